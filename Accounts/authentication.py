@@ -1,5 +1,12 @@
 from django.contrib.auth.backends import BaseBackend
 from django.contrib.auth import get_user_model
+from django.utils.functional import SimpleLazyObject
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
 
 UserModel = get_user_model()
 
@@ -18,4 +25,76 @@ class EmailBackend(BaseBackend):
         try:
             return UserModel.objects.get(pk=user_id)
         except UserModel.DoesNotExist:
-            return None
\ No newline at end of file
+            return None
+
+
+class ClaimsUser(SimpleLazyObject):
+    """
+    request.user for JWT requests. Identity, authentication and staff status are
+    answered from the access token's claims; any other attribute loads the real
+    user from the database on first use.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, token, load_user):
+        super().__init__(load_user)
+        self.__dict__['_token'] = token
+
+    def __bool__(self):
+        return True
+
+    @property
+    def pk(self):
+        return self.__dict__['_token'][api_settings.USER_ID_CLAIM]
+
+    id = pk
+
+    @property
+    def is_staff(self):
+        return bool(self.__dict__['_token'].get('is_staff', False))
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """Validates Bearer access tokens without touching the database; the user row is loaded lazily."""
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken("Token contained no recognizable user identification")
+        return ClaimsUser(validated_token, lambda: super(StatelessJWTAuthentication, self).get_user(validated_token))
+
+
+class StaffRefreshToken(RefreshToken):
+    """Refresh token whose access tokens carry the user's `is_staff` claim."""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token['is_staff'] = user.is_staff
+        return token
+
+
+def issue_jwt_pair(user):
+    refresh = StaffRefreshToken.for_user(user)
+    return {'access': str(refresh.access_token), 'refresh': str(refresh)}
+
+
+class StaffClaimRefreshSerializer(TokenRefreshSerializer):
+    """
+    Rotates refresh tokens like simplejwt's serializer, but re-reads the user so
+    a deactivated account cannot refresh and `is_staff` follows role changes.
+    """
+    token_class = StaffRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user = UserModel.objects.filter(pk=refresh[api_settings.USER_ID_CLAIM], is_active=True).first()
+        if user is None:
+            raise AuthenticationFailed("User not found or inactive.", code='user_inactive')
+
+        refresh.blacklist()
+        refresh['is_staff'] = user.is_staff
+        refresh.set_jti()
+        refresh.set_exp()
+        refresh.set_iat()
+        return {'access': str(refresh.access_token), 'refresh': str(refresh)}
@@ -0,0 +1,24 @@
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from Common.cache import PayloadCache
+from Server.models import Bookmark, BookHold, BookRental
+
+# UserInfoSerializer's document for CurrentUserView and VerifyTokenView, invalidated by Accounts.signals.
+profile_cache = PayloadCache('user-profile', settings.PROFILE_CACHE_TIMEOUT)
+
+
+def profile_timeout():
+    """Profiles never outlive the UTC day, since rentals turn late at UTC midnight."""
+    now = timezone.now()
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return max(1, min(settings.PROFILE_CACHE_TIMEOUT, int((midnight - now).total_seconds())))
+
+
+def book_readers(book_ids):
+    """Users whose profile embeds any of `book_ids`: through a rental, current or past, a hold or a bookmark."""
+    rentals, holds, bookmarks = (
+        model.objects.filter(book_id__in=book_ids).values_list('user_id', flat=True)
+        for model in (BookRental, BookHold, Bookmark)
+    )
+    return set(rentals.union(holds, bookmarks))
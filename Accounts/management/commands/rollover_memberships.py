@@ -0,0 +1,70 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DateField, ExpressionWrapper, F, Max, Min
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from Accounts.cache import profile_cache
+from Accounts.models import Membership
+
+BILLING_PERIOD = timedelta(days=30)
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the monthly membership cycle: deactivates memberships past their end date, then resets "
+        "monthly_books and advances recurrence for every membership whose billing period has ended. "
+        "Each membership is rolled over once per period, so repeated runs are safe."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Run as of this date (YYYY-MM-DD) instead of today.")
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        today = parse_date(options['date']) if options['date'] else timezone.localdate()
+        self.chunk_size = options['chunk_size']
+
+        expired = self.update_in_chunks(
+            Membership.objects.filter(active=True, end_date__lt=today),
+            active=False,
+        )
+        scheduled = self.update_in_chunks(
+            Membership.objects.filter(active=True, recurrence__isnull=True),
+            recurrence=self.shifted('start_date'),
+        )
+
+        # Members more than one period behind are caught up one period per pass.
+        rolled_over = 0
+        while True:
+            count = self.update_in_chunks(
+                Membership.objects.filter(active=True, recurrence__lte=today),
+                monthly_books=0,
+                recurrence=self.shifted('recurrence'),
+            )
+            if not count:
+                break
+            rolled_over += count
+
+        if expired or scheduled or rolled_over:
+            profile_cache.invalidate_all()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"As of {today}: deactivated {expired} expired membership(s), scheduled {scheduled} "
+            f"and rolled over {rolled_over} billing period(s)."
+        ))
+
+    def shifted(self, field):
+        return ExpressionWrapper(F(field) + BILLING_PERIOD, output_field=DateField())
+
+    def update_in_chunks(self, queryset, **changes):
+        """Applies `changes` with one UPDATE per primary-key window so no single statement locks the whole table."""
+        bounds = queryset.aggregate(first=Min('id'), last=Max('id'))
+        if bounds['first'] is None:
+            return 0
+
+        updated = 0
+        for start in range(bounds['first'], bounds['last'] + 1, self.chunk_size):
+            with transaction.atomic():
+                updated += queryset.filter(id__gte=start, id__lt=start + self.chunk_size).update(**changes)
+        return updated
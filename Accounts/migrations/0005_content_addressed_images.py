@@ -0,0 +1,20 @@
+# Generated by Django 5.1.1 on 2026-10-17 10:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Accounts', '0004_user_directory_indexes'),
+        ('Common', '0001_stored_images'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userimage',
+            name='stored',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='user_images', to='Common.storedimage'),
+        ),
+    ]
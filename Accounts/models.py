@@ -7,8 +7,12 @@ from django.utils import timezone
 from datetime import timedelta
 from django.conf import settings
 from django.db import models
-from Common.utils import convert_to_webp, create_user_icon
-from storages.backends.s3boto3 import S3Boto3Storage
+from django.contrib.postgres.indexes import OpClass
+from django.db.models.functions import Cast, Upper
+from Common.models import StoredImage
+from Common.storage import upload_files
+from Common.uploads import spool_upload
+from Common.utils import PLACEHOLDER_SIZE, encode_webp_variants, inline_webp
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, password, **extra_fields):
@@ -49,6 +53,15 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
 
     objects = CustomUserManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-joined_date', '-id'], name='customuser_joined_id_idx'),
+            # Match the UPPER(col::text) LIKE 'X%' that istartswith compiles to, for the directory's prefix search.
+            models.Index(OpClass(Upper(Cast('email', models.TextField())), name='text_pattern_ops'), name='customuser_email_prefix_idx'),
+            models.Index(OpClass(Upper(Cast('first_name', models.TextField())), name='text_pattern_ops'), name='customuser_first_prefix_idx'),
+            models.Index(OpClass(Upper(Cast('last_name', models.TextField())), name='text_pattern_ops'), name='customuser_last_prefix_idx'),
+        ]
+
     def __str__(self):
         return self.email
 
@@ -61,6 +74,8 @@ class UserImage(models.Model):
     user = models.OneToOneField(CustomUser, related_name="image", on_delete=models.CASCADE)
     image_url = models.URLField(blank=True, null=True)
     image_small = models.URLField(blank=True, null=True)
+    placeholder = models.TextField(blank=True)
+    stored = models.ForeignKey(StoredImage, related_name="user_images", on_delete=models.SET_NULL, blank=True, null=True)
 
     def clean_filename(self, filename):
         filename = filename.lower()
@@ -75,54 +90,40 @@ class UserImage(models.Model):
 
     def save(self, *args, **kwargs):
         image_file = kwargs.pop('image_file', None)
+        replaced = None
         if image_file:
-            if self.image_url:
-                self.delete_old_image()
-
-            clean_filename = self.clean_filename(image_file.name)
-            temp_image_path = f"/tmp/{clean_filename}"
-            temp_small_image_path = f"/tmp/{clean_filename}_small.webp"
-
-            try:
-                with open(temp_image_path, 'wb') as temp_image:
-                    temp_image.write(image_file.read())
-
-                webp_image_path = f"{temp_image_path}.webp"
-                convert_to_webp(temp_image_path, webp_image_path)
+            replaced = self.stored_id
+            self.store_upload(image_file)
 
-                create_user_icon(temp_image_path, temp_small_image_path)
-
-                s3_storage = S3Boto3Storage()
+        super(UserImage, self).save(*args, **kwargs)
+        if replaced:
+            StoredImage.objects.release(replaced)
+
+    def store_upload(self, image_file):
+        """
+        Reuses the stored variants of an identical avatar, otherwise encodes and
+        uploads both sizes and inlines a placeholder.
+        """
+        spool, sha256 = spool_upload(image_file)
+        with spool:
+            stored = StoredImage.objects.acquire(sha256, StoredImage.USER)
+            if stored is None:
+                clean_filename = self.clean_filename(image_file.name)
+                variants = encode_webp_variants(spool, {'image': None, 'small': 60, 'placeholder': PLACEHOLDER_SIZE})
+                self.placeholder = inline_webp(variants['placeholder'])
 
                 filename_without_extension = os.path.splitext(clean_filename)[0]
                 unique_suffix = str(uuid.uuid4())
 
-                s3_filename = f"users/{filename_without_extension}_{unique_suffix}.webp"
-                s3_small_filename = f"users/{filename_without_extension}_small_{unique_suffix}.webp"
-
-                with open(webp_image_path, 'rb') as webp_file:
-                    saved_path = s3_storage.save(s3_filename, webp_file)
-                    self.image_url = f'{settings.MEDIA_URL}{s3_filename}'
-
-                with open(temp_small_image_path, 'rb') as small_webp_file:
-                    small_saved_path = s3_storage.save(s3_small_filename, small_webp_file)
-                    self.image_small = f'{settings.MEDIA_URL}{s3_small_filename}'
-
-            except Exception as e:
-                print(f"Error while uploading image to S3: {str(e)}")
-
-            finally:
-                if os.path.exists(temp_image_path):
-                    os.remove(temp_image_path)
-                if os.path.exists(webp_image_path):
-                    os.remove(webp_image_path)
-                if os.path.exists(temp_small_image_path):
-                    os.remove(temp_small_image_path)
-
-        super(UserImage, self).save(*args, **kwargs)
-
-    def delete_old_image(self):
-        self.image_url = None
+                [(urls, error)] = upload_files([{
+                    'image': (f"users/{filename_without_extension}_{unique_suffix}.webp", variants['image']),
+                    'small': (f"users/{filename_without_extension}_small_{unique_suffix}.webp", variants['small']),
+                }])
+                if error:
+                    raise error
+                self.image_url, self.image_small = urls['image'], urls['small']
+                stored = StoredImage.objects.register(sha256, StoredImage.USER, self)
+        stored.copy_to(self)
 
 
 class Membership(models.Model):
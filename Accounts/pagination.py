@@ -0,0 +1,21 @@
+from rest_framework.exceptions import ValidationError
+from Common.pagination import KeysetPagination
+
+
+class UserDirectoryPagination(KeysetPagination):
+    """Always paginated; `sort` picks one of the directory orderings, each ending in id so cursors are unique."""
+    page_size = 50
+    sort_query_param = 'sort'
+    sort_orderings = {
+        'joined': ('-joined_date', '-id'),
+        'active_rental': ('-active_rentals', '-id'),
+        'late': ('-late_rentals', '-id'),
+    }
+    default_sort = 'joined'
+    always_paginate = True
+
+    def get_ordering(self, request, queryset, view=None):
+        sort = request.query_params.get(self.sort_query_param, self.default_sort)
+        if sort not in self.sort_orderings:
+            raise ValidationError({self.sort_query_param: f"Must be one of: {', '.join(self.sort_orderings)}."})
+        return self.sort_orderings[sort]
@@ -0,0 +1,111 @@
+from django.conf import settings
+from django.db.models import Count, Exists, IntegerField, OuterRef, Prefetch, Subquery, Value, prefetch_related_objects
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from Payments.models import Payment
+from Server.models import Book, Bookmark, BookHold, BookRental
+from .models import Membership
+
+
+def profile_prefetches():
+    """
+    Everything UserInfoSerializer and UserDetailSerializer read, loaded as a
+    fixed set of queries however many rentals, holds or bookmarks a user has.
+    """
+    books_with_images = Book.objects.prefetch_related('images')
+    return [
+        'image',
+        Prefetch('memberships', queryset=Membership.objects.order_by('pk').prefetch_related('transaction_history')),
+        Prefetch(
+            'rented_books',
+            queryset=BookRental.objects.order_by('-rental_date').prefetch_related(Prefetch('book', queryset=books_with_images)),
+            to_attr='profile_rentals',
+        ),
+        Prefetch(
+            'bookhold_set',
+            queryset=BookHold.objects.order_by('pk').prefetch_related(Prefetch('book', queryset=books_with_images)),
+            to_attr='profile_holds',
+        ),
+        Prefetch(
+            'bookmarks',
+            queryset=Bookmark.objects.order_by('pk').prefetch_related(Prefetch('book', queryset=Book.objects.with_catalog_data())),
+            to_attr='profile_bookmarks',
+        ),
+    ]
+
+
+def with_profile(queryset):
+    return queryset.prefetch_related(*profile_prefetches())
+
+
+def with_detail_profile(queryset):
+    """
+    The UserDetailSerializer variant of with_profile: history sections are
+    prefetched already capped at EMBEDDED_HISTORY_LIMIT rows per user, with
+    their totals annotated, so long-lived members cost no more than new ones.
+    Memberships come without their payments, which the detail view lists once
+    in transaction_history.
+    """
+    limit = settings.EMBEDDED_HISTORY_LIMIT
+    books_with_images = Book.objects.prefetch_related('images')
+    prefetches = [
+        prefetch for prefetch in profile_prefetches()
+        if getattr(prefetch, 'to_attr', None) != 'profile_rentals' and getattr(prefetch, 'prefetch_to', None) != 'memberships'
+    ]
+    return queryset.annotate(
+        book_history_count=count_per_user(BookRental.objects.all()),
+        membership_history_count=count_per_user(Membership.objects.all()),
+        transaction_history_count=count_per_user(Payment.objects.all()),
+    ).prefetch_related(
+        *prefetches,
+        Prefetch('memberships', queryset=Membership.objects.order_by('pk')),
+        Prefetch(
+            'rented_books',
+            queryset=BookRental.objects.order_by('-rental_date', '-id').prefetch_related(Prefetch('book', queryset=books_with_images))[:limit],
+            to_attr='recent_rentals',
+        ),
+        Prefetch(
+            'rented_books',
+            queryset=BookRental.objects.filter(return_date__isnull=True).order_by('-rental_date').prefetch_related(Prefetch('book', queryset=books_with_images)),
+            to_attr='profile_current_rentals',
+        ),
+        Prefetch('payment_set', queryset=Payment.objects.order_by('-created_at', '-id')[:limit], to_attr='recent_payments'),
+    )
+
+
+def load_user_profile(user):
+    """Prefetches the profile onto an already loaded user, such as request.user."""
+    prefetch_related_objects([user], *profile_prefetches())
+    return user
+
+
+def count_per_user(queryset, user_field='user'):
+    """A correlated COUNT(*) of `queryset` rows belonging to the outer user, 0 when there are none."""
+    counts = (
+        queryset.filter(**{user_field: OuterRef('pk')})
+        .order_by()
+        .values(user_field)
+        .annotate(count=Count('pk'))
+        .values('count')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def with_directory_summary(queryset):
+    """
+    Annotates the per-user counts shown in the staff directory. Each count is
+    its own aggregate subquery, so rentals, holds and bookmarks never multiply
+    each other the way joined COUNTs would.
+    """
+    # BookRental.late compares UTC dates, so "late" means due before today's UTC midnight.
+    today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    rentals = BookRental.objects.all()
+    return queryset.select_related('image').annotate(
+        has_membership=Exists(Membership.objects.filter(user=OuterRef('pk'), active=True)),
+        rental_count=count_per_user(rentals),
+        active_rentals=count_per_user(rentals.filter(is_active=True)),
+        reservations=count_per_user(rentals.filter(reserved=True)),
+        late_rentals=count_per_user(rentals.filter(return_date__isnull=True, due_date__lt=today)),
+        hold_count=count_per_user(BookHold.objects.all()),
+        bookmark_count=count_per_user(Bookmark.objects.all()),
+    )
@@ -2,8 +2,11 @@ from .models import UserImage, CustomUser, Membership
 from rest_framework import serializers
 from Payments.serializers import PaymentSerializer
 from Common.serializers import UserImageSerializer
-from Server.serializers import BookSerializer, BookImageSerializer
+from Common.storage import UploadError
+from Common.uploads import UploadRejected, check_image_upload
+from Server.serializers import BookCatalogSerializer, BookImageSerializer
 from Server.models import Book, BookRental, BookHold
+from django.conf import settings
 from django.contrib.auth import get_user_model, authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.utils.crypto import get_random_string
@@ -58,6 +61,15 @@ class CurrentMembershipSerializer(serializers.ModelSerializer):
         fields = ['start_date', 'end_date', 'monthly_books', 'active', 'recurrence', 'transaction_history']
 
 
+class MembershipSummarySerializer(serializers.ModelSerializer):
+    """A membership without its payments, for UserDetailSerializer, which lists them once, capped, in transaction_history."""
+    recurrence = serializers.DateField()
+
+    class Meta:
+        model = Membership
+        fields = ['start_date', 'end_date', 'monthly_books', 'active', 'recurrence']
+
+
 class BookRentalWithBookSerializer(serializers.ModelSerializer):
     book = serializers.SerializerMethodField()
 
@@ -97,6 +109,63 @@ class BookHoldWithBookSerializer(serializers.ModelSerializer):
         }
 
 
+def active_membership(user):
+    if 'memberships' in getattr(user, '_prefetched_objects_cache', {}):
+        return next((membership for membership in user.memberships.all() if membership.active), None)
+    return user.memberships.filter(active=True).first()
+
+
+def rental_history(user):
+    if hasattr(user, 'profile_rentals'):
+        return user.profile_rentals
+    return user.rented_books.all().order_by('-rental_date')
+
+
+def current_rentals(user):
+    if hasattr(user, 'profile_current_rentals'):
+        return user.profile_current_rentals
+    if hasattr(user, 'profile_rentals'):
+        return [rental for rental in user.profile_rentals if rental.return_date is None]
+    return user.rented_books.filter(return_date__isnull=True).order_by('-rental_date')
+
+
+def recent_rentals(user):
+    if hasattr(user, 'recent_rentals'):
+        return user.recent_rentals
+    if hasattr(user, 'profile_rentals'):
+        return user.profile_rentals[:settings.EMBEDDED_HISTORY_LIMIT]
+    return user.rented_books.order_by('-rental_date', '-id')[:settings.EMBEDDED_HISTORY_LIMIT]
+
+
+def recent_memberships(user):
+    memberships = sorted(user.memberships.all(), key=lambda membership: membership.pk, reverse=True)
+    return memberships[:settings.EMBEDDED_HISTORY_LIMIT]
+
+
+def recent_payments(user):
+    if hasattr(user, 'recent_payments'):
+        return user.recent_payments
+    return user.payment_set.order_by('-created_at', '-id')[:settings.EMBEDDED_HISTORY_LIMIT]
+
+
+def history_count(user, name, related):
+    """Total size of a capped history section, from the with_detail_profile annotation when present."""
+    count = getattr(user, f'{name}_count', None)
+    return related.count() if count is None else count
+
+
+def held_books(user):
+    if hasattr(user, 'profile_holds'):
+        return user.profile_holds
+    return BookHold.objects.filter(user=user).order_by('pk')
+
+
+def bookmarked_books(user):
+    if hasattr(user, 'profile_bookmarks'):
+        return [bookmark.book for bookmark in user.profile_bookmarks]
+    return Book.objects.filter(bookmarks__user=user).order_by('bookmarks__id')
+
+
 class UserInfoSerializer(serializers.ModelSerializer): 
     image = UserImageSerializer(required=False)
     membership = serializers.SerializerMethodField()
@@ -111,7 +180,7 @@ class UserInfoSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'email', 'joined_date']
 
     def get_membership(self, obj):
-        membership = obj.memberships.filter(active=True).first()
+        membership = active_membership(obj)
         if membership:
             return CurrentMembershipSerializer(membership).data
         return None
@@ -119,68 +188,91 @@ class UserInfoSerializer(serializers.ModelSerializer):
     def get_checked_out(self, obj):
         if obj.is_staff:
             return None
-
-        current_books = obj.rented_books.filter(return_date__isnull=True)
-        if current_books.exists():
-            return BookRentalWithBookSerializer(current_books, many=True).data
-        return []
+        return BookRentalWithBookSerializer(current_rentals(obj), many=True).data
 
     def get_on_hold(self, obj):
         if obj.is_staff:
-            held_books = BookHold.objects.filter(user=obj)
-            if held_books.exists():
-                return BookHoldWithBookSerializer(held_books, many=True).data
+            holds = held_books(obj)
+            if holds:
+                return BookHoldWithBookSerializer(holds, many=True).data
         return None
 
     def get_book_history(self, obj):
-        rental_history = obj.rented_books.all().order_by('-rental_date')
-        return BookRentalWithBookSerializer(rental_history, many=True).data
+        return BookRentalWithBookSerializer(rental_history(obj), many=True).data
 
     def get_bookmarked_books(self, obj):
-        bookmarked_books = Book.objects.filter(bookmarks__user=obj)
-        return BookSerializer(bookmarked_books, many=True).data
+        return BookCatalogSerializer(bookmarked_books(obj), many=True).data
 
 
 class UserDetailSerializer(serializers.ModelSerializer):
     image = UserImageSerializer(required=False)
     membership = serializers.SerializerMethodField()
     checked_out = serializers.SerializerMethodField()
-    membership_history = CurrentMembershipSerializer(many=True, read_only=True, source='memberships')
-    transaction_history = PaymentSerializer(many=True, read_only=True, source='payments')
+    membership_history = serializers.SerializerMethodField()
+    membership_history_count = serializers.SerializerMethodField()
+    transaction_history = serializers.SerializerMethodField()
+    transaction_history_count = serializers.SerializerMethodField()
     book_history = serializers.SerializerMethodField()
+    book_history_count = serializers.SerializerMethodField()
     on_hold = serializers.SerializerMethodField()
     bookmarked_books = serializers.SerializerMethodField()
 
     class Meta:
         model = CustomUser
-        fields = ['id', 'email', 'first_name', 'last_name', 'phone', 'image', 'is_staff', 'joined_date', 'membership', 'membership_history', 'transaction_history', 'checked_out', 'on_hold', 'book_history', 'bookmarked_books']
+        fields = ['id', 'email', 'first_name', 'last_name', 'phone', 'image', 'is_staff', 'joined_date', 'membership', 'membership_history', 'membership_history_count', 'transaction_history', 'transaction_history_count', 'checked_out', 'on_hold', 'book_history', 'book_history_count', 'bookmarked_books']
         read_only_fields = ['id', 'email', 'joined_date']
 
     def get_membership(self, obj):
-        membership = obj.memberships.filter(active=True).first()
+        membership = active_membership(obj)
         if membership:
-            return CurrentMembershipSerializer(membership).data
+            return MembershipSummarySerializer(membership).data
         return None
 
     def get_checked_out(self, obj):
-        current_books = obj.rented_books.filter(return_date__isnull=True)
-        if current_books.exists():
-            return BookRentalWithBookSerializer(current_books, many=True).data
-        return []
+        return BookRentalWithBookSerializer(current_rentals(obj), many=True).data
 
     def get_on_hold(self, obj):
-        held_books = BookHold.objects.filter(user=obj)
-        if held_books.exists():
-            return BookHoldWithBookSerializer(held_books, many=True).data
+        holds = held_books(obj)
+        if holds:
+            return BookHoldWithBookSerializer(holds, many=True).data
         return None
 
+    def get_membership_history(self, obj):
+        return MembershipSummarySerializer(recent_memberships(obj), many=True).data
+
+    def get_membership_history_count(self, obj):
+        return history_count(obj, 'membership_history', obj.memberships)
+
+    def get_transaction_history(self, obj):
+        return PaymentSerializer(recent_payments(obj), many=True).data
+
+    def get_transaction_history_count(self, obj):
+        return history_count(obj, 'transaction_history', obj.payment_set)
+
     def get_book_history(self, obj):
-        rental_history = obj.rented_books.all().order_by('-rental_date')
-        return BookRentalWithBookSerializer(rental_history, many=True).data
+        """The most recent rentals only; the full history is paginated at users/<id>/rentals/."""
+        return BookRentalWithBookSerializer(recent_rentals(obj), many=True).data
+
+    def get_book_history_count(self, obj):
+        return history_count(obj, 'book_history', obj.rented_books)
 
     def get_bookmarked_books(self, obj):
-        bookmarked_books = Book.objects.filter(bookmarks__user=obj)
-        return BookSerializer(bookmarked_books, many=True).data
+        return BookCatalogSerializer(bookmarked_books(obj), many=True).data
+
+
+class UserDirectorySerializer(serializers.ModelSerializer):
+    image = UserImageSerializer(read_only=True)
+    has_membership = serializers.BooleanField(read_only=True)
+    rental_count = serializers.IntegerField(read_only=True)
+    active_rentals = serializers.IntegerField(read_only=True)
+    reservations = serializers.IntegerField(read_only=True)
+    late_rentals = serializers.IntegerField(read_only=True)
+    hold_count = serializers.IntegerField(read_only=True)
+    bookmark_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = CustomUser
+        fields = ['id', 'email', 'first_name', 'last_name', 'phone', 'image', 'is_staff', 'archived', 'joined_date', 'has_membership', 'rental_count', 'active_rentals', 'reservations', 'late_rentals', 'hold_count', 'bookmark_count']
 
 
 class UserProfileUpdateSerializer(serializers.ModelSerializer):
@@ -202,6 +294,13 @@ class UserProfileUpdateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("First name cannot be empty.")
         return value
 
+    def validate_image_file(self, value):
+        try:
+            check_image_upload(value)
+        except UploadRejected as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
     def update(self, instance, validated_data):
         remove_image = validated_data.pop('remove_image', False)
         image_file = validated_data.pop('image_file', None)
@@ -222,7 +321,10 @@ class UserProfileUpdateSerializer(serializers.ModelSerializer):
             else:
                 user_image = UserImage(user=instance)
 
-            user_image.save(image_file=image_file)
+            try:
+                user_image.save(image_file=image_file)
+            except (UploadError, UploadRejected) as e:
+                raise serializers.ValidationError({"image_file": [str(e)]})
 
         return instance
 
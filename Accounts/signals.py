@@ -1,11 +1,63 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
+from Common.models import StoredImage
+from Payments.models import Payment
+from Server.cache import books_changed
+from Server.models import Bookmark, BookHold, BookRental
+from .cache import book_readers, profile_cache
+from .models import Membership, UserImage
 
 User = get_user_model()
 
 @receiver(post_save, sender=User)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
-    if created:
-        Token.objects.create(user=instance)
\ No newline at end of file
+    if created and settings.LEGACY_AUTH_TOKENS:
+        Token.objects.create(user=instance)
+
+
+@receiver(post_delete, sender=UserImage)
+def release_stored_user_image(sender, instance, **kwargs):
+    if instance.stored_id:
+        StoredImage.objects.release(instance.stored_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_own_profile(sender, instance, **kwargs):
+    profile_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=UserImage)
+@receiver(post_delete, sender=UserImage)
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+@receiver(post_save, sender=BookRental)
+@receiver(post_delete, sender=BookRental)
+@receiver(post_save, sender=BookHold)
+@receiver(post_delete, sender=BookHold)
+@receiver(post_save, sender=Bookmark)
+@receiver(post_delete, sender=Bookmark)
+def invalidate_owner_profile(sender, instance, **kwargs):
+    profile_cache.invalidate(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Membership.transaction_history.through)
+def invalidate_membership_payments_profile(sender, instance, action, **kwargs):
+    if action.startswith('post_'):
+        # Forward the instance is a membership, reverse a payment; both belong to the user.
+        profile_cache.invalidate(instance.user_id)
+
+
+@receiver(books_changed)
+def invalidate_book_readers_profiles(sender, book_ids, **kwargs):
+    if book_ids is None:
+        profile_cache.invalidate_all()
+    elif book_ids:
+        # Looked up once the change commits, outside the writer's transaction.
+        transaction.on_commit(lambda: profile_cache.invalidate_many(book_readers(book_ids)))
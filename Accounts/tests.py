@@ -1,3 +1,435 @@
-from django.test import TestCase
+import base64
+import json
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from Common.models import StoredImage
+from Common.testing import LocalMediaMixin
+from Payments.models import Payment
+from Server.models import Book, Bookmark, BookHold, BookImage, BookRating, BookRental
+from .authentication import StatelessJWTAuthentication
+from .cache import profile_timeout
+from .models import CustomUser, Membership, UserImage
+from .profiles import load_user_profile, with_detail_profile, with_profile
+from .serializers import UserDetailSerializer, UserInfoSerializer
 
-# Create your tests here.
+
+class RolloverMembershipsTests(TestCase):
+    def create_membership(self, **fields):
+        index = Membership.objects.count()
+        user = CustomUser.objects.create_user(email=f"member{index}@example.com", password="pass", first_name="Member")
+        membership = Membership.objects.create(user=user, monthly_books=3)
+        Membership.objects.filter(pk=membership.pk).update(**fields)
+        return membership
+
+    def rollover(self, day):
+        call_command('rollover_memberships', '--date', day.isoformat(), '--chunk-size', '2', stdout=StringIO())
+
+    def test_rollover_is_idempotent_per_period(self):
+        due = self.create_membership(recurrence=date(2025, 3, 1))
+        behind = self.create_membership(recurrence=date(2025, 1, 15))
+        upcoming = self.create_membership(recurrence=date(2025, 3, 20))
+        expired = self.create_membership(recurrence=date(2025, 3, 20), end_date=date(2025, 2, 28))
+
+        for _ in range(2):
+            self.rollover(date(2025, 3, 1))
+
+        due.refresh_from_db()
+        self.assertEqual((due.monthly_books, due.recurrence), (0, date(2025, 3, 31)))
+        behind.refresh_from_db()
+        self.assertEqual((behind.monthly_books, behind.recurrence), (0, date(2025, 1, 15) + timedelta(days=60)))
+        upcoming.refresh_from_db()
+        self.assertEqual((upcoming.monthly_books, upcoming.recurrence), (3, date(2025, 3, 20)))
+        expired.refresh_from_db()
+        self.assertFalse(expired.active)
+
+    def test_missing_recurrence_is_scheduled_from_start_date(self):
+        membership = self.create_membership(recurrence=None, start_date=date(2025, 2, 10))
+        self.rollover(date(2025, 3, 1))
+
+        membership.refresh_from_db()
+        self.assertEqual((membership.monthly_books, membership.recurrence), (3, date(2025, 3, 12)))
+
+
+class UserProfileLoaderTests(TestCase):
+    def setUp(self):
+        self.member = CustomUser.objects.create_user(email="member@example.com", password="pass", first_name="Member")
+        self.staff = CustomUser.objects.create_user(email="staff@example.com", password="pass", first_name="Staff", is_staff=True)
+        UserImage.objects.create(user=self.member, image_url="https://example.com/member.webp")
+        membership = Membership.objects.create(user=self.member, monthly_books=2)
+        Membership.objects.create(user=self.member, active=False)
+        for i in range(2):
+            payment = Payment.objects.create(user=self.member, stripe_payment_intent_id=f"pi_{i}", amount=35, status="succeeded", item="membership")
+            membership.transaction_history.add(payment)
+        self.add_activity(3)
+
+    def add_activity(self, count):
+        offset = Book.objects.count()
+        now = timezone.now()
+        for i in range(offset, offset + count):
+            book = Book.objects.create(title=f"Book {i}", author="Author", inventory=3)
+            BookImage.objects.create(book=book, image_url=f"https://example.com/{i}.webp")
+            BookRating.objects.create(book=book, user=self.member, rating=4)
+            BookRental.objects.create(
+                book=book, user=self.member, reserved=False,
+                rental_date=now - timedelta(days=i + 1), return_date=now - timedelta(days=i),
+            )
+            Bookmark.objects.create(book=book, user=self.member)
+            BookHold.objects.create(book=book, user=self.staff)
+        BookRental.objects.filter(user=self.member, return_date__isnull=True).delete()
+        BookRental.objects.create(book=book, user=self.member, rental_date=now)
+
+    def render(self, serializer_class, user):
+        return JSONRenderer().render(serializer_class(user).data)
+
+    def test_loaded_profiles_are_byte_identical(self):
+        for serializer_class in (UserInfoSerializer, UserDetailSerializer):
+            for email in ("member@example.com", "staff@example.com"):
+                expected = self.render(serializer_class, CustomUser.objects.get(email=email))
+                loaded = self.render(serializer_class, with_profile(CustomUser.objects.filter(email=email)).get())
+                self.assertEqual(expected, loaded)
+                self.assertEqual(expected, self.render(serializer_class, load_user_profile(CustomUser.objects.get(email=email))))
+
+        for email in ("member@example.com", "staff@example.com"):
+            expected = self.render(UserDetailSerializer, CustomUser.objects.get(email=email))
+            self.assertEqual(expected, self.render(UserDetailSerializer, with_detail_profile(CustomUser.objects.filter(email=email)).get()))
+
+    def count_profile_queries(self, email):
+        user = CustomUser.objects.get(email=email)
+        with CaptureQueriesContext(connection) as context:
+            self.render(UserInfoSerializer, load_user_profile(user))
+        return len(context.captured_queries)
+
+    def test_profile_query_budget(self):
+        member_queries = self.count_profile_queries("member@example.com")
+        staff_queries = self.count_profile_queries("staff@example.com")
+        self.assertLessEqual(member_queries, 12)
+
+        self.add_activity(5)
+        self.assertEqual(self.count_profile_queries("member@example.com"), member_queries)
+        self.assertEqual(self.count_profile_queries("staff@example.com"), staff_queries)
+
+
+class UserDirectoryTests(TestCase):
+    def setUp(self):
+        self.staff = CustomUser.objects.create_user(email="staff@example.com", password="pass", first_name="Staff", is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        self.book = Book.objects.create(title="Book", author="Author", inventory=10)
+
+        self.alice = CustomUser.objects.create_user(email="alice@example.com", password="pass", first_name="Alice", last_name="Martin")
+        self.bob = CustomUser.objects.create_user(email="bob@example.com", password="pass", first_name="Bob", last_name="Aubert")
+        self.carol = CustomUser.objects.create_user(email="carol@example.com", password="pass", first_name="Carol")
+        Membership.objects.create(user=self.alice)
+
+        now = timezone.now()
+        BookRental.objects.create(book=self.book, user=self.alice, reserved=False, is_active=True, rental_date=now)
+        BookRental.objects.create(book=self.book, user=self.bob, reserved=False, is_active=True, rental_date=now - timedelta(days=10))
+        BookRental.objects.create(book=self.book, user=self.bob, reserved=False, is_active=True, rental_date=now - timedelta(days=1))
+        BookRental.objects.create(book=self.book, user=self.bob, reserved=False, rental_date=now - timedelta(days=30), return_date=now - timedelta(days=25))
+        for i in range(3):
+            Bookmark.objects.create(book=Book.objects.create(title=f"Bookmarked {i}", author="Author"), user=self.alice)
+
+    def get(self, url=None, **params):
+        response = self.client.get(url or reverse('all-users'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_rows_are_compact_counts(self):
+        rows = {row['email']: row for row in self.get()['results']}
+        self.assertEqual(set(rows), {"staff@example.com", "alice@example.com", "bob@example.com", "carol@example.com"})
+        self.assertEqual(
+            {key: rows["bob@example.com"][key] for key in ('rental_count', 'active_rentals', 'late_rentals', 'bookmark_count', 'has_membership')},
+            {'rental_count': 3, 'active_rentals': 2, 'late_rentals': 1, 'bookmark_count': 0, 'has_membership': False},
+        )
+        self.assertEqual(rows["alice@example.com"]['bookmark_count'], 3)
+        self.assertTrue(rows["alice@example.com"]['has_membership'])
+        self.assertNotIn('book_history', rows["alice@example.com"])
+
+    def test_prefix_search_on_email_and_names(self):
+        self.assertEqual([row['email'] for row in self.get(q='ALI')['results']], ["alice@example.com"])
+        self.assertEqual([row['email'] for row in self.get(q='aub')['results']], ["bob@example.com"])
+        self.assertEqual(self.get(q='lice')['results'], [])
+
+    def test_sorts_walk_every_user_once(self):
+        for sort in ('joined', 'active_rental', 'late'):
+            data = self.get(sort=sort, page_size=1)
+            emails = [row['email'] for row in data['results']]
+            while data['next']:
+                data = self.get(data['next'])
+                emails.extend(row['email'] for row in data['results'])
+            self.assertEqual(len(emails), 4)
+            if sort == 'active_rental':
+                self.assertEqual(emails[:2], ["bob@example.com", "alice@example.com"])
+            if sort == 'late':
+                self.assertEqual(emails[0], "bob@example.com")
+
+    def test_invalid_sort_and_non_staff(self):
+        self.assertEqual(self.client.get(reverse('all-users'), {'sort': 'email'}).status_code, 400)
+        self.client.force_authenticate(self.alice)
+        self.assertEqual(self.client.get(reverse('all-users')).status_code, 403)
+
+    def test_query_count_is_constant(self):
+        with CaptureQueriesContext(connection) as context:
+            self.get()
+        self.assertEqual(len(context.captured_queries), 1)
+
+
+@override_settings(EMBEDDED_HISTORY_LIMIT=2)
+class UserHistoryTests(TestCase):
+    def setUp(self):
+        self.staff = CustomUser.objects.create_user(email="staff@example.com", password="pass", first_name="Staff", is_staff=True)
+        self.member = CustomUser.objects.create_user(email="member@example.com", password="pass", first_name="Member")
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        Membership.objects.create(user=self.member, active=False)
+        Membership.objects.create(user=self.member)
+        now = timezone.now()
+        for i in range(5):
+            book = Book.objects.create(title=f"Book {i}", author="Author", inventory=2)
+            BookRental.objects.create(
+                book=book, user=self.member, reserved=False,
+                rental_date=now - timedelta(days=30 - i), return_date=now - timedelta(days=29 - i),
+            )
+            Payment.objects.create(user=self.member, stripe_payment_intent_id=f"pi_{i}", amount=35, status="succeeded", item=f"item {i}")
+        self.open_rental = BookRental.objects.create(book=book, user=self.member, reserved=False, is_active=True, rental_date=now - timedelta(days=60))
+
+    def test_detail_sections_are_capped_with_totals(self):
+        data = self.client.get(reverse('specific-user', args=[self.member.id])).data
+        self.assertEqual([rental['book']['title'] for rental in data['book_history']], ["Book 4", "Book 3"])
+        self.assertEqual(data['book_history_count'], 6)
+        self.assertEqual([payment['item'] for payment in data['transaction_history']], ["item 4", "item 3"])
+        self.assertEqual(data['transaction_history_count'], 5)
+        self.assertEqual([membership['active'] for membership in data['membership_history']], [True, False])
+        self.assertEqual(data['membership_history_count'], 2)
+        # Open rentals are listed even when older than the embedded history.
+        self.assertEqual(len(data['checked_out']), 1)
+
+    def test_membership_payments_are_not_embedded_uncapped(self):
+        membership = Membership.objects.get(user=self.member, active=True)
+        membership.transaction_history.add(*Payment.objects.filter(user=self.member))
+        data = self.client.get(reverse('specific-user', args=[self.member.id])).data
+        self.assertNotIn('transaction_history', data['membership'])
+        self.assertTrue(all('transaction_history' not in entry for entry in data['membership_history']))
+        self.assertEqual([payment['item'] for payment in data['transaction_history']], ["item 4", "item 3"])
+
+    def test_rentals_endpoint_pages_through_full_history(self):
+        response = self.client.get(reverse('user-rental-history', args=[self.member.id]), {'page_size': 4})
+        titles = [rental['book']['title'] for rental in response.data['results']]
+        response = self.client.get(response.data['next'])
+        titles += [rental['book']['title'] for rental in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(titles, ["Book 4", "Book 3", "Book 2", "Book 1", "Book 0", "Book 4"])
+
+
+@override_settings(JWT_AUTH_ENABLED=True)
+class JWTAuthenticationTests(TestCase):
+    def setUp(self):
+        # Views read their authentication classes from DRF settings at import time.
+        patcher = mock.patch.object(APIView, 'authentication_classes', [StatelessJWTAuthentication, TokenAuthentication])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.staff = CustomUser.objects.create_user(email="staff@example.com", password="pass", first_name="Staff", is_staff=True)
+        self.member = CustomUser.objects.create_user(email="member@example.com", password="pass", first_name="Member")
+        self.client = APIClient()
+
+    def login(self, email):
+        response = self.client.post(reverse('login'), {'email': email, 'password': "pass"})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_login_issues_both_token_kinds(self):
+        data = self.login("staff@example.com")
+        self.assertEqual(Token.objects.get(user=self.staff).key, data['token'])
+        access = AccessToken(data['access'])
+        self.assertEqual((access['user_id'], access['is_staff']), (self.staff.id, True))
+        self.assertEqual(data['user']['email'], "staff@example.com")
+
+    def test_staff_check_needs_no_queries(self):
+        staff_access, member_access = self.login("staff@example.com")['access'], self.login("member@example.com")['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {staff_access}")
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(reverse('verify-staff')).status_code, 200)
+        self.assertEqual(len(context.captured_queries), 0)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {member_access}")
+        self.assertEqual(self.client.get(reverse('verify-staff')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('current-user')).data['email'], "member@example.com")
+
+    def test_legacy_tokens_still_work(self):
+        token = self.login("staff@example.com")['token']
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+        self.assertEqual(self.client.get(reverse('verify-staff')).status_code, 200)
+
+    def test_refresh_rotates_and_denylists_the_old_token(self):
+        refresh = self.login("member@example.com")['refresh']
+        response = self.client.post(reverse('token-refresh'), {'refresh': refresh})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data['refresh'], refresh)
+        self.assertEqual(self.client.post(reverse('token-refresh'), {'refresh': refresh}).status_code, 401)
+
+        CustomUser.objects.filter(pk=self.member.pk).update(is_staff=True)
+        rotated = self.client.post(reverse('token-refresh'), {'refresh': response.data['refresh']}).data
+        self.assertTrue(AccessToken(rotated['access'])['is_staff'])
+
+    def test_logout_denylists_refresh_token(self):
+        refresh = self.login("member@example.com")['refresh']
+        self.assertEqual(self.client.post(reverse('logout'), {'refresh': refresh}).status_code, 200)
+        self.assertFalse(Token.objects.filter(user=self.member).exists())
+        self.assertEqual(self.client.post(reverse('token-refresh'), {'refresh': refresh}).status_code, 401)
+
+    def test_logout_follows_the_configured_user_id_claim(self):
+        with mock.patch.object(jwt_settings, 'USER_ID_CLAIM', 'uid'):
+            refresh = self.login("member@example.com")['refresh']
+            self.assertEqual(self.client.post(reverse('logout'), {'refresh': refresh}).status_code, 200)
+        self.assertFalse(Token.objects.filter(user=self.member).exists())
+
+    @override_settings(LEGACY_AUTH_TOKENS=False)
+    def test_jwt_only_mode_skips_token_table(self):
+        CustomUser.objects.create_user(email="new@example.com", password="pass", first_name="New")
+        data = self.login("new@example.com")
+        self.assertNotIn('token', data)
+        self.assertFalse(Token.objects.filter(user__email="new@example.com").exists())
+
+
+class ProfileCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(APIView, 'authentication_classes', [StatelessJWTAuthentication])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.member = CustomUser.objects.create_user(email="member@example.com", password="pass", first_name="Member")
+        self.other = CustomUser.objects.create_user(email="other@example.com", password="pass", first_name="Other")
+        self.membership = Membership.objects.create(user=self.member, active=True)
+        self.rented = Book.objects.create(title="Rented", author="Author", inventory=3)
+        self.bookmarked = Book.objects.create(title="Bookmarked", author="Author", inventory=3)
+        self.unrelated = Book.objects.create(title="Unrelated", author="Author", inventory=3)
+        BookRental.objects.create(user=self.member, book=self.rented, is_active=True)
+        Bookmark.objects.create(user=self.member, book=self.bookmarked)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.member)}")
+
+    def fetch(self):
+        return self.client.get(reverse('current-user'))
+
+    def test_repeat_load_is_one_cache_read(self):
+        first = self.fetch()
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            again = self.fetch()
+            verified = self.client.get(reverse('token-verify'))
+        self.assertEqual((again['X-Cache'], verified['X-Cache']), ('HIT', 'HIT'))
+        self.assertEqual(again.json(), first.json())
+        self.assertEqual(verified.json()['user_info'], first.json())
+
+    def test_changes_invalidate_after_commit(self):
+        payment = Payment.objects.create(user=self.member, stripe_payment_intent_id="pi_1", amount=5, status="succeeded", item="Membership")
+        staff_client = APIClient()
+        staff_client.force_authenticate(CustomUser.objects.create_user(email="staff@example.com", password="pass", first_name="Staff", is_staff=True))
+        changes = {
+            'own rental': lambda: BookRental.objects.create(user=self.member, book=self.unrelated, reserved=True),
+            'own hold': lambda: BookHold.objects.create(user=self.member, book=self.unrelated),
+            'bookmark': lambda: Bookmark.objects.filter(user=self.member).delete(),
+            'membership': lambda: self.membership.save(),
+            'payment': lambda: Payment.objects.create(user=self.member, stripe_payment_intent_id="pi_2", amount=5, status="succeeded", item="Book"),
+            'membership payments': lambda: self.membership.transaction_history.add(payment),
+            'image': lambda: UserImage.objects.create(user=self.member, image_url="https://example.com/me.webp"),
+            'user': lambda: CustomUser.objects.filter(pk=self.member.pk).get().save(),
+            'book in history': lambda: BookRental.objects.create(user=self.other, book=self.rented, reserved=True),
+            'rating on held book': lambda: BookRating.objects.create(user=self.other, book=self.unrelated, rating=5),
+            'monthly reset': lambda: staff_client.post(reverse('reset-free-books')),
+        }
+        for name, change in changes.items():
+            self.fetch()
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            response = self.fetch()
+            self.assertEqual(response['X-Cache'], 'MISS', name)
+            expected = JSONRenderer().render(UserInfoSerializer(load_user_profile(CustomUser.objects.get(pk=self.member.pk))).data)
+            self.assertEqual(response.json(), json.loads(expected), name)
+
+    def test_unrelated_changes_keep_the_cached_profile(self):
+        self.fetch()
+        with self.captureOnCommitCallbacks(execute=True):
+            Bookmark.objects.create(user=self.other, book=self.unrelated)
+            self.unrelated.title = "Renamed"
+            self.unrelated.save()
+        self.assertEqual(self.fetch()['X-Cache'], 'HIT')
+
+    def test_profiles_expire_at_utc_midnight(self):
+        late_evening = timezone.now().replace(hour=23, minute=59, second=30, microsecond=0)
+        with mock.patch('Accounts.cache.timezone.now', return_value=late_evening):
+            self.assertEqual(profile_timeout(), 30)
+        with mock.patch('Accounts.cache.timezone.now', return_value=late_evening.replace(hour=8)):
+            self.assertEqual(profile_timeout(), settings.PROFILE_CACHE_TIMEOUT)
+
+
+class ProfileImageUploadTests(LocalMediaMixin, TestCase):
+    def setUp(self):
+        self.member = CustomUser.objects.create_user(email="member@example.com", password="pass", first_name="Member")
+        self.client = APIClient()
+        self.client.force_authenticate(self.member)
+
+    def update_profile(self, name):
+        buffer = BytesIO()
+        Image.new('RGB', (200, 200), 'green').save(buffer, 'PNG')
+        return self.client.patch(reverse('update-profile'), {
+            'first_name': "Member", 'image_file': SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png'),
+        }, format='multipart')
+
+    def test_uploads_both_variants(self):
+        storage = self.use_local_media()
+        response = self.update_profile("me.png")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(storage.exists(response.data['image']['image_small'].split(settings.MEDIA_URL, 1)[1]))
+        placeholder = response.data['image']['placeholder'].split('data:image/webp;base64,', 1)[1]
+        with Image.open(BytesIO(base64.b64decode(placeholder))) as inline:
+            self.assertEqual(inline.size, (20, 20))
+
+    def test_upload_failure_is_reported(self):
+        self.use_local_media('Common.testing.FlakyStorage')
+        response = self.update_profile("flaky.png")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("connection reset", response.data['image_file'][0])
+        self.assertFalse(UserImage.objects.filter(user=self.member).exists())
+
+    def test_oversized_avatar_is_rejected(self):
+        self.use_local_media()
+        with self.settings(MAX_IMAGE_UPLOAD_SIZE=128):
+            response = self.update_profile("big.png")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("larger than", response.data['image_file'][0])
+        self.assertFalse(UserImage.objects.filter(user=self.member).exists())
+
+    def test_reuploading_same_avatar_skips_encode_and_upload(self):
+        self.use_local_media()
+        first = self.update_profile("me.png").data['image']
+        uploaded = self.media_files()
+        with mock.patch('Accounts.models.encode_webp_variants') as encode:
+            again = self.update_profile("me_again.png").data['image']
+        encode.assert_not_called()
+        self.assertEqual(again['image_url'], first['image_url'])
+        self.assertEqual(self.media_files(), uploaded)
+        self.assertEqual(StoredImage.objects.get().ref_count, 1)
+
+        self.client.patch(reverse('update-profile'), {'remove_image': True}, format='multipart')
+        stored = StoredImage.objects.get()
+        self.assertEqual(stored.ref_count, 0)
+        self.assertIsNotNone(stored.released_at)
@@ -1,11 +1,12 @@
 from django.urls import path
-from .views import UserRegistrationView, VerifyTokenView, LogoutView, CustomObtainAuthToken, PasswordChangeView, PasswordResetRequestView, PasswordResetConfirmView, PasswordResetView, CreateStaffUserView, AllUsersView, SpecificUserView, CurrentUserView, UpdateProfileView, MembershipInfoView, CreateMembershipView, ResetMonthlyBooksView, VerifyStaffView
+from .views import UserRegistrationView, VerifyTokenView, LogoutView, CustomObtainAuthToken, JWTRefreshView, PasswordChangeView, PasswordResetRequestView, PasswordResetConfirmView, PasswordResetView, CreateStaffUserView, AllUsersView, SpecificUserView, UserRentalHistoryView, CurrentUserView, UpdateProfileView, MembershipInfoView, CreateMembershipView, ResetMonthlyBooksView, VerifyStaffView
 from rest_framework.authtoken.views import obtain_auth_token 
 
 urlpatterns = [
     path('register/', UserRegistrationView.as_view(), name='register'),
     path('login/', CustomObtainAuthToken.as_view(), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
+    path('token/refresh/', JWTRefreshView.as_view(), name='token-refresh'),
     path('token/verify/', VerifyTokenView.as_view(), name='token-verify'),
     path('password/change/', PasswordChangeView.as_view(), name='password-change'),
     path('password/reset/', PasswordResetRequestView.as_view(), name='password-reset-request'),
@@ -14,6 +15,7 @@ urlpatterns = [
     path('staff/create/', CreateStaffUserView.as_view(), name='create-staff-user'),
     path('users/all/', AllUsersView.as_view(), name='all-users'),
     path('users/<int:id>/', SpecificUserView.as_view(), name='specific-user'),
+    path('users/<int:id>/rentals/', UserRentalHistoryView.as_view(), name='user-rental-history'),
     path('users/me/', CurrentUserView.as_view(), name='current-user'),
     path('users/update-profile/', UpdateProfileView.as_view(), name='update-profile'),
     path('users/membership/', MembershipInfoView.as_view(), name='membership-info'),
@@ -2,16 +2,25 @@ import stripe
 from django.conf import settings
 from django.shortcuts import render
 from rest_framework import generics, permissions, status, permissions
-from .serializers import UserRegistrationSerializer, UserInfoSerializer, UserDetailSerializer, UserProfileUpdateSerializer, CustomAuthTokenSerializer, PasswordChangeSerializer, PasswordResetRequestSerializer, PasswordResetConfirmSerializer, PasswordResetSerializer, StaffUserRegistrationSerializer, CreateMembershipSerializer
+from .serializers import BookRentalWithBookSerializer, UserRegistrationSerializer, UserInfoSerializer, UserDetailSerializer, UserDirectorySerializer, UserProfileUpdateSerializer, CustomAuthTokenSerializer, PasswordChangeSerializer, PasswordResetRequestSerializer, PasswordResetConfirmSerializer, PasswordResetSerializer, StaffUserRegistrationSerializer, CreateMembershipSerializer
 from django.contrib.auth import get_user_model
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
-from rest_framework.authentication import TokenAuthentication
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenRefreshView
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from django.db.models import Q
+from .authentication import issue_jwt_pair
+from .cache import profile_cache, profile_timeout
 from .models import Membership
+from .pagination import UserDirectoryPagination
+from .profiles import load_user_profile, with_detail_profile, with_directory_summary
 from Payments.models import Payment
+from Server.pagination import RentalHistoryPagination
 
 User = get_user_model()
 stripe.api_key = settings.STRIPE_SECRET_KEY
@@ -21,16 +30,23 @@ class IsStaffPermission(permissions.BasePermission):
         return request.user.is_authenticated and request.user.is_staff
 
 
+def cached_profile(user):
+    """
+    The user's UserInfoSerializer document and whether it came from profile_cache.
+    A hit reads only the cache: with stateless JWTs the user is never loaded.
+    """
+    return profile_cache.get(user.pk, lambda: dict(UserInfoSerializer(load_user_profile(user)).data), profile_timeout())
+
+
 class VerifyTokenView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        user = request.user
-        user_data = UserInfoSerializer(user).data
+        user_data, hit = cached_profile(request.user)
         return Response({
             "detail": "Token is valid.",
             "user_info": user_data
-        }, status=status.HTTP_200_OK)
+        }, status=status.HTTP_200_OK, headers={'X-Cache': 'HIT' if hit else 'MISS'})
 
 
 class UserRegistrationView(generics.CreateAPIView):
@@ -59,34 +75,64 @@ class CustomObtainAuthToken(ObtainAuthToken):
         serializer = self.serializer_class(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
-        token, created = Token.objects.get_or_create(user=user)
-        
-        user_data = UserInfoSerializer(user).data
-        
-        return Response({
-            'token': token.key,
-            'user': user_data
-        }, status=status.HTTP_200_OK)
+        data = {}
+        if settings.LEGACY_AUTH_TOKENS:
+            token, created = Token.objects.get_or_create(user=user)
+            data['token'] = token.key
+        if settings.JWT_AUTH_ENABLED:
+            data.update(issue_jwt_pair(user))
+
+        data['user'] = UserInfoSerializer(load_user_profile(user)).data
+
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class JWTRefreshView(TokenRefreshView):
+    """Exchanges a refresh token for a new access token and a rotated refresh token; the old one is denylisted."""
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
 
 
 class AllUsersView(generics.ListAPIView):
-    queryset = User.objects.all()
-    serializer_class = UserInfoSerializer
+    serializer_class = UserDirectorySerializer
     permission_classes = [IsStaffPermission]
+    pagination_class = UserDirectoryPagination
+
+    def get_queryset(self):
+        queryset = with_directory_summary(User.objects.all())
+        query = self.request.query_params.get('q', '').strip()
+        if query:
+            queryset = queryset.filter(
+                Q(email__istartswith=query) | Q(first_name__istartswith=query) | Q(last_name__istartswith=query)
+            )
+        return queryset
 
 
 class SpecificUserView(generics.RetrieveAPIView):
-    queryset = User.objects.all()
     serializer_class = UserDetailSerializer
     permission_classes = [IsStaffPermission]
     lookup_field = 'id'
 
+    def get_queryset(self):
+        return with_detail_profile(User.objects.all())
+
+
+class UserRentalHistoryView(generics.ListAPIView):
+    serializer_class = BookRentalWithBookSerializer
+    pagination_class = RentalHistoryPagination
+    permission_classes = [IsStaffPermission]
+
+    def get_queryset(self):
+        user = generics.get_object_or_404(User, id=self.kwargs['id'])
+        return user.rented_books.select_related('book').prefetch_related('book__images')
+
 
 class CurrentUserView(generics.RetrieveAPIView):
     serializer_class = UserInfoSerializer
 
-    def get_object(self):
-        return self.request.user
+    def retrieve(self, request, *args, **kwargs):
+        user_data, hit = cached_profile(request.user)
+        return Response(user_data, headers={'X-Cache': 'HIT' if hit else 'MISS'})
 
 
 class UpdateProfileView(generics.UpdateAPIView):
@@ -103,7 +149,7 @@ class UpdateProfileView(generics.UpdateAPIView):
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
 
-        return Response(UserInfoSerializer(instance).data, status=status.HTTP_200_OK)
+        return Response(UserInfoSerializer(load_user_profile(instance)).data, status=status.HTTP_200_OK)
 
 
 class MembershipInfoView(APIView):
@@ -130,6 +176,17 @@ class LogoutView(APIView):
     authentication_classes = []
 
     def post(self, request):
+        refresh = request.data.get('refresh')
+        if refresh:
+            try:
+                token = RefreshToken(refresh)
+                token.blacklist()
+            except TokenError:
+                return Response({"detail": "Invalid or expired token."}, status=status.HTTP_401_UNAUTHORIZED)
+            # Login hands out the legacy token alongside the pair, so it goes too.
+            Token.objects.filter(user_id=token[api_settings.USER_ID_CLAIM]).delete()
+            return Response({"detail": "Logout successful."}, status=status.HTTP_200_OK)
+
         auth_header = request.META.get('HTTP_AUTHORIZATION', None)
 
         if auth_header:
@@ -210,18 +267,14 @@ class ResetMonthlyBooksView(APIView):
     permission_classes = [IsStaffPermission]
 
     def post(self, request, *args, **kwargs):
-        active_memberships = Membership.objects.filter(active=True)
-
-        for membership in active_memberships:
-            membership.monthly_books = 0 
-            membership.save()
+        Membership.objects.filter(active=True).update(monthly_books=0)
+        profile_cache.invalidate_all()
 
         return Response({"detail": "Monthly books count has been reset for all active memberships."}, status=200)
 
 
 class VerifyStaffView(APIView):
     permission_classes = [IsAuthenticated]
-    authentication_classes = [TokenAuthentication]
 
     def get(self, request):
         user = request.user
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class LocalTransport:
+    """
+    Delivers messages to subscribers in the publishing process only. Suits tests
+    and a single worker; messages still go through JSON so they look exactly as
+    they would arriving from another process.
+    """
+
+    def __init__(self):
+        self.receivers = defaultdict(list)
+
+    def publish(self, channel, message):
+        payload = json.dumps(message)
+        for deliver in list(self.receivers[channel]):
+            deliver(json.loads(payload))
+
+    def listen(self, channel, deliver):
+        self.receivers[channel].append(deliver)
+
+
+class RedisTransport:
+    """
+    Relays messages between worker processes through Redis pub/sub. A process
+    only starts its listener thread once it has a subscriber, so workers that
+    just publish hold no extra connection. A dropped connection is retried with
+    a growing delay; once subscribed again, local subscribers get a
+    {'resync': True} since whatever was published in between is lost.
+    """
+    reconnect_delay = 0.5
+    max_reconnect_delay = 30
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url or settings.REDIS_URL)
+        self.client = client
+        self.closed = threading.Event()
+
+    def publish(self, channel, message):
+        self.client.publish(channel, json.dumps(message))
+
+    def listen(self, channel, deliver):
+        threading.Thread(target=self.run_listener, args=(channel, deliver), name=f'broadcast-{channel}', daemon=True).start()
+
+    def run_listener(self, channel, deliver):
+        delay, reconnecting = self.reconnect_delay, False
+        while not self.closed.is_set():
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(channel)
+                if reconnecting:
+                    deliver({'resync': True})
+                delay, reconnecting = self.reconnect_delay, True
+                for message in pubsub.listen():
+                    deliver(json.loads(message['data']))
+            except Exception:
+                logger.warning("Lost the %s broadcast subscription, reconnecting in %.1fs", channel, delay, exc_info=True)
+            finally:
+                pubsub.close()
+            self.closed.wait(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def close(self):
+        """Stops the listener once its current connection ends."""
+        self.closed.set()
+
+
+class Subscription:
+    """
+    One async consumer of a Broadcast, bound to the event loop it was created
+    on. Messages pushed from any thread are queued onto that loop; past
+    `max_queue` undelivered messages the subscription is marked overflowed and
+    further messages are dropped until the consumer catches up.
+    """
+
+    def __init__(self, broadcast, accept, max_queue):
+        self.broadcast = broadcast
+        self.accept = accept
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(max_queue)
+        self.overflowed = False
+
+    def push(self, message):
+        if self.accept is None or self.accept(message):
+            try:
+                self.loop.call_soon_threadsafe(self._enqueue, message)
+            except RuntimeError:
+                # The loop closed under a subscriber that never got to unsubscribe.
+                self.close()
+
+    def _enqueue(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout=None):
+        """The next message, or None when `timeout` seconds pass without one."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def drain(self):
+        """Drops every queued message and clears the overflow mark, before the consumer re-reads its state."""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.overflowed = False
+
+    def close(self):
+        self.broadcast.unsubscribe(self)
+
+
+class Broadcast:
+    """
+    Fans messages published on `channel` by any worker out to the async
+    subscribers of this process. The cross-worker transport is
+    settings.BROADCAST_TRANSPORT, created on first use; publishing never
+    blocks on subscribers.
+    """
+    max_queue = 100
+
+    def __init__(self, channel, transport=None):
+        self.channel = channel
+        self._transport = transport
+        self._listening = False
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    @property
+    def transport(self):
+        with self._lock:
+            if self._transport is None:
+                self._transport = import_string(settings.BROADCAST_TRANSPORT)()
+            return self._transport
+
+    def publish(self, message):
+        self.transport.publish(self.channel, message)
+
+    def deliver(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.push(message)
+
+    def subscribe(self, accept=None):
+        """
+        Returns a Subscription receiving the messages for which `accept(message)`
+        is true, or all of them. Must be called from a running event loop.
+        """
+        transport = self.transport
+        subscription = Subscription(self, accept, self.max_queue)
+        with self._lock:
+            self._subscribers.add(subscription)
+            start_listening, self._listening = not self._listening, True
+        if start_listening:
+            transport.listen(self.channel, self.deliver)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
@@ -0,0 +1,117 @@
+import time
+import uuid
+from django.core.cache import cache
+from django.db import transaction
+from django.http import Http404
+
+
+class PayloadCache:
+    """
+    Caches one rendered payload per object id in the default cache.
+
+    Payload keys embed a version token per object and a generation token for
+    the whole cache. invalidate() and invalidate_all() replace the tokens once
+    the current transaction commits, so a rebuild that read the database before
+    the change stores its payload under a key nobody asks for any more.
+
+    A miss takes a short lock in the cache before rebuilding. Concurrent misses
+    on the same object wait for that one rebuild instead of all querying the
+    database; after `max_wait` seconds they give up waiting and build for
+    themselves. Hits, misses (rebuilds) and waits are counted in the cache, so
+    every worker process reports the same totals.
+
+    Tokens expire after `timeout` like the payloads they guard; losing one only
+    costs a miss. A build raising Http404 drops the object's token again, so
+    requests for ids that do not exist leave nothing behind in the cache.
+    """
+    lock_timeout = 10
+    poll_interval = 0.05
+    max_wait = 2.0
+
+    def __init__(self, name, timeout):
+        self.name = name
+        self.timeout = timeout
+
+    def key(self, *parts):
+        return ':'.join([self.name, *map(str, parts)])
+
+    def payload_key(self, pk):
+        generation_key, version_key = self.key('generation'), self.key(pk, 'version')
+        tokens = cache.get_many([generation_key, version_key])
+        generation = tokens.get(generation_key) or self.token(generation_key)
+        version = tokens.get(version_key) or self.token(version_key)
+        return self.key(pk, generation, version)
+
+    def token(self, token_key):
+        # add, not set: concurrent first readers must agree on one token.
+        cache.add(token_key, uuid.uuid4().hex, self.timeout)
+        return cache.get(token_key)
+
+    def reset(self, token_key):
+        cache.set(token_key, uuid.uuid4().hex, self.timeout)
+
+    def get(self, pk, build, timeout=None):
+        """
+        Returns (payload, hit), calling `build()` at most once per burst of misses
+        on `pk`. `timeout` overrides the cache's own for this payload.
+        """
+        try:
+            return self._get(pk, build, timeout)
+        except Http404:
+            cache.delete(self.key(pk, 'version'))
+            raise
+
+    def _get(self, pk, build, timeout):
+        key = self.payload_key(pk)
+        payload = cache.get(key)
+        if payload is not None:
+            self.count('hits')
+            return payload, True
+
+        lock_key = f'{key}:lock'
+        deadline = time.monotonic() + self.max_wait
+        while not cache.add(lock_key, 1, self.lock_timeout):
+            if time.monotonic() > deadline:
+                break
+            time.sleep(self.poll_interval)
+            payload = cache.get(key)
+            if payload is not None:
+                self.count('waits')
+                return payload, True
+        else:
+            try:
+                payload = build()
+                self.count('misses')
+                cache.set(key, payload, timeout or self.timeout)
+                return payload, False
+            finally:
+                cache.delete(lock_key)
+
+        payload = build()
+        self.count('misses')
+        return payload, False
+
+    def invalidate(self, pk):
+        transaction.on_commit(lambda: self.reset(self.key(pk, 'version')))
+
+    def invalidate_many(self, pks):
+        keys = [self.key(pk, 'version') for pk in set(pks)]
+        if keys:
+            transaction.on_commit(lambda: cache.set_many({key: uuid.uuid4().hex for key in keys}, self.timeout))
+
+    def invalidate_all(self):
+        transaction.on_commit(lambda: self.reset(self.key('generation')))
+
+    def count(self, counter):
+        key = self.key('stats', counter)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted between add and incr; the count restarts.
+            cache.set(key, 1, None)
+
+    def stats(self):
+        counters = ('hits', 'misses', 'waits')
+        values = cache.get_many([self.key('stats', counter) for counter in counters])
+        return {counter: values.get(self.key('stats', counter), 0) for counter in counters}
@@ -0,0 +1,49 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from Accounts.cache import profile_cache
+from Accounts.models import UserImage
+from Common.models import StoredImage
+from Common.storage import media_name
+from Common.utils import decode_image, encode_placeholder
+from Server.cache import invalidate_all_books
+from Server.models import BookImage
+
+MODELS = (StoredImage, BookImage, UserImage)
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills the inline placeholder of images uploaded before placeholders existed, from their stored small "
+        "variant. Each small file is downloaded once however many rows share it; rows are updated per URL."
+    )
+
+    def handle(self, *args, **options):
+        urls = set()
+        for model in MODELS:
+            urls.update(
+                model.objects.filter(placeholder='', image_small__isnull=False)
+                .values_list('image_small', flat=True).distinct().iterator()
+            )
+
+        read = filled = failed = 0
+        for url in sorted(urls):
+            name = media_name(url)
+            if name is None:
+                continue
+            try:
+                with default_storage.open(name) as small:
+                    placeholder = encode_placeholder(decode_image(small))
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"Could not read {name}: {type(e).__name__}: {e}")
+                continue
+            read += 1
+            for model in MODELS:
+                filled += model.objects.filter(image_small=url, placeholder='').update(placeholder=placeholder)
+
+        if filled:
+            # update() sends no signals, so the cached book and profile payloads still carry the empty placeholders.
+            invalidate_all_books()
+            profile_cache.invalidate_all()
+
+        self.stdout.write(self.style.SUCCESS(f"Filled {filled} placeholder(s) from {read} small image(s); {failed} failed."))
@@ -0,0 +1,44 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from Common.media_gc import MEDIA_PREFIXES, collect_media_garbage
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes media files no BookImage, UserImage or stored image points at any more. Stored images released "
+        "longer than the grace period ago are expired first. Files younger than the grace period are kept, so "
+        "uploads still being recorded are never collected."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="List orphaned files without deleting anything.")
+        parser.add_argument('--grace-hours', type=float, default=24, help="Minimum age, in hours, of a file or released stored image before it is collected.")
+        parser.add_argument('--prefix', action='append', help=f"Storage prefix to scan; defaults to {', '.join(MEDIA_PREFIXES)}.")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        def report_orphan(name):
+            if dry_run or options['verbosity'] > 1:
+                self.stdout.write(f"Orphaned: {name}")
+
+        summary = collect_media_garbage(
+            timedelta(hours=options['grace_hours']),
+            prefixes=options['prefix'] or MEDIA_PREFIXES,
+            dry_run=dry_run,
+            on_orphan=report_orphan,
+        )
+
+        for name, error in summary['errors'].items():
+            self.stderr.write(f"Could not delete {name}: {error}")
+
+        if dry_run:
+            self.stdout.write(self.style.SUCCESS(
+                f"Would expire {summary['expired']} stored image(s) and delete {summary['orphaned']} of "
+                f"{summary['scanned']} file(s)."
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Expired {summary['expired']} stored image(s) and deleted {summary['deleted']} of "
+                f"{summary['scanned']} file(s); {len(summary['errors'])} could not be deleted."
+            ))
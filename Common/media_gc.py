@@ -0,0 +1,84 @@
+from django.db import transaction
+from django.utils import timezone
+from Accounts.models import UserImage
+from Server.models import BookImage
+from .models import StoredImage
+from .storage import DELETE_BATCH_SIZE, delete_media, list_media, media_name
+
+MEDIA_PREFIXES = ('books/', 'users/')
+
+
+def expire_stored_images(cutoff, dry_run=False):
+    """
+    Deletes the StoredImage rows released before `cutoff` and returns how many.
+    The rows are locked first, so an upload of the same content racing with gc
+    either references a row before it is locked or misses it and re-uploads.
+    """
+    expired = StoredImage.objects.unreferenced(cutoff)
+    if dry_run:
+        return expired.count()
+    with transaction.atomic():
+        ids = list(expired.select_for_update(skip_locked=True).values_list('pk', flat=True))
+        StoredImage.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def referenced_media(stored_images):
+    """Storage names of every file a BookImage, UserImage or one of `stored_images` points at."""
+    names = set()
+
+    def add(url):
+        name = media_name(url)
+        if name:
+            names.add(name)
+
+    for queryset in (BookImage.objects.all(), stored_images):
+        for image_url, image_small, variants in queryset.values_list('image_url', 'image_small', 'variants').iterator(chunk_size=2000):
+            add(image_url)
+            add(image_small)
+            for variant in variants:
+                add(variant['url'])
+    for image_url, image_small in UserImage.objects.values_list('image_url', 'image_small').iterator(chunk_size=2000):
+        add(image_url)
+        add(image_small)
+    return names
+
+
+def collect_media_garbage(grace, prefixes=MEDIA_PREFIXES, dry_run=False, on_orphan=None):
+    """
+    Expires stored images unreferenced for longer than `grace`, then lists
+    `prefixes` and deletes every file older than `grace` that no row points at,
+    DELETE_BATCH_SIZE files per call. Files younger than `grace` are left
+    alone: their upload may still be on its way to the database. `on_orphan`
+    is called with each orphan's name. Returns counts and the delete errors.
+    """
+    cutoff = timezone.now() - grace
+    summary = {'expired': expire_stored_images(cutoff, dry_run), 'scanned': 0, 'orphaned': 0, 'deleted': 0, 'errors': {}}
+
+    stored_images = StoredImage.objects.all()
+    if dry_run:
+        stored_images = stored_images.exclude(pk__in=StoredImage.objects.unreferenced(cutoff).values('pk'))
+    referenced = referenced_media(stored_images)
+
+    orphans = []
+
+    def flush():
+        if not dry_run:
+            errors = delete_media(orphans)
+            summary['errors'].update(errors)
+            summary['deleted'] += len(orphans) - len(errors)
+        orphans.clear()
+
+    for prefix in prefixes:
+        for name, modified in list_media(prefix):
+            summary['scanned'] += 1
+            if name in referenced or modified >= cutoff:
+                continue
+            summary['orphaned'] += 1
+            if on_orphan:
+                on_orphan(name)
+            orphans.append(name)
+            if len(orphans) == DELETE_BATCH_SIZE:
+                flush()
+    flush()
+    return summary
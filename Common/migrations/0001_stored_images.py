@@ -0,0 +1,35 @@
+# Generated by Django 5.1.1 on 2026-10-17 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64)),
+                ('kind', models.CharField(choices=[('book', 'Book image'), ('user', 'User image')], max_length=10)),
+                ('image_url', models.URLField(blank=True, null=True)),
+                ('image_small', models.URLField(blank=True, null=True)),
+                ('width', models.PositiveIntegerField(blank=True, null=True)),
+                ('height', models.PositiveIntegerField(blank=True, null=True)),
+                ('dominant_color', models.CharField(blank=True, max_length=7)),
+                ('variants', models.JSONField(blank=True, default=list)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('released_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('ref_count', 0)), fields=['released_at'], name='storedimage_unreferenced_idx')],
+                'constraints': [models.UniqueConstraint(fields=('sha256', 'kind'), name='storedimage_sha256_kind_uniq')],
+            },
+        ),
+    ]
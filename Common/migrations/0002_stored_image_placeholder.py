@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-17 10:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Common', '0001_stored_images'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedimage',
+            name='placeholder',
+            field=models.TextField(blank=True),
+        ),
+    ]
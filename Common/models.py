@@ -0,0 +1,84 @@
+from django.db import models, transaction
+from django.db.models import Case, F, When
+from django.db.models.functions import Greatest, Now
+
+
+class StoredImageQuerySet(models.QuerySet):
+    def acquire(self, sha256, kind):
+        """Takes a reference on the variants already stored for this content, or returns None when there are none."""
+        with transaction.atomic():
+            if not self.filter(sha256=sha256, kind=kind).update(ref_count=F('ref_count') + 1, released_at=None):
+                return None
+            return self.get(sha256=sha256, kind=kind)
+
+    def register(self, sha256, kind, image):
+        """
+        Records the variants just uploaded for `image` under their content hash
+        and takes a reference on them. When an identical upload registered first,
+        its row is referenced instead and ours are left for gc to reclaim.
+        """
+        fields = {name: getattr(image, name) for name in StoredImage.VARIANT_FIELDS if hasattr(image, name)}
+        with transaction.atomic():
+            stored, created = self.get_or_create(sha256=sha256, kind=kind, defaults={**fields, 'ref_count': 1})
+        if created:
+            return stored
+        return self.acquire(sha256, kind) or self.register(sha256, kind, image)
+
+    def release(self, pk):
+        """Drops one reference; the row that reaches zero is stamped so gc can reclaim it after a grace period."""
+        self.filter(pk=pk).update(
+            ref_count=Greatest(F('ref_count') - 1, 0),
+            released_at=Case(When(ref_count__lte=1, then=Now()), default=F('released_at')),
+        )
+
+    def unreferenced(self, released_before):
+        return self.filter(ref_count=0, released_at__lt=released_before)
+
+
+class StoredImage(models.Model):
+    """
+    Uploaded image variants, addressed by the sha256 of the original upload
+    bytes. BookImage and UserImage rows point here and copy the URLs, so an
+    identical upload reuses the stored variants with no encode and no upload.
+    `ref_count` tracks how many images point here; rows released to zero are
+    garbage once `released_at` is old enough.
+    """
+    BOOK = 'book'
+    USER = 'user'
+    KIND_CHOICES = [(BOOK, 'Book image'), (USER, 'User image')]
+
+    VARIANT_FIELDS = ('image_url', 'image_small', 'placeholder', 'width', 'height', 'dominant_color', 'variants')
+
+    sha256 = models.CharField(max_length=64)
+    # Books and avatars encode different variant sets, so the same bytes are stored once per kind.
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    image_url = models.URLField(blank=True, null=True)
+    image_small = models.URLField(blank=True, null=True)
+    placeholder = models.TextField(blank=True)
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    dominant_color = models.CharField(max_length=7, blank=True)
+    variants = models.JSONField(default=list, blank=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    released_at = models.DateTimeField(blank=True, null=True)
+
+    objects = StoredImageQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['sha256', 'kind'], name='storedimage_sha256_kind_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['released_at'], condition=models.Q(ref_count=0), name='storedimage_unreferenced_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} image {self.sha256[:12]} ({self.ref_count} ref)"
+
+    def copy_to(self, image):
+        """Points `image` at these variants, copying every field it shares with them."""
+        for name in self.VARIANT_FIELDS:
+            if hasattr(image, name):
+                setattr(image, name, getattr(self, name))
+        image.stored = self
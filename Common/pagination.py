@@ -0,0 +1,170 @@
+import base64
+import binascii
+import json
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import BooleanField, F, Func, Q, Value
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class RowComparison(Func):
+    """`(a, b, ...) > (x, y, ...)` as one SQL row-value comparison, which Postgres can answer from a composite index."""
+    template = '%(expressions)s'
+    output_field = BooleanField()
+
+    def __init__(self, names, values, operator):
+        super().__init__(
+            Func(*(F(name) for name in names), template='(%(expressions)s)'),
+            Func(*(Value(value) for value in values), template='(%(expressions)s)'),
+            arg_joiner=f' {operator} ',
+        )
+
+    def get_group_by_cols(self):
+        # Filtering on an aggregate puts this in HAVING; only the compared columns may join the GROUP BY.
+        return self.source_expressions[0].get_group_by_cols()
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on every field of `ordering`, so each page is a
+    single indexed range scan no matter how deep the client has scrolled.
+
+    While LEGACY_UNPAGINATED_LISTS is enabled, requests without a cursor or
+    page_size parameter keep receiving the full, unpaginated list, unless the
+    endpoint sets `always_paginate`.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 24
+    max_page_size = 100
+    ordering = ('-id',)
+    invalid_cursor_message = 'Invalid cursor'
+    always_paginate = False
+
+    def is_requested(self, request):
+        if self.always_paginate or not getattr(settings, 'LEGACY_UNPAGINATED_LISTS', True):
+            return True
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request, queryset, view=None):
+        return self.ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        position, reverse = self.decode_cursor(request, queryset)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(self.invert(field) for field in ordering)
+
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after_position(position, ordering))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def after_position(self, position, ordering):
+        """
+        Filters to the rows after `position`. When every field sorts the same way
+        this is a row-value comparison, `(a, b) < (x, y)` for descending fields,
+        so Postgres seeks the matching composite index. Mixed directions fall back
+        to the equivalent OR of equal prefixes.
+        """
+        descending = {field.startswith('-') for field in ordering}
+        if len(descending) == 1:
+            return RowComparison([field.lstrip('-') for field in ordering], position, '<' if descending.pop() else '>')
+
+        condition = Q()
+        equal_prefix = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal_prefix & Q(**{f'{name}__{lookup}': value})
+            equal_prefix &= Q(**{name: value})
+        return condition
+
+    def encode_cursor(self, instance, reverse):
+        position = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip('-'))
+            # isoformat() keeps the microseconds that identify a row exactly.
+            position.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        payload = json.dumps({'p': position, 'r': int(reverse)})
+        cursor = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        return replace_query_param(remove_query_param(self.base_url, self.cursor_query_param), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            values = payload['p']
+            if len(values) != len(self.ordering):
+                raise ValueError
+            position = [
+                self.get_output_field(queryset, field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+            return position, bool(payload.get('r'))
+        except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def get_output_field(queryset, name):
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.get_field(name)
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
@@ -6,5 +6,5 @@ class UserImageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = UserImage
-        fields = ['image_url', 'image_small', 'image_file']
-        read_only_fields = ['image_url', 'image_small']
+        fields = ['image_url', 'image_small', 'placeholder', 'image_file']
+        read_only_fields = ['image_url', 'image_small', 'placeholder']
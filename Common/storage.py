@@ -0,0 +1,113 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.storage import default_storage
+from storages.backends.s3 import S3Storage
+
+# The most keys S3 accepts in one DeleteObjects call.
+DELETE_BATCH_SIZE = 1000
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """Raised for an instance whose files could not all be uploaded."""
+
+
+def upload_executor():
+    """
+    The process-wide upload pool. Its threads live as long as the process, so
+    each keeps its storage connection (boto3 resources are per thread) warm
+    across requests instead of opening a new session per file.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.MEDIA_UPLOAD_WORKERS, thread_name_prefix='media-upload')
+        return _executor
+
+
+def upload_files(items):
+    """
+    Uploads every file of every item concurrently through default_storage.
+
+    `items` is a list of {key: (name, content)}, typically all the variants of
+    one image. Returns a list aligned with `items` of (urls, error): `urls` maps
+    each key to its public URL when the whole item uploaded, otherwise it is
+    None and `error` is the UploadError for that item.
+    """
+    futures = [
+        {key: upload_executor().submit(default_storage.save, name, content) for key, (name, content) in files.items()}
+        for files in items
+    ]
+
+    results = []
+    for pending in futures:
+        urls, error = {}, None
+        for key, future in pending.items():
+            try:
+                urls[key] = f'{settings.MEDIA_URL}{future.result()}'
+            except Exception as e:
+                error = error or UploadError(f"Uploading {key} failed: {type(e).__name__}: {e}")
+        results.append((None, error) if error else (urls, None))
+    return results
+
+
+def media_name(url):
+    """The storage name behind a media URL, or None for URLs outside MEDIA_URL."""
+    if url and url.startswith(settings.MEDIA_URL):
+        return url[len(settings.MEDIA_URL):]
+    return None
+
+
+def list_media(prefix, storage=default_storage):
+    """
+    Yields (name, last_modified) for every stored file under `prefix`. S3 is
+    listed a page of up to 1000 keys at a time, so memory stays flat however
+    large the bucket grows; other storages are walked directory by directory.
+    """
+    if isinstance(storage, S3Storage):
+        root = storage._normalize_name('')  # AWS_LOCATION with its trailing slash, or ''
+        paginator = storage.connection.meta.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=storage.bucket_name, Prefix=f'{root}{prefix}'):
+            for obj in page.get('Contents', []):
+                yield obj['Key'][len(root):], obj['LastModified']
+        return
+
+    directory = prefix.rstrip('/')
+    if not storage.exists(directory):
+        return
+    dirs, files = storage.listdir(directory)
+    for name in files:
+        path = f'{directory}/{name}'
+        yield path, storage.get_modified_time(path)
+    for name in dirs:
+        yield from list_media(f'{directory}/{name}/', storage)
+
+
+def delete_media(names, storage=default_storage):
+    """
+    Deletes `names`, on S3 with one DeleteObjects call per DELETE_BATCH_SIZE
+    keys. Returns {name: error} for the files that could not be deleted.
+    """
+    errors = {}
+    if isinstance(storage, S3Storage):
+        root = storage._normalize_name('')
+        client = storage.connection.meta.client
+        for start in range(0, len(names), DELETE_BATCH_SIZE):
+            batch = names[start:start + DELETE_BATCH_SIZE]
+            response = client.delete_objects(
+                Bucket=storage.bucket_name,
+                Delete={'Objects': [{'Key': f'{root}{name}'} for name in batch], 'Quiet': True},
+            )
+            for error in response.get('Errors', []):
+                errors[error['Key'][len(root):]] = f"{error['Code']}: {error['Message']}"
+        return errors
+
+    for name in names:
+        try:
+            storage.delete(name)
+        except Exception as e:
+            errors[name] = f"{type(e).__name__}: {e}"
+    return errors
@@ -0,0 +1,33 @@
+import os
+import tempfile
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.test import override_settings
+
+
+class FlakyStorage(FileSystemStorage):
+    """Fails the small variant of any upload whose name contains "flaky"."""
+
+    def _save(self, name, content):
+        if 'flaky' in name and '_small_' in name:
+            raise OSError("connection reset")
+        return super()._save(name, content)
+
+
+class LocalMediaMixin:
+    """Points default_storage at a temporary directory instead of S3."""
+
+    def use_local_media(self, backend='django.core.files.storage.FileSystemStorage'):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(STORAGES={
+            'default': {'BACKEND': backend, 'OPTIONS': {'location': media.name}},
+            'staticfiles': settings.STORAGES['staticfiles'],
+        })
+        override.enable()
+        self.addCleanup(override.disable)
+        self.media_root = media.name
+        return default_storage
+
+    def media_files(self):
+        return sorted(os.path.join(path, name) for path, dirs, names in os.walk(self.media_root) for name in names)
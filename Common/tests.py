@@ -0,0 +1,196 @@
+import asyncio
+import base64
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from PIL import Image
+from storages.backends.s3 import S3Storage
+from Accounts.cache import profile_cache
+from Server.models import Book, BookImage
+from .broadcast import Broadcast, LocalTransport, RedisTransport
+from .models import StoredImage
+from .storage import delete_media, list_media
+from .testing import LocalMediaMixin
+
+
+class GarbageCollectMediaTests(LocalMediaMixin, TestCase):
+    def setUp(self):
+        self.storage = self.use_local_media()
+        self.book = Book.objects.create(title="Cover", author="Author")
+
+    def upload(self, color='red'):
+        buffer = BytesIO()
+        Image.new('RGB', (400, 300), color).save(buffer, 'PNG')
+        return SimpleUploadedFile("cover.png", buffer.getvalue(), content_type='image/png')
+
+    def age_files(self, hours=48):
+        past = time.time() - hours * 3600
+        for path in self.media_files():
+            os.utime(path, (past, past))
+
+    def gc(self, *args):
+        out = StringIO()
+        call_command('gc_media', *args, stdout=out)
+        return out.getvalue()
+
+    def test_deletes_only_old_unreferenced_files(self):
+        BookImage(book=self.book).save(image_file=self.upload())
+        self.storage.save('books/orphan.webp', ContentFile(b'orphan'))
+        self.storage.save('users/orphan.webp', ContentFile(b'orphan'))
+        self.age_files()
+        self.storage.save('books/in_flight.webp', ContentFile(b'new'))
+        kept = [path for path in self.media_files() if 'orphan' not in path]
+
+        output = self.gc('--dry-run')
+        self.assertIn("Orphaned: books/orphan.webp", output)
+        self.assertIn("Would expire 0 stored image(s) and delete 2 of 7 file(s).", output)
+        self.assertEqual(len(self.media_files()), 7)
+
+        self.assertIn("deleted 2 of 7 file(s)", self.gc())
+        self.assertEqual(self.media_files(), kept)
+
+    def test_expires_released_stored_images_after_grace(self):
+        BookImage(book=self.book).save(image_file=self.upload())
+        self.age_files()
+        self.book.images.get().delete()
+
+        self.assertIn("deleted 0 of 4 file(s)", self.gc())
+        self.assertTrue(StoredImage.objects.exists())
+
+        StoredImage.objects.update(released_at=timezone.now() - timedelta(hours=25))
+        self.assertIn("Would expire 1 stored image(s) and delete 4 of 4", self.gc('--dry-run'))
+        self.assertIn("Expired 1 stored image(s) and deleted 4 of 4", self.gc())
+        self.assertFalse(StoredImage.objects.exists())
+        self.assertEqual(self.media_files(), [])
+
+
+class BackfillPlaceholdersTests(LocalMediaMixin, TestCase):
+    def test_fills_placeholders_from_small_variants_once_per_url(self):
+        storage = self.use_local_media()
+        buffer = BytesIO()
+        Image.new('RGB', (60, 40), 'navy').save(buffer, 'WEBP')
+        name = storage.save('books/old_small.webp', ContentFile(buffer.getvalue()))
+        url = f'{settings.MEDIA_URL}{name}'
+        book = Book.objects.create(title="Old", author="Author")
+        images = [BookImage.objects.create(book=book, image_small=url) for _ in range(2)]
+        BookImage.objects.create(book=book, image_small=f'{settings.MEDIA_URL}books/missing.webp')
+
+        out, err = StringIO(), StringIO()
+        with (
+            mock.patch.object(storage, 'open', wraps=storage.open) as opened,
+            mock.patch('Common.management.commands.backfill_placeholders.invalidate_all_books') as invalidate_books,
+            mock.patch.object(profile_cache, 'invalidate_all') as invalidate_profiles,
+        ):
+            call_command('backfill_placeholders', stdout=out, stderr=err)
+        self.assertEqual(opened.call_count, 2)
+        invalidate_books.assert_called_once_with()
+        invalidate_profiles.assert_called_once_with()
+        self.assertIn("Filled 2 placeholder(s) from 1 small image(s); 1 failed.", out.getvalue())
+        self.assertIn("books/missing.webp", err.getvalue())
+
+        for image in images:
+            image.refresh_from_db()
+            with Image.open(BytesIO(base64.b64decode(image.placeholder.split(',', 1)[1]))) as placeholder:
+                self.assertEqual(placeholder.size, (20, 13))
+
+
+class S3MediaListingTests(TestCase):
+    def setUp(self):
+        self.storage = S3Storage(bucket_name='bucket', location='media')
+        self.client = mock.Mock()
+        connection = mock.patch.object(S3Storage, 'connection', new_callable=mock.PropertyMock)
+        connection.start().return_value.meta.client = self.client
+        self.addCleanup(connection.stop)
+
+    def test_lists_every_page_under_the_prefix(self):
+        modified = timezone.now()
+        self.client.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [{'Key': 'media/books/a.webp', 'LastModified': modified}]},
+            {'Contents': [{'Key': 'media/books/b.webp', 'LastModified': modified}]},
+            {},
+        ]
+        self.assertEqual(list(list_media('books/', self.storage)), [('books/a.webp', modified), ('books/b.webp', modified)])
+        self.client.get_paginator.assert_called_once_with('list_objects_v2')
+        self.client.get_paginator.return_value.paginate.assert_called_once_with(Bucket='bucket', Prefix='media/books/')
+
+    def test_deletes_in_batches_of_1000_keys(self):
+        self.client.delete_objects.side_effect = [
+            {},
+            {'Errors': [{'Key': 'media/books/1500.webp', 'Code': 'AccessDenied', 'Message': "Access Denied"}]},
+            {},
+        ]
+        names = [f'books/{index}.webp' for index in range(2500)]
+        errors = delete_media(names, self.storage)
+
+        batches = [call.kwargs['Delete']['Objects'] for call in self.client.delete_objects.call_args_list]
+        self.assertEqual([len(batch) for batch in batches], [1000, 1000, 500])
+        self.assertEqual(batches[1][0], {'Key': 'media/books/1000.webp'})
+        self.assertEqual(errors, {'books/1500.webp': "AccessDenied: Access Denied"})
+
+
+class BroadcastTests(SimpleTestCase):
+    async def test_delivers_accepted_messages_from_other_threads(self):
+        broadcast = Broadcast('test', LocalTransport())
+        evens = broadcast.subscribe(lambda message: message['n'] % 2 == 0)
+        everything = broadcast.subscribe()
+
+        publisher = threading.Thread(target=lambda: [broadcast.publish({'n': n}) for n in range(4)])
+        publisher.start()
+        publisher.join()
+
+        self.assertEqual([await evens.get(1), await evens.get(1)], [{'n': 0}, {'n': 2}])
+        self.assertIsNone(await evens.get(0.01))
+        self.assertEqual([(await everything.get(1))['n'] for _ in range(4)], [0, 1, 2, 3])
+
+        evens.close()
+        broadcast.publish({'n': 4})
+        self.assertEqual(await everything.get(1), {'n': 4})
+        self.assertIsNone(await evens.get(0.01))
+
+    async def test_overflow_is_flagged_instead_of_growing(self):
+        broadcast = Broadcast('test', LocalTransport())
+        broadcast.max_queue = 2
+        subscription = broadcast.subscribe()
+        for n in range(5):
+            broadcast.publish({'n': n})
+        await asyncio.sleep(0)
+
+        self.assertTrue(subscription.overflowed)
+        self.assertEqual(subscription.queue.qsize(), 2)
+        subscription.drain()
+        self.assertFalse(subscription.overflowed)
+        self.assertIsNone(await subscription.get(0.01))
+
+    async def test_redis_listener_reconnects_and_asks_for_a_resync(self):
+        released = threading.Event()
+
+        def dropped():
+            raise ConnectionError("connection reset")
+            yield
+
+        def one_message():
+            yield {'type': 'message', 'data': json.dumps({'n': 1})}
+            released.wait(5)
+
+        scripts = iter([dropped, one_message])
+        client = mock.Mock()
+        client.pubsub.side_effect = lambda **kwargs: mock.Mock(listen=next(scripts))
+        transport = RedisTransport(client=client)
+        transport.reconnect_delay = 0.01
+        self.addCleanup(released.set)
+        self.addCleanup(transport.close)
+
+        subscription = Broadcast('test', transport).subscribe()
+        self.assertEqual(await subscription.get(2), {'resync': True})
+        self.assertEqual(await subscription.get(2), {'n': 1})
+        self.assertEqual(client.pubsub.call_count, 2)
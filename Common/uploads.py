@@ -0,0 +1,73 @@
+import hashlib
+import tempfile
+from django.conf import settings
+from PIL import Image, UnidentifiedImageError
+
+# Spooled uploads stay in memory up to this size and move to an anonymous temporary file beyond it.
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+
+class UploadRejected(Exception):
+    """Raised for an upload over MAX_IMAGE_UPLOAD_SIZE bytes or MAX_IMAGE_PIXELS pixels."""
+
+
+def check_upload_size(size):
+    if size > settings.MAX_IMAGE_UPLOAD_SIZE:
+        raise UploadRejected(f"Image is larger than {settings.MAX_IMAGE_UPLOAD_SIZE // (1024 * 1024)} MB.")
+
+
+def check_pixels(width, height):
+    if width * height > settings.MAX_IMAGE_PIXELS:
+        raise UploadRejected(
+            f"Image is {width}x{height}; at most {settings.MAX_IMAGE_PIXELS / 1e6:g} megapixels are accepted."
+        )
+
+
+def check_image_header(image_file):
+    """
+    Rejects an image by the dimensions declared in its header; Pillow reads
+    only the header here, no pixels. Files Pillow cannot identify pass, so the
+    encoder reports them as it does any other unreadable image.
+    """
+    position = image_file.tell()
+    try:
+        with Image.open(image_file) as image:
+            check_pixels(image.width, image.height)
+    except Image.DecompressionBombError as e:
+        raise UploadRejected(str(e))
+    except UnidentifiedImageError:
+        pass
+    finally:
+        image_file.seek(position)
+
+
+def check_image_upload(image_file):
+    """Rejects an upload by its declared size and header before it is read, so the request fails fast."""
+    if image_file.size is not None:
+        check_upload_size(image_file.size)
+    check_image_header(image_file)
+
+
+def spool_upload(image_file):
+    """
+    Copies the upload chunk by chunk into a private spooled buffer, hashing it
+    on the way, and checks its header. Only one chunk is held at a time and
+    copying stops as soon as MAX_IMAGE_UPLOAD_SIZE is passed, so a mislabelled
+    or oversized body is never read in full. Returns the rewound buffer, which
+    the caller closes, and the sha256 of the content.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        for chunk in image_file.chunks():
+            size += len(chunk)
+            check_upload_size(size)
+            digest.update(chunk)
+            spool.write(chunk)
+        spool.seek(0)
+        check_image_header(spool)
+    except BaseException:
+        spool.close()
+        raise
+    return spool, digest.hexdigest()
@@ -1,45 +1,95 @@
-import os
-from PIL import Image
-import subprocess
-
-def convert_to_webp(input_image_path, output_image_path):
-    try:
-        subprocess.run(
-            ['ffmpeg', '-i', input_image_path, '-pix_fmt', 'yuv420p', '-q:v', '80', output_image_path],
-            check=True
-        )
-    except subprocess.CalledProcessError as e:
-        print(f"Error converting image to .webp: {e}")
-        raise e
-
-def create_small_image(input_image_path, small_image_webp_path, max_size=20):
-    try:
-        with Image.open(input_image_path) as img:
-            img.thumbnail((max_size, max_size), Image.LANCZOS)
-            temp_small_image_path = f"{small_image_webp_path}.tmp"
-            img.save(temp_small_image_path, 'PNG')
-
-        convert_to_webp(temp_small_image_path, small_image_webp_path)
-
-    except Exception as e:
-        print(f"Error resizing and converting small image to .webp: {e}")
-        raise e
-    finally:
-        if os.path.exists(temp_small_image_path):
-            os.remove(temp_small_image_path)
-
-def create_user_icon(input_image_path, small_image_webp_path, max_size=60):
-    try:
-        with Image.open(input_image_path) as img:
-            img.thumbnail((max_size, max_size), Image.LANCZOS)
-            temp_small_image_path = f"{small_image_webp_path}.tmp"
-            img.save(temp_small_image_path, 'PNG')
-
-        convert_to_webp(temp_small_image_path, small_image_webp_path)
-
-    except Exception as e:
-        print(f"Error resizing and converting small image to .webp: {e}")
-        raise e
-    finally:
-        if os.path.exists(temp_small_image_path):
-            os.remove(temp_small_image_path)
+import base64
+from io import BytesIO
+from PIL import Image, ImageOps
+from .uploads import check_pixels
+
+WEBP_QUALITY = 80
+# Placeholders are inlined into API responses, so they stay tiny: a few hundred bytes of WebP.
+PLACEHOLDER_SIZE = 20
+
+
+def decode_image(image_file):
+    """
+    Decodes an upload once, applying its EXIF orientation, into RGB or RGBA when
+    it has transparency. The pixel count is bounded from the header first.
+    """
+    with Image.open(image_file) as source:
+        check_pixels(source.width, source.height)
+        image = ImageOps.exif_transpose(source)
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        return image.convert('RGBA' if has_alpha else 'RGB')
+
+
+def encode_webp(image, quality=WEBP_QUALITY):
+    buffer = BytesIO()
+    image.save(buffer, 'WEBP', quality=quality)
+    buffer.seek(0)
+    return buffer
+
+
+def inline_webp(buffer):
+    """A data: URI embedding an encoded WebP, for placeholders clients can paint without a request."""
+    return f"data:image/webp;base64,{base64.b64encode(buffer.getvalue()).decode('ascii')}"
+
+
+def encode_placeholder(image, quality=WEBP_QUALITY):
+    placeholder = image.copy()
+    placeholder.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.LANCZOS)
+    return inline_webp(encode_webp(placeholder, quality))
+
+
+def dominant_color(image):
+    """The most common colour of a 64px copy reduced to an 8-colour palette, as #rrggbb."""
+    sample = image.convert('RGB')
+    sample.thumbnail((64, 64))
+    palette = sample.quantize(colors=8)
+    count, index = max(palette.getcolors())
+    red, green, blue = palette.getpalette()[index * 3:index * 3 + 3]
+    return f'#{red:02x}{green:02x}{blue:02x}'
+
+
+def encode_webp_variants(image_file, sizes, quality=WEBP_QUALITY):
+    """
+    Decodes `image_file` once and encodes one WebP per entry of `sizes`
+    ({name: max_size}, None keeping the original size) into memory.
+    Returns {name: BytesIO}, each rewound and ready to upload.
+    """
+    image = decode_image(image_file)
+
+    variants = {}
+    # Largest first, so each thumbnail is downscaled from the previous one instead of the full image.
+    for name, max_size in sorted(sizes.items(), key=lambda item: -(item[1] or float('inf'))):
+        if max_size is not None:
+            image = image.copy()
+            image.thumbnail((max_size, max_size), Image.LANCZOS)
+        variants[name] = encode_webp(image, quality)
+    return variants
+
+
+def encode_responsive_webp(image_file, widths, small_size, quality=WEBP_QUALITY):
+    """
+    Decodes `image_file` once and encodes the original, a `small_size` placeholder
+    and one WebP per entry of `widths` narrower than the original. Returns a dict
+    with the original's width, height and dominant_color, the 'original' and
+    'small' buffers, the small one inlined as 'placeholder', and 'widths'
+    mapping each width to (buffer, height).
+    """
+    image = decode_image(image_file)
+    encoded = {
+        'width': image.width,
+        'height': image.height,
+        'dominant_color': dominant_color(image),
+        'original': encode_webp(image, quality),
+        'widths': {},
+    }
+
+    # Widest first, so each variant is downscaled from the previous one instead of the full image.
+    for width in sorted((width for width in widths if width < image.width), reverse=True):
+        height = max(1, round(image.height * width / image.width))
+        image = image.resize((width, height), Image.LANCZOS)
+        encoded['widths'][width] = (encode_webp(image, quality), height)
+
+    image.thumbnail((small_size, small_size), Image.LANCZOS)
+    encoded['small'] = encode_webp(image, quality)
+    encoded['placeholder'] = inline_webp(encoded['small'])
+    return encoded
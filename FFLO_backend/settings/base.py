@@ -3,6 +3,8 @@ import logging
 from pathlib import Path
 from decouple import config
 from datetime import timedelta
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 
 print(f"Using settings module: {os.getenv('DJANGO_SETTINGS_MODULE')} (PID: {os.getpid()})")
 
@@ -27,8 +29,11 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
+    'rest_framework_simplejwt.token_blacklist',
+    'Common.apps.CommonConfig',
     'Accounts.apps.AccountsConfig',
     'Server.apps.ServerConfig',
     'Payments.apps.PaymentsConfig',
@@ -70,15 +75,43 @@ WSGI_APPLICATION = 'FFLO_backend.wsgi.application'
 
 # FFLO_backend/settings/base.py
 
+# JWT_AUTH_ENABLED issues short-lived access tokens next to the legacy DRF tokens and
+# accepts both. Once every client sends Bearer tokens, LEGACY_AUTH_TOKENS=False stops
+# creating and accepting rows in authtoken_token.
+JWT_AUTH_ENABLED = config('JWT_AUTH_ENABLED', default=False, cast=bool)
+LEGACY_AUTH_TOKENS = config('LEGACY_AUTH_TOKENS', default=True, cast=bool)
+
+AUTHENTICATION_CLASSES = []
+if JWT_AUTH_ENABLED:
+    AUTHENTICATION_CLASSES.append('Accounts.authentication.StatelessJWTAuthentication')
+if LEGACY_AUTH_TOKENS or not JWT_AUTH_ENABLED:
+    AUTHENTICATION_CLASSES.append('rest_framework.authentication.TokenAuthentication')
+
 REST_FRAMEWORK = {
-    'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
-    ),
+    'DEFAULT_AUTHENTICATION_CLASSES': AUTHENTICATION_CLASSES,
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
 }
 
+# List endpoints only paginate when a client sends `cursor` or `page_size`
+# until every client understands the paginated response shape.
+LEGACY_UNPAGINATED_LISTS = config('LEGACY_UNPAGINATED_LISTS', default=True, cast=bool)
+
+# Detail responses embed only the most recent items of each history section;
+# the rest is served by the paginated `.../rentals/` endpoints.
+EMBEDDED_HISTORY_LIMIT = config('EMBEDDED_HISTORY_LIMIT', default=10, cast=int)
+
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=config('JWT_ACCESS_MINUTES', default=10, cast=int)),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=config('JWT_REFRESH_DAYS', default=14, cast=int)),
+    'ROTATE_REFRESH_TOKENS': True,
+    'BLACKLIST_AFTER_ROTATION': True,
+    'UPDATE_LAST_LOGIN': False,
+    'AUTH_HEADER_TYPES': ('Bearer',),
+    'TOKEN_REFRESH_SERIALIZER': 'Accounts.authentication.StaffClaimRefreshSerializer',
+}
+
 AUTH_USER_MODEL = 'Accounts.CustomUser'
 
 AUTHENTICATION_BACKENDS = [
@@ -138,8 +171,50 @@ AWS_S3_CUSTOM_DOMAIN = f'https://{AWS_STORAGE_BUCKET_NAME}.s3.{AWS_S3_REGION_NAM
 AWS_S3_FILE_OVERWRITE = False
 AWS_DEFAULT_ACL = None
 
-# Use S3 for file storage
-DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+# Use S3 for file storage. default_storage is built once per process and shared.
+STORAGES = {
+    'default': {'BACKEND': 'storages.backends.s3boto3.S3Boto3Storage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# Image variants are uploaded concurrently on a pool of MEDIA_UPLOAD_WORKERS threads;
+# each thread keeps its own S3 connection, so files are not split further.
+MEDIA_UPLOAD_WORKERS = config('MEDIA_UPLOAD_WORKERS', default=8, cast=int)
+AWS_S3_CLIENT_CONFIG = Config(
+    max_pool_connections=MEDIA_UPLOAD_WORKERS,
+    connect_timeout=5,
+    read_timeout=30,
+    retries={'max_attempts': 4, 'mode': 'standard'},
+)
+AWS_S3_TRANSFER_CONFIG = TransferConfig(use_threads=False)
+
+# Image uploads are rejected past either bound before any pixel is decoded.
+MAX_IMAGE_UPLOAD_SIZE = config('MAX_IMAGE_UPLOAD_SIZE', default=20 * 1024 * 1024, cast=int)
+MAX_IMAGE_PIXELS = config('MAX_IMAGE_PIXELS', default=40_000_000, cast=int)
+
+# Rendered payloads are shared by every worker through Redis; without REDIS_URL each process
+# keeps its own in-memory cache, which only suits a single-process development server
+# (production.py refuses to start without REDIS_URL).
+REDIS_URL = config('REDIS_URL', default='')
+CACHES = {
+    'default': (
+        {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL}
+        if REDIS_URL else
+        {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    ),
+}
+BOOK_CACHE_TIMEOUT = config('BOOK_CACHE_TIMEOUT', default=300, cast=int)
+PROFILE_CACHE_TIMEOUT = config('PROFILE_CACHE_TIMEOUT', default=300, cast=int)
+
+# Availability changes reach every worker's event streams through Redis pub/sub when REDIS_URL is
+# set; the local transport only reaches streams served by the process that made the change.
+BROADCAST_TRANSPORT = config(
+    'BROADCAST_TRANSPORT',
+    default='Common.broadcast.RedisTransport' if REDIS_URL else 'Common.broadcast.LocalTransport',
+)
+AVAILABILITY_STREAM_MAX_BOOKS = config('AVAILABILITY_STREAM_MAX_BOOKS', default=100, cast=int)
+AVAILABILITY_STREAM_HEARTBEAT = config('AVAILABILITY_STREAM_HEARTBEAT', default=15, cast=int)
+AVAILABILITY_STREAM_RETRY_MS = 3000
 
 # Configure media files to be stored in the 'books' folder in the S3 bucket
 MEDIA_URL = f'https://{AWS_STORAGE_BUCKET_NAME}.s3.{AWS_S3_REGION_NAME}.amazonaws.com/'
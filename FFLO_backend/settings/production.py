@@ -26,6 +26,10 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# Signals and management commands invalidate cached payloads from whichever process made the change,
+# so production must share one cache: a missing REDIS_URL fails at startup instead of serving stale data.
+REDIS_URL = config('REDIS_URL')
+
 AWS_ACCESS_KEY_ID = config('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = config('AWS_SECRET_ACCESS_KEY')
 AWS_STORAGE_BUCKET_NAME = config('AWS_STORAGE_BUCKET_NAME')
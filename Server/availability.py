@@ -0,0 +1,82 @@
+from django.db import connection, transaction
+from django.db.models import Q
+from .cache import invalidate_all_books, invalidate_books
+from .models import Book, BookHold, BookRental
+
+EXPECTED_COMMITMENTS = """
+    SELECT book.id, book.title, book.inventory,
+           book.committed_copies AS stored_committed, book.available AS stored_available,
+           COALESCE(rentals.committed, 0) + COALESCE(holds.committed, 0) AS committed
+    FROM {book} AS book
+    LEFT JOIN (
+        SELECT book_id, SUM(reserved::int + is_active::int) AS committed FROM {rental} GROUP BY book_id
+    ) AS rentals ON rentals.book_id = book.id
+    LEFT JOIN (
+        SELECT book_id, COUNT(*) AS committed FROM {hold} GROUP BY book_id
+    ) AS holds ON holds.book_id = book.id
+"""
+
+FIND_MISMATCHES = """
+    WITH expected AS ({expected})
+    SELECT id, title, stored_committed, stored_available, committed, GREATEST(inventory - committed, 0)
+    FROM expected
+    WHERE stored_committed <> committed OR stored_available <> GREATEST(inventory - committed, 0)
+    ORDER BY id
+"""
+
+FIX_MISMATCHES = """
+    WITH expected AS ({expected})
+    UPDATE {book} AS book
+    SET committed_copies = expected.committed, available = GREATEST(book.inventory - expected.committed, 0)
+    FROM expected
+    WHERE book.id = expected.id
+      AND (book.committed_copies <> expected.committed OR book.available <> GREATEST(book.inventory - expected.committed, 0))
+    RETURNING book.id, book.title, expected.stored_committed, expected.stored_available, book.committed_copies, book.available
+"""
+
+MISMATCH_COLUMNS = ('id', 'title', 'stored_committed', 'stored_available', 'committed', 'available')
+
+
+def reconcile_availability(dry_run=False):
+    """
+    Recomputes every book's committed copies and availability from rentals and
+    holds in a single set-based statement and returns the rows that were off.
+    With dry_run the mismatches are only reported.
+    """
+    tables = {
+        'book': connection.ops.quote_name(Book._meta.db_table),
+        'rental': connection.ops.quote_name(BookRental._meta.db_table),
+        'hold': connection.ops.quote_name(BookHold._meta.db_table),
+    }
+    expected = EXPECTED_COMMITMENTS.format(**tables)
+    statement = FIND_MISMATCHES if dry_run else FIX_MISMATCHES
+
+    with connection.cursor() as cursor:
+        cursor.execute(statement.format(expected=expected, **tables))
+        rows = [dict(zip(MISMATCH_COLUMNS, row)) for row in cursor.fetchall()]
+    if not dry_run:
+        invalidate_books(row['id'] for row in rows)
+    return sorted(rows, key=lambda row: row['id'])
+
+
+def reset_all_books(dry_run=False):
+    """
+    Ends every reservation and active rental, unarchives every book and
+    recomputes availability in one transaction of set-based statements.
+    With dry_run the transaction is rolled back after measuring the changes.
+    """
+    with transaction.atomic():
+        rentals_reset = BookRental.objects.filter(Q(reserved=True) | Q(is_active=True)).update(is_active=False, reserved=False)
+        books_unarchived = Book.objects.filter(archived=True).update(archived=False)
+        availability_changes = reconcile_availability()
+
+        if dry_run:
+            transaction.set_rollback(True)
+        else:
+            invalidate_all_books()
+
+    return {
+        'rentals_reset': rentals_reset,
+        'books_unarchived': books_unarchived,
+        'availability_changes': availability_changes,
+    }
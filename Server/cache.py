@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.dispatch import Signal
+from Common.cache import PayloadCache
+from .models import Book
+
+# BookInfoView's serialized book, invalidated by the signals in Server.signals.
+book_payload_cache = PayloadCache('book-payload', settings.BOOK_CACHE_TIMEOUT)
+
+# Sent with the ids of changed books, or None when every book may have changed,
+# so caches embedding book data elsewhere can drop it too.
+books_changed = Signal()
+
+
+def invalidate_books(book_ids):
+    book_ids = list(book_ids)
+    book_payload_cache.invalidate_many(book_ids)
+    books_changed.send(sender=Book, book_ids=book_ids)
+
+
+def invalidate_all_books():
+    book_payload_cache.invalidate_all()
+    books_changed.send(sender=Book, book_ids=None)
@@ -0,0 +1,80 @@
+import json
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from Common.broadcast import Broadcast
+from .models import Book, BookHold
+
+logger = logging.getLogger(__name__)
+
+# Fed from books_changed once each change commits, in whichever worker made it.
+availability_broadcast = Broadcast('book-availability')
+
+AVAILABILITY_FIELDS = ('id', 'inventory', 'available', 'on_hold', 'archived')
+
+
+def availability_snapshot(book_ids):
+    """The availability of each existing book in `book_ids`, as the stream sends it."""
+    on_hold = Exists(BookHold.objects.filter(book=OuterRef('pk'), hold_date__isnull=False))
+    return list(Book.objects.filter(pk__in=book_ids).annotate(on_hold=on_hold).values(*AVAILABILITY_FIELDS))
+
+
+def publish_availability(book_ids):
+    """
+    Broadcasts the current availability of `book_ids`, or a resync when None
+    says every book may have changed. A failing transport is logged rather than
+    raised: the write it reports has already committed.
+    """
+    try:
+        if book_ids is None:
+            availability_broadcast.publish({'resync': True})
+        elif books := availability_snapshot(book_ids):
+            availability_broadcast.publish({'books': books})
+    except Exception:
+        logger.exception("Could not publish availability for books %s", book_ids)
+
+
+def server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def availability_events(book_ids, heartbeat=None):
+    """
+    Yields server-sent events for `book_ids`: each book's availability once,
+    then again whenever it changes. A comment line goes out after `heartbeat`
+    idle seconds so proxies keep the connection open. When the broadcast asks
+    for a resync, or this stream fell too far behind, the books are re-read.
+    """
+    book_ids = set(book_ids)
+    heartbeat = heartbeat or settings.AVAILABILITY_STREAM_HEARTBEAT
+    sent = {}
+
+    def changes(books):
+        for book in books:
+            if book['id'] in book_ids and sent.get(book['id']) != book:
+                sent[book['id']] = book
+                yield server_sent_event('availability', book)
+
+    # Subscribed before the first read, so nothing committed in between is missed.
+    subscription = availability_broadcast.subscribe(
+        lambda message: message.get('resync') or any(book['id'] in book_ids for book in message['books'])
+    )
+    try:
+        yield f"retry: {settings.AVAILABILITY_STREAM_RETRY_MS}\n\n"
+        for event in changes(await sync_to_async(availability_snapshot)(book_ids)):
+            yield event
+
+        while True:
+            message = await subscription.get(heartbeat)
+            if message is None:
+                yield ": keep-alive\n\n"
+            elif message.get('resync') or subscription.overflowed:
+                subscription.drain()
+                for event in changes(await sync_to_async(availability_snapshot)(book_ids)):
+                    yield event
+            else:
+                for event in changes(message['books']):
+                    yield event
+    finally:
+        subscription.close()
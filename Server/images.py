@@ -0,0 +1,129 @@
+from datetime import timedelta
+from io import BytesIO
+from django.db import transaction
+from django.utils import timezone
+from Common.models import StoredImage
+from Common.storage import upload_files
+from Common.uploads import spool_upload
+from .models import BookImage, ImageJob
+
+MAX_ATTEMPTS = 3
+RETRY_DELAY = timedelta(seconds=30)
+# How long a claimed job stays invisible to other workers while it is encoded and uploaded.
+CLAIM_LEASE = timedelta(minutes=5)
+IMAGE_UPLOAD_FIELDS = ['image_url', 'image_small', 'placeholder', 'width', 'height', 'dominant_color', 'variants', 'stored', 'status']
+
+
+def enqueue_book_image(book, image_file):
+    """
+    Stores the upload as a pending BookImage plus its job, without encoding or
+    uploading anything. Content that was stored before is attached right away
+    as a ready image and never queued. Raises UploadRejected for uploads over
+    the size or pixel limits.
+    """
+    spool, sha256 = spool_upload(image_file)
+    with spool, transaction.atomic():
+        stored = StoredImage.objects.acquire(sha256, StoredImage.BOOK)
+        if stored:
+            image = BookImage(book=book, status=BookImage.READY)
+            stored.copy_to(image)
+            image.save()
+            return image
+
+        image = BookImage.objects.create(book=book, status=BookImage.PENDING)
+        # The job row is the queue's only copy of the upload; its size is bounded by MAX_IMAGE_UPLOAD_SIZE.
+        ImageJob.objects.create(image=image, filename=image_file.name, sha256=sha256, data=spool.read())
+    return image
+
+
+def claim_jobs(batch_size):
+    """
+    Leases up to `batch_size` due jobs in one short transaction, skipping rows
+    other workers are claiming. A leased job is not due again until CLAIM_LEASE
+    has passed, so a worker that dies mid-batch only delays its jobs.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            ImageJob.objects.select_for_update(skip_locked=True, of=('self',))
+            .select_related('image')
+            .filter(attempts__lt=MAX_ATTEMPTS, run_after__lte=now)
+            .order_by('id')[:batch_size]
+        )
+        ImageJob.objects.filter(pk__in=[job.pk for job in jobs]).update(run_after=now + CLAIM_LEASE)
+    return jobs
+
+
+def process_image_batch(batch_size=10):
+    """
+    Claims up to `batch_size` due jobs and processes them with no transaction
+    open: images whose content is already stored are attached to it, every
+    other one is encoded, then all variants of all images are uploaded
+    concurrently. Each job is then finalized in its own short transaction,
+    registering its upload by content hash.
+
+    Returns the images still present, empty when nothing is due. An image
+    deleted while its job ran is skipped; its files are left to gc_media. Each
+    image succeeds or fails on its own; a failed one is retried after a growing
+    delay, and after MAX_ATTEMPTS it is marked failed with the job kept for its
+    last error.
+    """
+    jobs = claim_jobs(batch_size)
+
+    errors, prepared, reused = {}, [], set()
+    for job in jobs:
+        if StoredImage.objects.filter(sha256=job.sha256, kind=StoredImage.BOOK).exists():
+            reused.add(job.pk)
+            continue
+        try:
+            prepared.append((job, job.image.prepare_upload(BytesIO(job.data), job.filename)))
+        except Exception as e:
+            errors[job.pk] = e
+
+    uploads = {}
+    for (job, files), (urls, error) in zip(prepared, upload_files([files for job, files in prepared])):
+        if error:
+            errors[job.pk] = error
+        else:
+            uploads[job.pk] = urls
+
+    return [job.image for job in jobs if finalize_job(job, job.pk in reused, uploads.get(job.pk), errors.get(job.pk))]
+
+
+def finalize_job(job, reused, urls, error):
+    """
+    Records the outcome of one job in a short transaction. Returns False when
+    its image was deleted meanwhile, in which case the job went with it.
+    """
+    with transaction.atomic():
+        # Locking the image keeps it, and through the cascade its job, in place until commit.
+        if not BookImage.objects.select_for_update().filter(pk=job.image_id).exists():
+            return False
+
+        if reused:
+            stored = StoredImage.objects.acquire(job.sha256, StoredImage.BOOK)
+            if stored:
+                stored.copy_to(job.image)
+            else:
+                error = error or LookupError("The stored image was collected before it could be reused")
+        elif urls:
+            job.image.apply_upload(urls)
+            StoredImage.objects.register(job.sha256, StoredImage.BOOK, job.image).copy_to(job.image)
+
+        if error:
+            record_failure(job, error)
+        else:
+            job.image.status = BookImage.READY
+            job.image.save(update_fields=IMAGE_UPLOAD_FIELDS)
+            job.delete()
+    return True
+
+
+def record_failure(job, error):
+    job.attempts += 1
+    job.last_error = f"{type(error).__name__}: {error}"
+    job.run_after = timezone.now() + RETRY_DELAY * job.attempts
+    job.save(update_fields=['attempts', 'last_error', 'run_after'])
+    if job.attempts >= MAX_ATTEMPTS:
+        job.image.status = BookImage.FAILED
+        job.image.save(update_fields=['status'])
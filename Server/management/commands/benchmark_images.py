@@ -0,0 +1,136 @@
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from io import BytesIO
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+from Common.utils import encode_webp_variants
+
+# The two variants the ffmpeg pipeline produced: full size plus a 20px thumbnail.
+VARIANTS = {'image': None, 'small': 20}
+
+
+def encode_in_process(data):
+    variants = encode_webp_variants(BytesIO(data), VARIANTS)
+    return sum(len(buffer.getvalue()) for buffer in variants.values())
+
+
+def encode_with_ffmpeg(data):
+    """The previous pipeline: upload written to /tmp, one ffmpeg launch per variant plus a temporary PNG."""
+    workdir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(workdir, 'upload.jpg')
+        with open(source, 'wb') as upload:
+            upload.write(data)
+
+        webp = f"{source}.webp"
+        subprocess.run(['ffmpeg', '-loglevel', 'error', '-i', source, '-pix_fmt', 'yuv420p', '-q:v', '80', webp], check=True)
+
+        small_png = os.path.join(workdir, 'small.png')
+        small_webp = os.path.join(workdir, 'small.webp')
+        with Image.open(source) as img:
+            img.thumbnail((VARIANTS['small'], VARIANTS['small']), Image.LANCZOS)
+            img.save(small_png, 'PNG')
+        subprocess.run(['ffmpeg', '-loglevel', 'error', '-i', small_png, '-pix_fmt', 'yuv420p', '-q:v', '80', small_webp], check=True)
+
+        size = 0
+        for path in (webp, small_webp):
+            with open(path, 'rb') as encoded:
+                size += len(encoded.read())
+        return size
+    finally:
+        shutil.rmtree(workdir)
+
+
+PIPELINES = {
+    'inprocess': encode_in_process,
+    'ffmpeg': encode_with_ffmpeg,
+}
+
+
+def run_pipeline(name, images, results):
+    """Runs in a fresh process so ru_maxrss reflects this pipeline alone."""
+    encode = PIPELINES[name]
+    started = time.perf_counter()
+    encoded_bytes = sum(encode(data) for data in images)
+    elapsed = time.perf_counter() - started
+    results.put({
+        'elapsed': elapsed,
+        'encoded_bytes': encoded_bytes,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'peak_child_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    })
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the in-process Pillow WebP encoder with the previous ffmpeg/tmp-file pipeline on the same "
+        "images, reporting throughput and peak RSS. Uploading is left out; both sides stop at the encoded bytes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('sources', nargs='*', help="Image files to encode. Synthetic photos are generated when omitted.")
+        parser.add_argument('--images', type=int, default=20, help="Synthetic images to generate.")
+        parser.add_argument('--size', default='3000x2000', help="Synthetic image size, WIDTHxHEIGHT.")
+        parser.add_argument('--pipeline', choices=sorted(PIPELINES), action='append', help="Defaults to every available pipeline.")
+
+    def handle(self, *args, **options):
+        images = self.load_sources(options['sources']) if options['sources'] else self.synthesize(options['images'], options['size'])
+        pipelines = options['pipeline'] or sorted(PIPELINES)
+        if 'ffmpeg' in pipelines and not shutil.which('ffmpeg'):
+            self.stdout.write(self.style.WARNING("ffmpeg not found on PATH, skipping the ffmpeg pipeline."))
+            pipelines = [name for name in pipelines if name != 'ffmpeg']
+
+        megapixels = sum(self.megapixels(data) for data in images)
+        self.stdout.write(f"{len(images)} image(s), {megapixels:.1f} MP, {sum(map(len, images)) / 1e6:.1f} MB of input")
+
+        context = multiprocessing.get_context('spawn')
+        for name in pipelines:
+            results = context.Queue()
+            process = context.Process(target=run_pipeline, args=(name, images, results))
+            process.start()
+            result = results.get()
+            process.join()
+            self.report(name, len(images), megapixels, result)
+
+    def load_sources(self, paths):
+        images = []
+        for path in paths:
+            try:
+                with open(path, 'rb') as source:
+                    images.append(source.read())
+            except OSError as e:
+                raise CommandError(f"Cannot read {path}: {e}")
+        return images
+
+    def synthesize(self, count, size):
+        try:
+            width, height = (int(value) for value in size.lower().split('x'))
+        except ValueError:
+            raise CommandError("--size must look like 3000x2000")
+
+        images = []
+        for index in range(count):
+            # Noise over a gradient compresses roughly like a photo, unlike a flat colour.
+            noise = Image.effect_noise((width, height), 40 + index % 20).convert('RGB')
+            gradient = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+            buffer = BytesIO()
+            Image.blend(noise, gradient, 0.5).save(buffer, 'JPEG', quality=90)
+            images.append(buffer.getvalue())
+        return images
+
+    def megapixels(self, data):
+        with Image.open(BytesIO(data)) as image:
+            return image.width * image.height / 1e6
+
+    def report(self, name, count, megapixels, result):
+        elapsed = result['elapsed']
+        self.stdout.write(
+            f"{name:<10} {elapsed:.2f}s  {count / elapsed:.1f} images/s  {megapixels / elapsed:.1f} MP/s  "
+            f"peak RSS {result['peak_rss_kb'] / 1024:.0f} MB (children {result['peak_child_rss_kb'] / 1024:.0f} MB)  "
+            f"output {result['encoded_bytes'] / 1e6:.1f} MB"
+        )
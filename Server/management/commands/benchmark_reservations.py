@@ -0,0 +1,210 @@
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+from django.db.models import Count, Q
+from Accounts.models import CustomUser, Membership
+from Server.models import Book, BookHold, BookRental
+from Server import reservations
+from Server.reservations import MONTHLY_BOOK_LIMIT, ReservationError
+
+
+def legacy_reserve(book, user):
+    """The read-check-write BookReservationView used before the reservation service: no lock, no transaction."""
+    if book.available <= 0:
+        raise ReservationError(f"No available copies for {book.title}")
+    membership = user.memberships.filter(active=True).first()
+    if membership.monthly_books >= MONTHLY_BOOK_LIMIT:
+        raise ReservationError(f"You have reached your limit of {MONTHLY_BOOK_LIMIT} books for this month")
+    if BookRental.objects.filter(user=user, return_date__isnull=True).exists():
+        raise ReservationError("You already have an active rental")
+    BookRental.objects.create(book=book, user=user, reserved=True)
+    membership.monthly_books += 1
+    membership.save()
+
+
+def legacy_cancel(book, user):
+    reservation = BookRental.objects.filter(book=book, user=user, reserved=True, is_active=False).first()
+    if not reservation:
+        raise ReservationError("No matching reservation found for this book.")
+    membership = user.memberships.filter(active=True).first()
+    membership.monthly_books -= 1
+    membership.save()
+    reservation.delete()
+
+
+def legacy_hold(book, user):
+    if book.available <= 0:
+        raise ReservationError(f"No available copies for {book.title}")
+    if book.holds.filter(hold_date__isnull=False).exists():
+        raise ReservationError(f"Book '{book.title}' is already on hold")
+    BookHold.objects.create(book=book, user=user)
+
+
+def legacy_remove_hold(book):
+    hold = book.holds.filter(hold_date__isnull=False).first()
+    if not hold:
+        raise ReservationError(f"No active hold found for {book.title}")
+    hold.delete()
+
+
+STRATEGIES = {
+    'service': {
+        'reserve': reservations.reserve_book,
+        'cancel': reservations.cancel_reservation,
+        'hold': reservations.place_hold,
+        'remove_hold': lambda book, user: reservations.remove_hold(book),
+    },
+    'legacy': {
+        'reserve': legacy_reserve,
+        'cancel': legacy_cancel,
+        'hold': legacy_hold,
+        'remove_hold': lambda book, user: legacy_remove_hold(book),
+    },
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Fires concurrent reservations, cancellations and holds at one scarce book from many threads, then checks "
+        "the availability ledger, per-user limits and hold uniqueness. Reports throughput and how many operations "
+        "were refused. The seeded users and book are deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--operations', type=int, default=50, help="Operations per thread.")
+        parser.add_argument('--copies', type=int, default=5, help="Inventory of the contended book.")
+        parser.add_argument('--readers', type=int, default=40, help="Members competing for the book.")
+        parser.add_argument('--cancel-rate', type=float, default=0.5, help="Share of successful reservations cancelled straight away.")
+        parser.add_argument('--hold-rate', type=float, default=0.1, help="Share of operations that toggle a staff hold.")
+        parser.add_argument('--strategy', choices=sorted(STRATEGIES), action='append', help="Defaults to every strategy.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['copies'] < 1 or options['readers'] < 1:
+            raise CommandError("--threads, --copies and --readers must be positive.")
+
+        for name in options['strategy'] or sorted(STRATEGIES):
+            book, staff, readers = self.seed(options['copies'], options['readers'])
+            try:
+                outcomes, elapsed = self.run(STRATEGIES[name], book, staff, readers, options)
+                violations = self.check_invariants(book, readers)
+                self.report(name, outcomes, elapsed, violations)
+            finally:
+                book.delete()
+                CustomUser.objects.filter(pk__in=[staff.pk, *(reader.pk for reader in readers)]).delete()
+
+    def seed(self, copies, reader_count):
+        run = uuid.uuid4().hex[:12]
+        book = Book.objects.create(title=f"benchmark-reservations-{run}", author="Benchmark", inventory=copies)
+        staff = CustomUser.objects.create(email=f"bench-staff-{run}@example.invalid", first_name="Staff", is_staff=True)
+        readers = CustomUser.objects.bulk_create([
+            CustomUser(email=f"bench-{run}-{index}@example.invalid", first_name="Reader") for index in range(reader_count)
+        ])
+        Membership.objects.bulk_create([Membership(user=reader) for reader in readers])
+        return book, staff, readers
+
+    def run(self, strategy, book, staff, readers, options):
+        outcomes = Counter()
+        outcomes_lock = threading.Lock()
+        start = threading.Barrier(options['threads'])
+
+        def record(operation, outcome):
+            with outcomes_lock:
+                outcomes[operation, outcome] += 1
+
+        def attempt(operation, user):
+            try:
+                # Each request loads the book afresh, as the views do.
+                strategy[operation](Book.objects.get(pk=book.pk), user)
+            except ReservationError as e:
+                record(operation, str(e).replace(book.title, '<book>'))
+                return False
+            except DatabaseError as e:
+                record(operation, f"database error: {type(e).__name__}")
+                return False
+            record(operation, 'ok')
+            return True
+
+        def worker(index):
+            rng = random.Random(options['seed'] * 1000 + index)
+            try:
+                start.wait()
+                for _ in range(options['operations']):
+                    if rng.random() < options['hold_rate']:
+                        attempt(rng.choice(('hold', 'remove_hold')), staff)
+                        continue
+                    reader = rng.choice(readers)
+                    if attempt('reserve', reader) and rng.random() < options['cancel_rate']:
+                        attempt('cancel', reader)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes, time.perf_counter() - started
+
+    def check_invariants(self, book, readers):
+        violations = []
+        book.refresh_from_db()
+        rentals = BookRental.objects.filter(book=book)
+        committed = sum(rental.commitment for rental in rentals) + BookHold.objects.filter(book=book).count()
+
+        if committed > book.inventory:
+            violations.append(f"oversold: {committed} copies committed out of {book.inventory}")
+        if (book.committed_copies, book.available) != (committed, max(book.inventory - committed, 0)):
+            violations.append(
+                f"ledger drift: stored committed {book.committed_copies}, available {book.available}; "
+                f"rentals and holds commit {committed}"
+            )
+
+        holds = BookHold.objects.filter(book=book).count()
+        if holds > 1:
+            violations.append(f"{holds} holds on one book")
+
+        rentals_per_user = defaultdict(int, (
+            (row['user'], row['count']) for row in rentals.values('user').annotate(count=Count('id'))
+        ))
+        open_rentals = rentals.filter(return_date__isnull=True).values('user').annotate(count=Count('id')).filter(count__gt=1).count()
+        if open_rentals:
+            violations.append(f"{open_rentals} user(s) with more than one open rental")
+
+        # Reservations are the only thing counted and cancellations delete them, so every counter must match its rows.
+        memberships = Membership.objects.filter(user__in=readers)
+        lost = sum(1 for membership in memberships if membership.monthly_books != rentals_per_user[membership.user_id])
+        over_limit = memberships.filter(Q(monthly_books__gt=MONTHLY_BOOK_LIMIT) | Q(monthly_books__lt=0)).count()
+        if lost:
+            violations.append(f"{lost} membership(s) whose monthly_books disagrees with their reservations")
+        if over_limit:
+            violations.append(f"{over_limit} membership(s) outside 0..{MONTHLY_BOOK_LIMIT} monthly books")
+        return violations
+
+    def report(self, name, outcomes, elapsed, violations):
+        total = sum(outcomes.values())
+        refused = sum(count for (operation, outcome), count in outcomes.items() if outcome != 'ok')
+        self.stdout.write(
+            f"{name:<8} {total} operations in {elapsed:.2f}s, {total / elapsed:.0f} ops/s, "
+            f"{refused / total:.1%} refused" if total else f"{name:<8} no operations"
+        )
+
+        for operation in STRATEGIES[name]:
+            results = {outcome: count for (op, outcome), count in outcomes.items() if op == operation}
+            if not results:
+                continue
+            attempts = sum(results.values())
+            refusals = ', '.join(f"{outcome} x{count}" for outcome, count in sorted(results.items()) if outcome != 'ok')
+            self.stdout.write(f"  {operation:<12} {attempts} attempts, {results.get('ok', 0)} ok" + (f"; {refusals}" if refusals else ''))
+
+        if violations:
+            for violation in violations:
+                self.stdout.write(self.style.ERROR(f"  invariant violated: {violation}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("  invariants held"))
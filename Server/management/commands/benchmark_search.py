@@ -0,0 +1,73 @@
+import random
+import statistics
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.test import APIRequestFactory
+from Server.models import Book, book_search_vector
+from Server.views import BookSearchView
+
+WORDS = [
+    "prince", "petit", "nuit", "jardin", "ocean", "mystery", "garden", "voyage", "histoire", "shadow",
+    "lumière", "river", "maison", "winter", "étoile", "forest", "silence", "memory", "chemin", "island",
+    "secret", "hiver", "fleur", "storm", "reine", "dragon", "mer", "city", "amour", "light",
+]
+
+QUERIES = {
+    "single word": ["prince", "garden", "étoile", "dragon"],
+    "phrase": ["petit prince", "winter garden", "chemin étoile"],
+    "typo": ["pettit prinse", "gardden", "misteri"],
+}
+
+
+class Command(BaseCommand):
+    help = "Seeds a throwaway catalog, times /api/books/search/ and reports latency percentiles. All data is rolled back."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=100000)
+        parser.add_argument('--runs', type=int, default=100, help="Requests timed per query group.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.seed(options['books'], options['batch_size'])
+            view = BookSearchView.as_view()
+            host = settings.ALLOWED_HOSTS[0].lstrip('.') if settings.ALLOWED_HOSTS else 'localhost'
+            factory = APIRequestFactory(HTTP_HOST=host.replace('*', 'localhost'))
+
+            for group, queries in QUERIES.items():
+                timings = []
+                for run in range(options['runs']):
+                    request = factory.get('/api/books/search/', {'q': queries[run % len(queries)]})
+                    started = time.perf_counter()
+                    view(request).render()
+                    timings.append((time.perf_counter() - started) * 1000)
+                self.report(group, timings)
+
+            transaction.set_rollback(True)
+
+    def seed(self, count, batch_size):
+        self.stdout.write(f"Seeding {count} books...")
+        started = time.perf_counter()
+        rng = random.Random(0)
+        for start in range(0, count, batch_size):
+            Book.objects.bulk_create([
+                Book(
+                    title=f"{' '.join(rng.sample(WORDS, 3))} {index}",
+                    author=' '.join(rng.sample(WORDS, 2)).title(),
+                    description=' '.join(rng.choices(WORDS, k=20)),
+                )
+                for index in range(start, min(start + batch_size, count))
+            ])
+        Book.objects.update(search_vector=book_search_vector())
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {connection.ops.quote_name(Book._meta.db_table)}")
+        self.stdout.write(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+    def report(self, group, timings):
+        percentiles = statistics.quantiles(timings, n=100, method='inclusive')
+        self.stdout.write(
+            f"{group:<12} runs={len(timings)} p50={percentiles[49]:.1f}ms "
+            f"p95={percentiles[94]:.1f}ms max={max(timings):.1f}ms"
+        )
@@ -0,0 +1,38 @@
+import time
+from django.core.management.base import BaseCommand
+from Server.images import process_image_batch
+from Server.models import BookImage
+
+
+class Command(BaseCommand):
+    help = (
+        "Encodes and uploads queued book images. Runs until stopped, polling the job table when it is empty; "
+        "with --once it drains the queue and exits. Several workers can run side by side."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty.")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--batch-size', type=int, default=10, help="Jobs claimed at once; their uploads run concurrently.")
+
+    def handle(self, *args, **options):
+        processed = failed = 0
+        while True:
+            images = process_image_batch(options['batch_size'])
+            if not images:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            for image in images:
+                if image.status == BookImage.READY:
+                    processed += 1
+                    self.stdout.write(f"Processed image {image.id} for book {image.book_id}")
+                elif image.status == BookImage.FAILED:
+                    failed += 1
+                    self.stderr.write(f"Gave up on image {image.id} for book {image.book_id}: {image.job.last_error}")
+                else:
+                    self.stderr.write(f"Image {image.id} for book {image.book_id} will be retried: {image.job.last_error}")
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} image(s), {failed} failed."))
@@ -0,0 +1,69 @@
+import math
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from Server.cache import invalidate_books
+from Server.models import Book, BookRating
+
+
+class Command(BaseCommand):
+    help = "Recomputes every book's rating counters from BookRating and reports any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report drift without writing corrections.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            expected = self.expected_counters()
+            drifted = []
+
+            for book in Book.objects.only('id', 'title', *Book.RATING_FIELDS).select_for_update().iterator(chunk_size=2000):
+                counters = expected.get(book.id, self.empty_counters())
+                changes = {
+                    field: (getattr(book, field), value)
+                    for field, value in counters.items()
+                    if not self.matches(getattr(book, field), value)
+                }
+                if not changes:
+                    continue
+
+                self.stdout.write(f"Book {book.id} '{book.title}': " + ', '.join(
+                    f"{field} {stored} -> {value}" for field, (stored, value) in changes.items()
+                ))
+                for field, (stored, value) in changes.items():
+                    setattr(book, field, value)
+                drifted.append(book)
+
+            if drifted and not options['dry_run']:
+                Book.objects.bulk_update(drifted, Book.RATING_FIELDS, batch_size=500)
+                invalidate_books(book.pk for book in drifted)
+
+        action = "Would correct" if options['dry_run'] else "Corrected"
+        self.stdout.write(self.style.SUCCESS(f"{action} {len(drifted)} book(s) with drifted rating counters."))
+
+    def expected_counters(self):
+        rows = (
+            BookRating.objects.filter(rating__isnull=False)
+            .values('book')
+            .annotate(
+                rating_sum=Sum('rating'),
+                rating_count=Count('id'),
+                **{f'rating_count_{star}': Count('id', filter=Q(rating=star)) for star in range(1, 6)},
+            )
+        )
+        expected = {}
+        for row in rows:
+            book_id = row.pop('book')
+            row['rating'] = row['rating_sum'] / row['rating_count']
+            expected[book_id] = row
+        return expected
+
+    def empty_counters(self):
+        counters = {field: 0 for field in Book.RATING_FIELDS}
+        counters['rating'] = None
+        return counters
+
+    def matches(self, stored, value):
+        if stored is None or value is None:
+            return stored is value
+        return math.isclose(stored, value, rel_tol=1e-9)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from Server.availability import reconcile_availability
+
+
+class Command(BaseCommand):
+    help = "Recomputes every book's availability from rentals and holds in one statement and reports mismatches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report mismatches without correcting them.")
+
+    def handle(self, *args, **options):
+        mismatches = reconcile_availability(dry_run=options['dry_run'])
+
+        for row in mismatches:
+            self.stdout.write(
+                f"Book {row['id']} '{row['title']}': committed {row['stored_committed']} -> {row['committed']}, "
+                f"available {row['stored_available']} -> {row['available']}"
+            )
+
+        action = "Would correct" if options['dry_run'] else "Corrected"
+        self.stdout.write(self.style.SUCCESS(f"{action} {len(mismatches)} book(s) with mismatched availability."))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from Server.availability import reset_all_books
+
+
+class Command(BaseCommand):
+    help = "Ends all reservations and rentals, unarchives every book and recomputes availability."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Show what would change and roll everything back.")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        result = reset_all_books(dry_run=dry_run)
+
+        if options['verbosity'] > 1:
+            for row in result['availability_changes']:
+                self.stdout.write(
+                    f"Book {row['id']} '{row['title']}': available {row['stored_available']} -> {row['available']}"
+                )
+
+        prefix = "Would reset" if dry_run else "Reset"
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} {result['rentals_reset']} rental(s), unarchive {result['books_unarchived']} book(s) "
+            f"and change availability on {len(result['availability_changes'])} book(s)."
+        ))
@@ -0,0 +1,70 @@
+# Generated by Django 5.1.1 on 2026-10-17 10:15
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_rating_counters(apps, schema_editor):
+    Book = apps.get_model('Server', 'Book')
+    BookRating = apps.get_model('Server', 'BookRating')
+
+    def per_book(aggregate, **filters):
+        ratings = BookRating.objects.filter(book=OuterRef('pk'), rating__isnull=False, **filters)
+        return Coalesce(Subquery(ratings.values('book').annotate(total=aggregate).values('total')), 0)
+
+    Book.objects.update(
+        rating_sum=per_book(Sum('rating')),
+        rating_count=per_book(Count('id')),
+        rating_count_1=per_book(Count('id'), rating=1),
+        rating_count_2=per_book(Count('id'), rating=2),
+        rating_count_3=per_book(Count('id'), rating=3),
+        rating_count_4=per_book(Count('id'), rating=4),
+        rating_count_5=per_book(Count('id'), rating=5),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Server', '0011_book_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_count_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_count_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_count_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_count_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_count_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_rating_counters, migrations.RunPython.noop),
+    ]
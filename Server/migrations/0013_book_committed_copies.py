@@ -0,0 +1,36 @@
+# Generated by Django 5.1.1 on 2026-10-17 10:17
+
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+
+def populate_committed_copies(apps, schema_editor):
+    Book = apps.get_model('Server', 'Book')
+    BookRental = apps.get_model('Server', 'BookRental')
+    BookHold = apps.get_model('Server', 'BookHold')
+
+    def per_book(model, **filters):
+        rows = model.objects.filter(book=OuterRef('pk'), **filters).values('book').annotate(total=Count('id')).values('total')
+        return Coalesce(Subquery(rows), 0)
+
+    Book.objects.update(
+        committed_copies=per_book(BookRental, reserved=True) + per_book(BookRental, is_active=True) + per_book(BookHold),
+    )
+    Book.objects.update(available=Greatest(F('inventory') - F('committed_copies'), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Server', '0012_book_rating_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='committed_copies',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_committed_copies, migrations.RunPython.noop),
+    ]
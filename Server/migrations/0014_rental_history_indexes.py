@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-17 10:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Server', '0013_book_committed_copies'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookrental',
+            index=models.Index(fields=['book', '-rental_date', '-id'], name='bookrental_book_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookrental',
+            index=models.Index(fields=['user', '-rental_date', '-id'], name='bookrental_user_date_idx'),
+        ),
+    ]
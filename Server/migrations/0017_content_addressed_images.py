@@ -0,0 +1,35 @@
+# Generated by Django 5.1.1 on 2026-10-17 10:41
+
+import hashlib
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def hash_queued_images(apps, schema_editor):
+    ImageJob = apps.get_model('Server', 'ImageJob')
+    for job in ImageJob.objects.only('id', 'data').iterator(chunk_size=50):
+        job.sha256 = hashlib.sha256(job.data).hexdigest()
+        job.save(update_fields=['sha256'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Common', '0001_stored_images'),
+        ('Server', '0016_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookimage',
+            name='stored',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='book_images', to='Common.storedimage'),
+        ),
+        migrations.AddField(
+            model_name='imagejob',
+            name='sha256',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        migrations.RunPython(hash_queued_images, migrations.RunPython.noop),
+    ]
@@ -1,17 +1,21 @@
 import os
 import uuid
 import re
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, SearchVectorField, TrigramSimilarity
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.core.files.storage import default_storage
-from storages.backends.s3boto3 import S3Boto3Storage
 from Accounts.models import CustomUser
 from Payments.models import Payment
 from django.utils import timezone
-from Common.utils import convert_to_webp, create_small_image
-from django.db.models import Avg
+from Common.models import StoredImage
+from Common.storage import upload_files
+from Common.uploads import spool_upload
+from Common.utils import encode_responsive_webp
+from django.db.models import Exists, ExpressionWrapper, F, OuterRef
+from django.db.models.functions import Cast, Greatest, NullIf
 
 class Category(models.Model):
     name = models.CharField(max_length=15, unique=True)
@@ -25,18 +29,105 @@ class Category(models.Model):
         return self.name
 
 
+BOOK_SEARCH_FIELDS = {'title', 'author', 'description'}
+
+
+def book_search_vector():
+    # The 'simple' configuration avoids stemming French titles with English rules (and vice versa).
+    return (
+        SearchVector('title', weight='A', config='simple')
+        + SearchVector('author', weight='B', config='simple')
+        + SearchVector('description', weight='C', config='simple')
+    )
+
+
+class BookQuerySet(models.QuerySet):
+    def with_catalog_data(self):
+        """Annotates hold state and prefetches nested relations so a list serializes in constant queries."""
+        active_holds = BookHold.objects.filter(book=OuterRef('pk'), hold_date__isnull=False)
+        return self.annotate(
+            has_active_hold=Exists(active_holds),
+        ).prefetch_related('images', 'ratings', 'categories')
+
+    def apply_rating_change(self, old_rating=None, new_rating=None):
+        """Shifts the denormalized rating counters in a single UPDATE so concurrent ratings never lose increments."""
+        if old_rating == new_rating:
+            return 0
+
+        count_delta = (new_rating is not None) - (old_rating is not None)
+        new_sum = F('rating_sum') + ((new_rating or 0) - (old_rating or 0))
+        new_count = F('rating_count') + count_delta
+        updates = {
+            'rating_sum': new_sum,
+            'rating_count': new_count,
+            'rating': ExpressionWrapper(
+                Cast(new_sum, models.FloatField()) / NullIf(new_count, 0),
+                output_field=models.FloatField(),
+            ),
+        }
+        if old_rating is not None:
+            updates[f'rating_count_{old_rating}'] = F(f'rating_count_{old_rating}') - 1
+        if new_rating is not None:
+            updates[f'rating_count_{new_rating}'] = F(f'rating_count_{new_rating}') + 1
+        return self.update(**updates)
+
+    def adjust_committed(self, delta):
+        """Moves the committed-copies ledger by `delta` and derives availability from it in the same UPDATE."""
+        if not delta:
+            return 0
+        committed = F('committed_copies') + delta
+        return self.update(committed_copies=committed, available=Greatest(F('inventory') - committed, 0))
+
+    def search(self, query):
+        """Ranks full-text matches, falling back to trigram similarity on the title when nothing matches."""
+        search_query = SearchQuery(query, config='simple', search_type='websearch')
+        matches = self.filter(search_vector=search_query)
+        if matches.exists():
+            return matches.annotate(rank=SearchRank(F('search_vector'), search_query)).order_by('-rank', 'id')
+
+        return (
+            self.filter(title__trigram_similar=query)
+            .annotate(rank=TrigramSimilarity('title', query))
+            .order_by('-rank', 'id')
+        )
+
+
 class Book(models.Model):
     title = models.CharField(max_length=255, unique=True)
     author = models.CharField(max_length=255)
     description = models.CharField(max_length=1200, blank=True, null=True)
     language = models.CharField(max_length=20, default="Français")
     rating = models.FloatField(null=True, blank=True)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_count_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_count_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_count_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_count_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_count_5 = models.PositiveIntegerField(default=0, editable=False)
     inventory = models.PositiveIntegerField(default=1)
     available = models.PositiveIntegerField(default=1)
+    # Copies tied up by reservations, active rentals and holds; adjusted by their save/delete signals.
+    committed_copies = models.PositiveIntegerField(default=0, editable=False)
     created_date = models.DateTimeField(auto_now_add=True)
     flair = models.CharField(max_length=10, blank=True, null=True)
     archived = models.BooleanField(default=False)
     categories = models.ManyToManyField(Category, related_name='books', blank=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = BookQuerySet.as_manager()
+
+    # Written only through set-based UPDATEs, so a stale instance must never save them back.
+    RATING_FIELDS = ('rating', 'rating_sum', 'rating_count', 'rating_count_1', 'rating_count_2', 'rating_count_3', 'rating_count_4', 'rating_count_5')
+    AVAILABILITY_FIELDS = ('available', 'committed_copies')
+    MAINTAINED_FIELDS = RATING_FIELDS + AVAILABILITY_FIELDS + ('search_vector',)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_date', 'id'], name='book_created_date_id_idx'),
+            GinIndex(fields=['search_vector'], name='book_search_vector_idx'),
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='book_title_trgm_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -45,21 +136,41 @@ class Book(models.Model):
         return bool(self.on_hold_by)
 
     def get_rating(self):
-        average = self.ratings.aggregate(average=Avg('rating'))['average']
-        return average
+        return self.rating
 
-    def update_available(self):
-        if not self.pk:
-          return
-        reserved_count = BookRental.objects.filter(book=self, reserved=True).count()
-        active_count = BookRental.objects.filter(book=self, is_active=True).count()
-        hold_count = BookHold.objects.filter(book=self).count()
+    @property
+    def rating_histogram(self):
+        return {star: getattr(self, f'rating_count_{star}') for star in range(1, 6)}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stored_inventory = instance.__dict__.get('inventory')
+        return instance
 
-        self.available = max(self.inventory - (reserved_count + active_count + hold_count), 0)
+    def update_available(self):
+        self.available = max(self.inventory - self.committed_copies, 0)
 
     def save(self, *args, **kwargs):
-        self.update_available()
-        super(Book, self).save(*args, **kwargs)
+        if self._state.adding:
+            self.update_available()
+            super(Book, self).save(*args, **kwargs)
+            self._stored_inventory = self.inventory
+            return
+
+        if kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.MAINTAINED_FIELDS
+            ]
+        inventory_changed = 'inventory' in kwargs['update_fields'] and self.inventory != getattr(self, '_stored_inventory', None)
+
+        with transaction.atomic():
+            super(Book, self).save(*args, **kwargs)
+            if inventory_changed:
+                Book.objects.filter(pk=self.pk).update(available=Greatest(F('inventory') - F('committed_copies'), 0))
+                self.refresh_from_db(fields=self.AVAILABILITY_FIELDS)
+        self._stored_inventory = self.inventory
 
 
 class BookRating(models.Model):
@@ -69,6 +180,15 @@ class BookRating(models.Model):
 
     class Meta:
         unique_together = ('book', 'user')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so the rating signals can move the book counters from the stored value.
+        # A deferred rating is read in pre_save instead.
+        if 'rating' in instance.__dict__:
+            instance._stored_rating = instance.rating
+        return instance
     
     def __str__(self):
         return f"Rating of {self.rating} for {self.book.title} by {self.user.username}"
@@ -89,9 +209,26 @@ class Bookmark(models.Model):
 
 
 class BookImage(models.Model):
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (READY, 'Ready'), (FAILED, 'Failed')]
+
+    RESPONSIVE_WIDTHS = (160, 320, 640, 1280)
+    SMALL_SIZE = 20
+
     book = models.ForeignKey(Book, related_name="images", on_delete=models.CASCADE)
     image_url = models.URLField(blank=True, null=True)
     image_small = models.URLField(blank=True, null=True)
+    # The small variant as a data: URI, so lists paint a blurred cover without fetching image_small.
+    placeholder = models.TextField(blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=READY)
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    dominant_color = models.CharField(max_length=7, blank=True)
+    # [{"width": 160, "height": 240, "url": "..."}, ...] narrowest first, excluding the original.
+    variants = models.JSONField(default=list, blank=True)
+    stored = models.ForeignKey(StoredImage, related_name="book_images", on_delete=models.SET_NULL, blank=True, null=True)
 
     def clean_filename(self, filename):
         filename = filename.lower()
@@ -104,50 +241,79 @@ class BookImage(models.Model):
 
         return f"{name}{ext}"
 
+    def prepare_upload(self, image_file, filename):
+        """
+        Decodes the upload once and encodes the original, the small placeholder and
+        every responsive width into {key: (storage name, buffer)} for upload_files.
+        Intrinsic size, dominant colour and the inline placeholder are set on the
+        instance right away.
+        """
+        clean_filename = self.clean_filename(filename)
+        encoded = encode_responsive_webp(image_file, self.RESPONSIVE_WIDTHS, self.SMALL_SIZE)
+        self.width, self.height, self.dominant_color = encoded['width'], encoded['height'], encoded['dominant_color']
+        self.placeholder = encoded['placeholder']
+        # Remembered until apply_upload pairs each width with its uploaded URL.
+        self._variant_heights = {f'{width}w': height for width, (buffer, height) in encoded['widths'].items()}
+
+        filename_without_extension = os.path.splitext(clean_filename)[0]
+        unique_suffix = str(uuid.uuid4())
+
+        files = {
+            'original': (f"books/{filename_without_extension}_{unique_suffix}.webp", encoded['original']),
+            'small': (f"books/{filename_without_extension}_small_{unique_suffix}.webp", encoded['small']),
+        }
+        for width, (buffer, height) in encoded['widths'].items():
+            files[f'{width}w'] = (f"books/{filename_without_extension}_{width}w_{unique_suffix}.webp", buffer)
+        return files
+
+    def apply_upload(self, urls):
+        self.image_url = urls['original']
+        self.image_small = urls['small']
+        self.variants = sorted(
+            ({'width': int(key[:-1]), 'height': height, 'url': urls[key]} for key, height in self._variant_heights.items()),
+            key=lambda variant: variant['width'],
+        )
+
+    def store_upload(self, image_file, filename):
+        """
+        Reuses the stored variants of identical content, otherwise encodes and
+        uploads every variant, raising UploadError if any upload fails.
+        """
+        spool, sha256 = spool_upload(image_file)
+        with spool:
+            stored = StoredImage.objects.acquire(sha256, StoredImage.BOOK)
+            if stored is None:
+                [(urls, error)] = upload_files([self.prepare_upload(spool, filename)])
+                if error:
+                    raise error
+                self.apply_upload(urls)
+                stored = StoredImage.objects.register(sha256, StoredImage.BOOK, self)
+        stored.copy_to(self)
+
     def save(self, *args, **kwargs):
         image_file = kwargs.pop('image_file', None)
         if image_file:
-            clean_filename = self.clean_filename(image_file.name)
-            temp_image_path = f"/tmp/{clean_filename}"
-            temp_small_image_path = f"/tmp/{clean_filename}_small.webp"
-
-            try:
-                with open(temp_image_path, 'wb') as temp_image:
-                    temp_image.write(image_file.read())
-
-                webp_image_path = f"{temp_image_path}.webp"
-                convert_to_webp(temp_image_path, webp_image_path)
-
-                create_small_image(temp_image_path, temp_small_image_path)
-
-                s3_storage = S3Boto3Storage()
+            self.store_upload(image_file, image_file.name)
 
-                filename_without_extension = os.path.splitext(clean_filename)[0]
-                unique_suffix = str(uuid.uuid4())
-
-                s3_filename = f"books/{filename_without_extension}_{unique_suffix}.webp"
-                s3_small_filename = f"books/{filename_without_extension}_small_{unique_suffix}.webp"
-                
-                with open(webp_image_path, 'rb') as webp_file:
-                    saved_path = s3_storage.save(s3_filename, webp_file)
-                    self.image_url = f'{settings.MEDIA_URL}{s3_filename}'
-
-                with open(temp_small_image_path, 'rb') as small_webp_file:
-                    small_saved_path = s3_storage.save(s3_small_filename, small_webp_file)
-                    self.image_small = f'{settings.MEDIA_URL}{s3_small_filename}'
+        super(BookImage, self).save(*args, **kwargs)
 
-            except Exception as e:
-                print(f"Error while uploading image to S3: {str(e)}")
 
-            finally:
-                if os.path.exists(temp_image_path):
-                    os.remove(temp_image_path)
-                if os.path.exists(webp_image_path):
-                    os.remove(webp_image_path)
-                if os.path.exists(temp_small_image_path):
-                    os.remove(temp_small_image_path)
+class ImageJob(models.Model):
+    """
+    A queued upload waiting for process_images. The original bytes live in the
+    row itself so any worker host can pick the job up without shared storage.
+    """
+    image = models.OneToOneField(BookImage, related_name="job", on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    sha256 = models.CharField(max_length=64)
+    data = models.BinaryField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
 
-        super(BookImage, self).save(*args, **kwargs)
+    def __str__(self):
+        return f"Image job {self.pk} for {self.filename}"
 
 
 class BookRental(models.Model):
@@ -159,10 +325,35 @@ class BookRental(models.Model):
     reserved = models.BooleanField(default=True)
     is_active = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['book', '-rental_date', '-id'], name='bookrental_book_date_idx'),
+            models.Index(fields=['user', '-rental_date', '-id'], name='bookrental_user_date_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so the availability signals can move the book ledger from the stored state.
+        # With either flag deferred, pre_save reads the row instead of loading it here per rental.
+        if {'reserved', 'is_active'} <= instance.__dict__.keys():
+            instance._stored_commitment = instance.commitment
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.due_date:
             self.due_date = self.rental_date + timezone.timedelta(days=7)
-        super(BookRental, self).save(*args, **kwargs)
+        with transaction.atomic():
+            super(BookRental, self).save(*args, **kwargs)
+
+    @property
+    def commitment(self):
+        """Copies this rental keeps off the shelf, matching how availability has always been counted."""
+        return int(bool(self.reserved)) + int(bool(self.is_active))
+
+    def mark_copy_claimed(self):
+        """Records that the book's ledger already counts this rental's commitment, so saving moves it only by later changes."""
+        self._stored_commitment = self.commitment
 
     @property
     def late(self):
@@ -178,6 +369,17 @@ class BookHold(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, limit_choices_to={'is_staff': True})
     hold_date = models.DateTimeField(default=timezone.now)
 
+    # A hold keeps one copy off the shelf for as long as it exists.
+    commitment = 1
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super(BookHold, self).save(*args, **kwargs)
+
+    def mark_copy_claimed(self):
+        """Records that the book's ledger already counts this hold, so creating it leaves the ledger alone."""
+        self._stored_commitment = self.commitment
+
     def __str__(self):
         return f"{self.book.title} held by {self.user.first_name} on {self.hold_date} (email: {self.user.email})"
 
@@ -187,5 +389,10 @@ class Review(models.Model):
     message = models.TextField(max_length=500)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='review_created_at_id_idx'),
+        ]
+
     def __str__(self):
         return f"Review by {self.name}"
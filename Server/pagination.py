@@ -0,0 +1,26 @@
+from rest_framework.pagination import PageNumberPagination
+from Common.pagination import KeysetPagination
+
+
+class BookCursorPagination(KeysetPagination):
+    ordering = ('-created_date', '-id')
+
+
+class ReviewCursorPagination(KeysetPagination):
+    ordering = ('-created_at', '-id')
+
+
+class CategoryCursorPagination(KeysetPagination):
+    ordering = ('sort_order', 'id')
+
+
+class RentalHistoryPagination(KeysetPagination):
+    ordering = ('-rental_date', '-id')
+    page_size = 20
+    always_paginate = True
+
+
+class BookSearchPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -0,0 +1,139 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import status
+from Accounts.models import Membership
+from .models import Book, BookHold, BookRental
+
+MONTHLY_BOOK_LIMIT = 4
+RENTAL_PERIOD = timezone.timedelta(days=7)
+
+
+class ReservationError(Exception):
+    """A refused transition, with the HTTP status the endpoints answer it with."""
+
+    def __init__(self, message, status=status.HTTP_400_BAD_REQUEST):
+        super().__init__(message)
+        self.status = status
+
+
+def claim_copy(book):
+    """
+    Takes one copy of `book` off the shelf with a conditional UPDATE, so two
+    concurrent claims on the last copy cannot both succeed. The updated row
+    stays locked until the transaction ends, serialising every other claim on
+    the same book behind this one.
+    """
+    if not Book.objects.filter(pk=book.pk, available__gt=0).adjust_committed(1):
+        raise ReservationError(f"No available copies for {book.title}")
+
+
+def reserve_book(book, user):
+    """
+    Reserves a copy of `book` for `user`. Returns (rental, membership) with the
+    membership's monthly_books as stored after the increment.
+
+    The membership row is claimed first: its conditional increment locks it, so
+    a user's concurrent reservations run one at a time and each sees the rental
+    the previous one created.
+    """
+    if book.available <= 0:
+        # Cheap early answer from the row already loaded; claim_copy() is the authoritative check.
+        raise ReservationError(f"No available copies for {book.title}")
+
+    with transaction.atomic():
+        membership = user.memberships.filter(active=True).first()
+        if not membership:
+            raise ReservationError("User does not have an active membership", status.HTTP_403_FORBIDDEN)
+
+        claimed = Membership.objects.filter(pk=membership.pk, monthly_books__lt=MONTHLY_BOOK_LIMIT).update(monthly_books=F('monthly_books') + 1)
+        if not claimed:
+            raise ReservationError(f"You have reached your limit of {MONTHLY_BOOK_LIMIT} books for this month", status.HTTP_403_FORBIDDEN)
+
+        if BookRental.objects.filter(user=user, return_date__isnull=True).exists():
+            raise ReservationError("You already have an active rental", status.HTTP_403_FORBIDDEN)
+
+        claim_copy(book)
+        now = timezone.now()
+        rental = BookRental(book=book, user=user, rental_date=now, due_date=now + RENTAL_PERIOD, reserved=True)
+        rental.mark_copy_claimed()
+        rental.save()
+
+    membership.refresh_from_db(fields=['monthly_books'])
+    return rental, membership
+
+
+def cancel_reservation(book, user):
+    """Cancels `user`'s reservation of `book`. Returns (rental_id, membership), the membership None when inactive."""
+    with transaction.atomic():
+        reservation = BookRental.objects.select_for_update().filter(book=book, user=user, reserved=True, is_active=False).first()
+        if not reservation:
+            raise ReservationError("No matching reservation found for this book.", status.HTTP_404_NOT_FOUND)
+
+        membership = user.memberships.filter(active=True).first()
+        if membership:
+            Membership.objects.filter(pk=membership.pk).update(monthly_books=F('monthly_books') - 1)
+
+        reservation_id = reservation.id
+        reservation.delete()
+
+    if membership:
+        membership.refresh_from_db(fields=['monthly_books'])
+    return reservation_id, membership
+
+
+def activate_rental(user):
+    """Turns `user`'s reservation into an active rental once the book is picked up."""
+    with transaction.atomic():
+        try:
+            rental = BookRental.objects.select_for_update().get(user=user, reserved=True)
+        except BookRental.DoesNotExist:
+            raise ReservationError("No reserved rental found for this user or already activated.", status.HTTP_404_NOT_FOUND)
+
+        rental.reserved = False
+        rental.is_active = True
+        rental.save()
+    return rental
+
+
+def return_book(user):
+    """
+    Closes `user`'s open rental. The row is locked before it is read, so two
+    concurrent returns cannot both release the copy.
+    """
+    with transaction.atomic():
+        rental = BookRental.objects.select_for_update().filter(user=user, return_date__isnull=True).first()
+        if not rental:
+            raise ReservationError("No active rental found for this user")
+
+        rental.return_date = timezone.now()
+        rental.reserved = False
+        rental.is_active = False
+        rental.save()
+    return rental
+
+
+def place_hold(book, user):
+    """Holds a copy of `book` for staff. A book carries at most one hold."""
+    with transaction.atomic():
+        claim_copy(book)
+        # The claim locked the book row, so a concurrent hold on it has committed by now and is visible here.
+        if book.holds.filter(hold_date__isnull=False).exists():
+            raise ReservationError(f"Book '{book.title}' is already on hold")
+
+        hold = BookHold(book=book, user=user, hold_date=timezone.now())
+        hold.mark_copy_claimed()
+        hold.save()
+    return hold
+
+
+def remove_hold(book):
+    """Lifts the hold on `book` and returns its id."""
+    with transaction.atomic():
+        hold = book.holds.select_for_update().filter(hold_date__isnull=False).first()
+        if not hold:
+            raise ReservationError(f"No active hold found for {book.title}")
+
+        hold_id = hold.id
+        hold.delete()
+    return hold_id
@@ -1,18 +1,33 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Bookmark, Category, Book, BookRating, BookImage, BookRental, Review
+from .models import Bookmark, Category, Book, BookRating, BookImage, BookRental, BookHold, Review
 from Accounts.models import CustomUser
 from Common.serializers import UserImageSerializer
-from django.db.models import Avg
+from Common.uploads import UploadRejected, check_image_upload
 
 
 class BookImageSerializer(serializers.ModelSerializer):
     image_file = serializers.ImageField(write_only=True, required=False)
     id = serializers.ReadOnlyField()
+    srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = BookImage
-        fields = ['id', 'image_url', 'image_small', 'image_file']
-        read_only_fields = ['id', 'image_url', 'image_small']
+        fields = ['id', 'image_url', 'image_small', 'placeholder', 'status', 'width', 'height', 'dominant_color', 'srcset', 'image_file']
+        read_only_fields = ['id', 'image_url', 'image_small', 'placeholder', 'status', 'width', 'height', 'dominant_color']
+
+    def validate_image_file(self, value):
+        try:
+            check_image_upload(value)
+        except UploadRejected as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+    def get_srcset(self, obj):
+        """Every encoded width, narrowest first, ending with the original; images from before variants list only the original."""
+        if not obj.image_url:
+            return []
+        return obj.variants + [{'width': obj.width, 'height': obj.height, 'url': obj.image_url}]
 
 
 class UserRentalSerializer(serializers.ModelSerializer):
@@ -78,6 +93,8 @@ class CategorySerializer(serializers.ModelSerializer):
         read_only_fields = ['sort_order', 'quantity']
 
     def get_quantity(self, obj):
+        if hasattr(obj, 'book_count'):
+            return obj.book_count
         return obj.books.count()
 
     def validate_name(self, value):
@@ -138,8 +155,7 @@ class BookSerializer(serializers.ModelSerializer):
         return obj.holds.filter(hold_date__isnull=False).exists()
 
     def get_rating(self, obj):
-        average = obj.ratings.aggregate(average=Avg('rating'))['average']
-        return average if average is not None else None
+        return obj.rating
 
     def create(self, validated_data):
         images_data = validated_data.pop('images', [])
@@ -155,21 +171,59 @@ class BookSerializer(serializers.ModelSerializer):
         return book
 
 
+class BookCatalogSerializer(BookSerializer):
+    """Reads hold state from the annotation added by Book.objects.with_catalog_data()."""
+
+    def get_on_hold(self, obj):
+        if hasattr(obj, 'has_active_hold'):
+            return obj.has_active_hold
+        return super().get_on_hold(obj)
+
+
+class BookAvailabilitySerializer(serializers.ModelSerializer):
+    on_hold = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Book
+        fields = ['id', 'inventory', 'available', 'on_hold']
+
+    def get_on_hold(self, obj):
+        return obj.holds.filter(hold_date__isnull=False).exists()
+
+
+class RentalDeltaSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BookRental
+        fields = ['id', 'book', 'rental_date', 'due_date', 'return_date', 'reserved', 'is_active', 'late']
+
+
+class HoldDeltaSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BookHold
+        fields = ['id', 'book', 'hold_date']
+
+
 class BookDetailSerializer(BookSerializer):
     checked_out = serializers.SerializerMethodField()
     rental_history = serializers.SerializerMethodField()
+    rental_history_count = serializers.SerializerMethodField()
+    rating_histogram = serializers.ReadOnlyField()
 
     class Meta:
         model = Book
-        fields = BookSerializer.Meta.fields + ['checked_out', 'rental_history']
+        fields = BookSerializer.Meta.fields + ['rating_count', 'rating_histogram', 'checked_out', 'rental_history', 'rental_history_count']
 
     def get_checked_out(self, obj):
         active_rentals = obj.rentals.filter(return_date__isnull=True)
         return CurrentRentalSerializer(active_rentals, many=True).data
 
     def get_rental_history(self, obj):
-        rental_history = obj.rentals.all().order_by('-rental_date')
-        return RentalHistorySerializer(rental_history, many=True).data
+        """The most recent rentals only; the full history is paginated at books/<id>/rentals/."""
+        rental_history = obj.rentals.select_related('user__image').order_by('-rental_date', '-id')
+        return RentalHistorySerializer(rental_history[:settings.EMBEDDED_HISTORY_LIMIT], many=True).data
+
+    def get_rental_history_count(self, obj):
+        return obj.rentals.count()
 
 
 class ReviewSerializer(serializers.ModelSerializer):
@@ -1,12 +1,123 @@
-from django.db.models.signals import post_save, post_delete
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
-from django.db.models import Avg
-from .models import BookRating
+from Common.models import StoredImage
+from .cache import books_changed, invalidate_all_books, invalidate_books
+from .events import publish_availability
+from .models import Book, BookHold, BookImage, BookRating, BookRental, Category, BOOK_SEARCH_FIELDS, book_search_vector
 
+@receiver(pre_save, sender=BookRating)
+def remember_stored_rating(sender, instance, raw, **kwargs):
+    if raw or instance.pk is None or hasattr(instance, '_stored_rating'):
+        return
+    # Saved without its rating loaded, e.g. BookRating(pk=...).save(): read the rating the counters hold.
+    instance._stored_rating = BookRating.objects.filter(pk=instance.pk).values_list('rating', flat=True).first()
+
+
+@receiver(post_save, sender=BookRating)
+def update_book_rating(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    old_rating = None if created else instance._stored_rating
+    Book.objects.filter(pk=instance.book_id).apply_rating_change(old_rating, instance.rating)
+    instance._stored_rating = instance.rating
+
+
+@receiver(post_delete, sender=BookRating)
+def remove_book_rating(sender, instance, **kwargs):
+    old_rating = getattr(instance, '_stored_rating', instance.rating)
+    Book.objects.filter(pk=instance.book_id).apply_rating_change(old_rating, None)
+
+
+@receiver(post_save, sender=Book)
+def update_book_search_vector(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not BOOK_SEARCH_FIELDS.intersection(update_fields):
+        return
+    Book.objects.filter(pk=instance.pk).update(search_vector=book_search_vector())
+
+
+@receiver(pre_save, sender=BookRental)
+def remember_rental_commitment(sender, instance, raw, **kwargs):
+    if raw or instance.pk is None or hasattr(instance, '_stored_commitment'):
+        return
+    # Saved without being loaded whole, e.g. BookRental(pk=...).save(): the row still holds what it commits.
+    stored = BookRental.objects.filter(pk=instance.pk).values('reserved', 'is_active').first()
+    instance._stored_commitment = int(stored['reserved']) + int(stored['is_active']) if stored else 0
+
+
+@receiver(post_save, sender=BookRental)
+def update_rental_availability(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    # New rentals count from zero unless mark_copy_claimed() says the reservation service already claimed them.
+    stored_commitment = getattr(instance, '_stored_commitment', 0) if created else instance._stored_commitment
+    Book.objects.filter(pk=instance.book_id).adjust_committed(instance.commitment - stored_commitment)
+    instance.mark_copy_claimed()
+
+
+@receiver(post_delete, sender=BookRental)
+def release_rental_availability(sender, instance, **kwargs):
+    stored_commitment = getattr(instance, '_stored_commitment', instance.commitment)
+    Book.objects.filter(pk=instance.book_id).adjust_committed(-stored_commitment)
+
+
+@receiver(post_save, sender=BookHold)
+def update_hold_availability(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        Book.objects.filter(pk=instance.book_id).adjust_committed(instance.commitment - getattr(instance, '_stored_commitment', 0))
+        instance.mark_copy_claimed()
+
+
+@receiver(post_delete, sender=BookHold)
+def release_hold_availability(sender, instance, **kwargs):
+    Book.objects.filter(pk=instance.book_id).adjust_committed(-1)
+
+
+@receiver(post_delete, sender=BookImage)
+def release_stored_book_image(sender, instance, **kwargs):
+    if instance.stored_id:
+        StoredImage.objects.release(instance.stored_id)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_book_payload(sender, instance, **kwargs):
+    invalidate_books([instance.pk])
+
+
+@receiver(post_save, sender=BookImage)
+@receiver(post_delete, sender=BookImage)
 @receiver(post_save, sender=BookRating)
 @receiver(post_delete, sender=BookRating)
-def update_book_rating(sender, instance, **kwargs):
-    book = instance.book
-    avg_rating = book.ratings.aggregate(average=Avg('rating'))['average']
-    book.rating = avg_rating if avg_rating is not None else None
-    book.save()
\ No newline at end of file
+@receiver(post_save, sender=BookHold)
+@receiver(post_delete, sender=BookHold)
+@receiver(post_save, sender=BookRental)
+@receiver(post_delete, sender=BookRental)
+def invalidate_related_book_payload(sender, instance, **kwargs):
+    invalidate_books([instance.book_id])
+
+
+@receiver(m2m_changed, sender=Book.categories.through)
+def invalidate_book_categories_payload(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        invalidate_books([instance.pk])
+    elif pk_set is None:
+        # category.books.clear() reports no ids; its books are already detached.
+        invalidate_all_books()
+    else:
+        invalidate_books(pk_set)
+
+
+@receiver(pre_delete, sender=Category)
+def invalidate_category_books_payload(sender, instance, **kwargs):
+    # Deleting a category drops its through rows without m2m_changed, so its books are looked up first.
+    invalidate_books(instance.books.values_list('pk', flat=True))
+
+
+@receiver(books_changed)
+def broadcast_book_availability(sender, book_ids, **kwargs):
+    if book_ids is None or book_ids:
+        # Read once the change commits, so subscribers never see a state that rolls back.
+        transaction.on_commit(lambda: publish_availability(book_ids))
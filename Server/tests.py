@@ -1,3 +1,850 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from Accounts.models import CustomUser, Membership, UserImage
+from Common.models import StoredImage
+from Common.storage import upload_files
+from Common.testing import LocalMediaMixin
+from Common.uploads import UploadRejected, spool_upload
+from .cache import book_payload_cache
+from .images import MAX_ATTEMPTS, claim_jobs, enqueue_book_image, process_image_batch
+from .models import Book, BookHold, BookImage, BookRating, BookRental, Category, ImageJob
+from .reservations import MONTHLY_BOOK_LIMIT, ReservationError, activate_rental, place_hold, remove_hold, reserve_book, return_book
+from .serializers import BookSerializer, BookCatalogSerializer, BookImageSerializer
 
-# Create your tests here.
+
+class BookListQueryCountTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name="Roman", description="Romans", color=1, icon=1, sort_order=1)
+        self.staff = CustomUser.objects.create_user(email="staff@example.com", password="pass", first_name="Staff", is_staff=True)
+        self.readers = [
+            CustomUser.objects.create_user(email=f"reader{i}@example.com", password="pass", first_name="Reader")
+            for i in range(3)
+        ]
+
+    def create_books(self, count):
+        offset = Book.objects.count()
+        for i in range(offset, offset + count):
+            book = Book.objects.create(title=f"Book {i}", author="Author", inventory=2)
+            book.categories.add(self.category)
+            BookImage.objects.create(book=book, image_url=f"https://example.com/{i}.webp")
+            for rating, reader in enumerate(self.readers, start=3):
+                BookRating.objects.create(book=book, user=reader, rating=rating)
+            if i % 2:
+                BookHold.objects.create(book=book, user=self.staff)
+
+    def count_list_queries(self, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('book-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_query_count_does_not_grow_with_books(self):
+        self.create_books(2)
+        small_catalog = self.count_list_queries()
+        self.create_books(8)
+        large_catalog = self.count_list_queries()
+
+        self.assertEqual(small_catalog, large_catalog)
+        self.assertEqual(self.count_list_queries(category_id=self.category.id), large_catalog)
+
+    def test_catalog_payload_matches_book_serializer(self):
+        self.create_books(4)
+        Book.objects.create(title="Unrated", author="Author")
+
+        books = Book.objects.order_by('id')
+        expected = BookSerializer(books, many=True).data
+        actual = BookCatalogSerializer(books.with_catalog_data(), many=True).data
+
+        self.assertEqual(expected, actual)
+
+
+class BookCursorPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name="Roman", description="Romans", color=1, icon=1, sort_order=1)
+        self.books = [Book.objects.create(title=f"Book {i}", author="Author") for i in range(5)]
+        for book in self.books[:4]:
+            book.categories.add(self.category)
+
+    def walk(self, url, params, link):
+        ids = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids.append([book['id'] for book in response.data['results']])
+            if not response.data[link]:
+                return ids
+            response = self.client.get(response.data[link])
+
+    def test_unpaginated_without_cursor(self):
+        response = self.client.get(reverse('book-list'))
+        self.assertEqual(len(response.data), 5)
+
+    def test_pages_forward_and_back(self):
+        expected = sorted((book.id for book in self.books), reverse=True)
+        pages = self.walk(reverse('book-list'), {'page_size': 2}, 'next')
+        self.assertEqual(pages, [expected[0:2], expected[2:4], expected[4:]])
+
+        response = self.client.get(reverse('book-list'), {'page_size': 2})
+        last_page = self.client.get(self.client.get(response.data['next']).data['next'])
+        back = self.walk(last_page.data['previous'], {}, 'previous')
+        self.assertEqual(back, [expected[2:4], expected[0:2]])
+
+    def test_cursor_seeks_with_a_row_comparison(self):
+        response = self.client.get(reverse('book-list'), {'page_size': 2})
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(response.data['next'])
+        self.assertTrue(any('("Server_book"."created_date", "Server_book"."id") < (' in query['sql'] for query in context.captured_queries))
+
+    def test_category_filter_is_kept_across_pages(self):
+        pages = self.walk(reverse('book-list'), {'page_size': 3, 'category_id': self.category.id}, 'next')
+        self.assertEqual(sum(len(page) for page in pages), 4)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('book-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class BookSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        Book.objects.create(title="Le Petit Prince", author="Antoine de Saint-Exupéry", description="Un aviateur rencontre un prince.")
+        Book.objects.create(title="The Little Prince", author="Antoine de Saint-Exupéry", language="English")
+        Book.objects.create(title="Prince Caspian", author="C. S. Lewis", language="English")
+        Book.objects.create(title="Madame Bovary", author="Gustave Flaubert", description="Une histoire de prince.", archived=True)
+        Book.objects.create(title="Le Rouge et le Noir", author="Stendhal", description="Julien rêve d'être un prince.")
+
+    def search(self, query):
+        response = self.client.get(reverse('book-search'), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [book['title'] for book in response.data['results']]
+
+    def test_ranks_title_matches_first(self):
+        titles = self.search("petit prince")
+        self.assertEqual(titles, ["Le Petit Prince"])
+
+        # Le Petit Prince also matches on its description; a description-only match comes last.
+        titles = self.search("prince")
+        self.assertEqual(titles, ["Le Petit Prince", "The Little Prince", "Prince Caspian", "Le Rouge et le Noir"])
+
+    def test_search_vector_follows_edits(self):
+        book = Book.objects.get(title="Prince Caspian")
+        book.title = "Voyage of the Dawn Treader"
+        book.save()
+        self.assertEqual(self.search("treader"), ["Voyage of the Dawn Treader"])
+
+    def test_trigram_fallback_for_typos(self):
+        self.assertEqual(self.search("Madam Bovary"), [])
+        self.assertIn("Le Petit Prince", self.search("petit prinse"))
+
+    def test_query_is_required(self):
+        response = self.client.get(reverse('book-search'))
+        self.assertEqual(response.status_code, 400)
+
+
+class RatingCounterTests(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title="Book", author="Author")
+        self.readers = [
+            CustomUser.objects.create_user(email=f"reader{i}@example.com", password="pass", first_name="Reader")
+            for i in range(3)
+        ]
+
+    def test_counters_follow_insert_update_and_delete(self):
+        ratings = [BookRating.objects.create(book=self.book, user=reader, rating=star) for reader, star in zip(self.readers, (5, 4, 4))]
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_sum, self.book.rating_count), (13, 3))
+        self.assertAlmostEqual(self.book.rating, 13 / 3)
+        self.assertEqual(self.book.rating_histogram, {1: 0, 2: 0, 3: 0, 4: 2, 5: 1})
+
+        rating = BookRating.objects.get(pk=ratings[0].pk)
+        rating.rating = 1
+        rating.save()
+        ratings[1].delete()
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_sum, self.book.rating_count, self.book.rating), (5, 2, 2.5))
+        self.assertEqual(self.book.rating_histogram, {1: 1, 2: 0, 3: 0, 4: 1, 5: 0})
+
+        BookRating.objects.filter(book=self.book).delete()
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_sum, self.book.rating_count, self.book.rating), (0, 0, None))
+
+    def test_saving_an_unloaded_rating_is_an_update(self):
+        rating = BookRating.objects.create(book=self.book, user=self.readers[0], rating=2)
+        BookRating(pk=rating.pk, book=self.book, user=self.readers[0], rating=5).save()
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_sum, self.book.rating_count), (5, 1))
+        self.assertEqual(self.book.rating_histogram, {1: 0, 2: 0, 3: 0, 4: 0, 5: 1})
+
+    def test_stale_book_save_keeps_counters(self):
+        stale = Book.objects.get(pk=self.book.pk)
+        BookRating.objects.create(book=self.book, user=self.readers[0], rating=3)
+        stale.title = "Renamed"
+        stale.save()
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.title, self.book.rating_count, self.book.rating), ("Renamed", 1, 3.0))
+
+    def test_rebuild_command_corrects_drift(self):
+        BookRating.objects.create(book=self.book, user=self.readers[0], rating=2)
+        Book.objects.filter(pk=self.book.pk).update(rating_sum=9, rating_count_2=0)
+
+        output = StringIO()
+        call_command('rebuild_rating_counters', stdout=output)
+        self.assertIn("rating_sum 9 -> 2", output.getvalue())
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_sum, self.book.rating_count_2), (2, 1))
+
+
+class AvailabilityLedgerTests(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title="Book", author="Author", inventory=3)
+        self.staff = CustomUser.objects.create_user(email="staff@example.com", password="pass", first_name="Staff", is_staff=True)
+        self.reader = CustomUser.objects.create_user(email="reader@example.com", password="pass", first_name="Reader")
+
+    def assertAvailability(self, available, committed):
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.available, self.book.committed_copies), (available, committed))
+
+    def test_transitions_adjust_availability(self):
+        self.assertAvailability(3, 0)
+        rental = BookRental.objects.create(book=self.book, user=self.reader, reserved=True)
+        hold = BookHold.objects.create(book=self.book, user=self.staff)
+        self.assertAvailability(1, 2)
+
+        rental = BookRental.objects.get(pk=rental.pk)
+        rental.reserved = False
+        rental.is_active = True
+        rental.save()
+        self.assertAvailability(1, 2)
+
+        rental.is_active = False
+        rental.save()
+        hold.delete()
+        self.assertAvailability(3, 0)
+
+    def test_saving_an_unloaded_rental_moves_the_ledger_from_the_stored_row(self):
+        rental = BookRental.objects.create(book=self.book, user=self.reader, reserved=True)
+        BookRental(pk=rental.pk, book=self.book, user=self.reader, rental_date=rental.rental_date, reserved=False, is_active=True).save()
+        self.assertAvailability(2, 1)
+        BookRental(pk=rental.pk, book=self.book, user=self.reader, rental_date=rental.rental_date, reserved=False).save()
+        self.assertAvailability(3, 0)
+
+    def test_deferred_loads_do_not_query_per_rental(self):
+        for _ in range(3):
+            BookRental.objects.create(book=self.book, user=self.reader, reserved=True, return_date=timezone.now())
+        with self.assertNumQueries(1):
+            list(BookRental.objects.only('id', 'book_id'))
+
+    def test_inventory_edits_and_plain_saves(self):
+        BookRental.objects.create(book=self.book, user=self.reader, reserved=True)
+        book = Book.objects.get(pk=self.book.pk)
+        book.inventory = 1
+        book.save()
+        self.assertAvailability(0, 1)
+
+        book = Book.objects.get(pk=self.book.pk)
+        book.title = "Renamed"
+        with CaptureQueriesContext(connection) as context:
+            book.save()
+        self.assertFalse(any('COUNT' in query['sql'] for query in context.captured_queries))
+        self.assertAvailability(0, 1)
+
+    def test_reconcile_command_reports_and_fixes_drift(self):
+        BookRental.objects.create(book=self.book, user=self.reader, reserved=True)
+        BookRental.objects.filter(book=self.book).update(is_active=True)
+
+        output = StringIO()
+        call_command('reconcile_availability', '--dry-run', stdout=output)
+        self.assertIn("committed 1 -> 2, available 2 -> 1", output.getvalue())
+        self.assertAvailability(2, 1)
+
+        call_command('reconcile_availability', stdout=StringIO())
+        self.assertAvailability(1, 2)
+
+
+class ResetAllBooksTests(TestCase):
+    def setUp(self):
+        self.reader = CustomUser.objects.create_user(email="reader@example.com", password="pass", first_name="Reader")
+        self.books = [Book.objects.create(title=f"Book {i}", author="Author", archived=bool(i % 2)) for i in range(4)]
+        for book in self.books[:3]:
+            BookRental.objects.create(book=book, user=self.reader, reserved=True)
+
+    def test_dry_run_rolls_back(self):
+        output = StringIO()
+        call_command('reset_all_books', '--dry-run', stdout=output)
+        self.assertIn("Would reset 3 rental(s), unarchive 2 book(s) and change availability on 3 book(s).", output.getvalue())
+        self.assertEqual(BookRental.objects.filter(reserved=True).count(), 3)
+        self.assertEqual(Book.objects.filter(available=0).count(), 3)
+
+    def test_reset_is_set_based(self):
+        self.books.extend(Book.objects.create(title=f"Extra {i}", author="Author") for i in range(10))
+        with CaptureQueriesContext(connection) as context:
+            call_command('reset_all_books', stdout=StringIO())
+        self.assertLessEqual(len(context.captured_queries), 6)
+
+        self.assertFalse(BookRental.objects.filter(reserved=True).exists())
+        self.assertFalse(Book.objects.filter(archived=True).exists())
+        self.assertFalse(Book.objects.exclude(available=1).exists())
+
+
+class CategoryReorderTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create_user(email="staff@example.com", password="pass", first_name="Staff", is_staff=True))
+
+    def create_categories(self, count):
+        offset = Category.objects.count()
+        categories = [
+            Category.objects.create(name=f"Cat {i}", description="Category", color=1, icon=1, sort_order=i)
+            for i in range(offset, offset + count)
+        ]
+        book = Book.objects.create(title=f"Book {offset}", author="Author")
+        book.categories.add(categories[0])
+        return categories
+
+    def reorder(self, order):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('category-reorder'), {'order': order}, format='json')
+        return response, len(context.captured_queries)
+
+    def test_reorder_query_count_is_constant(self):
+        categories = self.create_categories(3)
+        response, small = self.reorder([category.id for category in reversed(categories)])
+        self.assertEqual([category['id'] for category in response.data['categories']], [category.id for category in reversed(categories)])
+        self.assertEqual([category['quantity'] for category in response.data['categories']], [0, 0, 1])
+
+        categories += self.create_categories(12)
+        response, large = self.reorder([category.id for category in categories])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(small, large)
+
+    def test_unknown_id_changes_nothing(self):
+        categories = self.create_categories(2)
+        response, _ = self.reorder([categories[1].id, 999999])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Category.objects.get(pk=categories[1].pk).sort_order, categories[1].sort_order)
+
+
+class DeltaResponseTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.book = Book.objects.create(title="Book", author="Author", inventory=2)
+        self.reader = CustomUser.objects.create_user(email="reader@example.com", password="pass", first_name="Reader")
+        Membership.objects.create(user=self.reader)
+        self.client.force_authenticate(self.reader)
+
+    def test_reservation_delta(self):
+        url = reverse('book-reservation', kwargs={'book_id': self.book.id})
+        response = self.client.post(f"{url}?response=delta")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('user', response.data)
+        self.assertEqual(response.data['book'], {'id': self.book.id, 'inventory': 2, 'available': 1, 'on_hold': False})
+        self.assertTrue(response.data['rental']['reserved'])
+        self.assertEqual(response.data['membership'], {'monthly_books': 1})
+
+        url = reverse('cancel_reservation', kwargs={'book_id': self.book.id})
+        response = self.client.post(f"{url}?response=delta")
+        self.assertTrue(response.data['rental']['removed'])
+        self.assertEqual(response.data['book']['available'], 2)
+        self.assertEqual(response.data['membership'], {'monthly_books': 0})
+
+    def test_full_profile_is_the_default(self):
+        response = self.client.post(reverse('book-reservation', kwargs={'book_id': self.book.id}))
+        self.assertEqual(response.data['user']['email'], self.reader.email)
+        self.assertEqual(response.data['book']['title'], "Book")
+
+
+class ReservationServiceTests(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title="Book", author="Author", inventory=1)
+        self.staff = CustomUser.objects.create_user(email="staff@example.com", password="pass", first_name="Staff", is_staff=True)
+        self.reader = CustomUser.objects.create_user(email="reader@example.com", password="pass", first_name="Reader")
+        self.membership = Membership.objects.create(user=self.reader)
+
+    def assertAvailability(self, available, committed):
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.available, self.book.committed_copies), (available, committed))
+
+    def test_reserve_claims_the_copy_once(self):
+        rental, membership = reserve_book(self.book, self.reader)
+        self.assertEqual(membership.monthly_books, 1)
+        self.assertAvailability(0, 1)
+
+        activate_rental(self.reader)
+        self.assertAvailability(0, 1)
+        return_book(self.reader)
+        self.assertAvailability(1, 0)
+        with self.assertRaises(ReservationError):
+            return_book(self.reader)
+        self.assertAvailability(1, 0)
+
+    def test_refusals_roll_back_every_claim(self):
+        BookRental.objects.create(book=Book.objects.create(title="Other", author="Author"), user=self.reader, reserved=True)
+        with self.assertRaises(ReservationError) as refused:
+            reserve_book(self.book, self.reader)
+        self.assertEqual(refused.exception.status, 403)
+        self.membership.refresh_from_db()
+        self.assertEqual(self.membership.monthly_books, 0)
+        self.assertAvailability(1, 0)
+
+    def test_stale_availability_cannot_oversell(self):
+        stale = Book.objects.get(pk=self.book.pk)
+        place_hold(self.book, self.staff)
+        with self.assertRaises(ReservationError):
+            reserve_book(stale, self.reader)
+        self.membership.refresh_from_db()
+        self.assertEqual(self.membership.monthly_books, 0)
+
+        remove_hold(self.book)
+        self.assertAvailability(1, 0)
+
+    def test_monthly_limit(self):
+        Membership.objects.filter(pk=self.membership.pk).update(monthly_books=MONTHLY_BOOK_LIMIT)
+        with self.assertRaises(ReservationError) as refused:
+            reserve_book(self.book, self.reader)
+        self.assertIn(f"limit of {MONTHLY_BOOK_LIMIT} books", str(refused.exception))
+        self.assertAvailability(1, 0)
+
+
+class ReservationConcurrencyTests(TransactionTestCase):
+    def test_stress_benchmark_keeps_invariants(self):
+        output = StringIO()
+        call_command(
+            'benchmark_reservations', '--strategy', 'service', '--threads', '6', '--operations', '15',
+            '--copies', '2', '--readers', '8', stdout=output,
+        )
+        self.assertIn("invariants held", output.getvalue())
+        self.assertNotIn("database error", output.getvalue())
+        self.assertFalse(Book.objects.exists())
+
+
+@override_settings(AVAILABILITY_STREAM_HEARTBEAT=0.05)
+class AvailabilityStreamTests(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title="Book", author="Author", inventory=1)
+        self.other = Book.objects.create(title="Other", author="Author")
+        self.reader = CustomUser.objects.create_user(email="reader@example.com", password="pass", first_name="Reader")
+        Membership.objects.create(user=self.reader)
+
+    def commit(self, change):
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+
+    async def next_event(self, events):
+        chunk = await asyncio.wait_for(anext(events), 2)
+        return chunk.decode() if isinstance(chunk, bytes) else chunk
+
+    async def test_snapshot_then_changes(self):
+        response = await self.async_client.get(reverse('book-availability-stream'), {'ids': f'{self.book.id},{self.other.id}'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+        try:
+            self.assertEqual(await self.next_event(events), "retry: 3000\n\n")
+            snapshot = [json.loads((await self.next_event(events)).split("data: ", 1)[1]) for _ in range(2)]
+            self.assertIn({'id': self.book.id, 'inventory': 1, 'available': 1, 'on_hold': False, 'archived': False}, snapshot)
+
+            # A change that leaves availability alone sends nothing but the heartbeat.
+            await sync_to_async(self.commit)(lambda: Book.objects.filter(pk=self.book.pk).first().save())
+            self.assertEqual(await self.next_event(events), ": keep-alive\n\n")
+
+            await sync_to_async(self.commit)(lambda: reserve_book(Book.objects.get(pk=self.book.pk), self.reader))
+            event = await self.next_event(events)
+            while event.startswith(':'):
+                event = await self.next_event(events)
+            self.assertTrue(event.startswith("event: availability\n"))
+            self.assertEqual(json.loads(event.split("data: ", 1)[1]), {
+                'id': self.book.id, 'inventory': 1, 'available': 0, 'on_hold': False, 'archived': False,
+            })
+        finally:
+            await events.aclose()
+
+    async def test_rejects_bad_ids(self):
+        url = reverse('book-availability-stream')
+        self.assertEqual((await self.async_client.get(url)).status_code, 400)
+        self.assertEqual((await self.async_client.get(url, {'ids': '1,x'})).status_code, 400)
+        with self.settings(AVAILABILITY_STREAM_MAX_BOOKS=2):
+            self.assertEqual((await self.async_client.get(url, {'ids': '1,2,3'})).status_code, 400)
+
+
+@override_settings(EMBEDDED_HISTORY_LIMIT=3)
+class BookRentalHistoryTests(TestCase):
+    def setUp(self):
+        self.staff = CustomUser.objects.create_user(email="staff@example.com", password="pass", first_name="Staff", is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        self.book = Book.objects.create(title="Popular", author="Author", inventory=1)
+        now = timezone.now()
+        self.rentals = []
+        for i in range(7):
+            reader = CustomUser.objects.create_user(email=f"reader{i}@example.com", password="pass", first_name="Reader")
+            UserImage.objects.create(user=reader, image_url=f"https://example.com/u{i}.webp")
+            self.rentals.append(BookRental.objects.create(
+                book=self.book, user=reader, reserved=False,
+                rental_date=now - timedelta(days=30 - i), return_date=now - timedelta(days=29 - i),
+            ))
+
+    def test_detail_embeds_most_recent_rentals_with_total(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('book-full-detail', args=[self.book.id]))
+        self.assertEqual(response.data['rental_history_count'], 7)
+        self.assertEqual([rental['user']['email'] for rental in response.data['rental_history']], ["reader6@example.com", "reader5@example.com", "reader4@example.com"])
+        self.assertEqual(response.data['rental_history'][0]['user']['image']['image_url'], "https://example.com/u6.webp")
+        # No per-rental user or image lookups.
+        self.assertLess(len(context.captured_queries), 15)
+
+    def test_rentals_endpoint_pages_through_full_history(self):
+        url, emails = reverse('book-rental-history', args=[self.book.id]), []
+        params = {'page_size': 3}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            emails.extend(rental['user']['email'] for rental in response.data['results'])
+            url, params = response.data['next'], {}
+        self.assertEqual(emails, [f"reader{i}@example.com" for i in reversed(range(7))])
+
+    def test_rentals_endpoint_requires_existing_book_and_staff(self):
+        self.assertEqual(self.client.get(reverse('book-rental-history', args=[self.book.id + 100])).status_code, 404)
+        self.client.force_authenticate(CustomUser.objects.get(email="reader0@example.com"))
+        self.assertEqual(self.client.get(reverse('book-rental-history', args=[self.book.id])).status_code, 403)
+
+
+class BookPayloadCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.member = CustomUser.objects.create_user(email="member@example.com", password="pass", first_name="Member")
+        self.book = Book.objects.create(title="Cached", author="Author", inventory=2)
+        self.category = Category.objects.create(name="Cat", description="", color=1, icon=1, sort_order=1)
+        BookImage.objects.create(book=self.book, image_url="https://example.com/cover.webp")
+
+    def fetch(self):
+        return self.client.get(reverse('book-detail', args=[self.book.id]))
+
+    def test_hit_serves_payload_without_queries(self):
+        first = self.fetch()
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.fetch()
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.json(), first.json())
+
+    def test_changes_invalidate_after_commit(self):
+        changes = [
+            lambda: BookRating.objects.create(book=self.book, user=self.member, rating=4),
+            lambda: BookHold.objects.create(book=self.book, user=self.member),
+            lambda: self.book.categories.add(self.category),
+            lambda: self.category.delete(),
+            lambda: BookImage.objects.filter(book=self.book).get().delete(),
+            lambda: BookRental.objects.create(book=self.book, user=self.member, reserved=True),
+            lambda: Book.objects.filter(pk=self.book.pk).get().save(),
+        ]
+        for change in changes:
+            self.fetch()
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            response = self.fetch()
+            self.assertEqual(response['X-Cache'], 'MISS')
+            expected = JSONRenderer().render(BookSerializer(Book.objects.get(pk=self.book.pk)).data)
+            self.assertEqual(response.json(), json.loads(expected))
+
+    def test_archived_book_is_not_served_from_cache(self):
+        self.fetch()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.archived = True
+            self.book.save()
+        self.assertEqual(self.fetch().status_code, 404)
+
+    def test_unknown_ids_leave_no_tokens(self):
+        missing = self.book.id + 1000
+        self.assertEqual(self.client.get(reverse('book-detail', args=[missing])).status_code, 404)
+        self.assertIsNone(cache.get(book_payload_cache.key(missing, 'version')))
+        self.assertEqual(book_payload_cache.stats()['misses'], 0)
+
+    def test_burst_of_misses_builds_once(self):
+        builds, results = [], []
+
+        def build():
+            builds.append(1)
+            time.sleep(0.2)
+            return {'id': 'built'}
+
+        threads = [threading.Thread(target=lambda: results.append(book_payload_cache.get('burst', build))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(builds), 1)
+        self.assertEqual([payload for payload, hit in results], [{'id': 'built'}] * 8)
+        self.assertEqual(book_payload_cache.stats(), {'hits': 0, 'misses': 1, 'waits': 7})
+
+    def test_rebuild_racing_an_invalidation_is_not_served(self):
+        def build():
+            with self.captureOnCommitCallbacks(execute=True):
+                book_payload_cache.invalidate('race')
+            return {'version': 'stale'}
+
+        book_payload_cache.get('race', build)
+        payload, hit = book_payload_cache.get('race', lambda: {'version': 'fresh'})
+        self.assertEqual((payload, hit), ({'version': 'fresh'}, False))
+
+    def test_stats_endpoint_is_staff_only(self):
+        self.fetch()
+        self.fetch()
+        client = APIClient()
+        client.force_authenticate(self.member)
+        self.assertEqual(client.get(reverse('book-cache-stats')).status_code, 403)
+        client.force_authenticate(CustomUser.objects.create_user(email="staff@example.com", password="pass", first_name="Staff", is_staff=True))
+        self.assertEqual(client.get(reverse('book-cache-stats')).data, {'hits': 1, 'misses': 1, 'waits': 0, 'hit_rate': 0.5})
+
+
+class ImageJobLockingTests(LocalMediaMixin, TransactionTestCase):
+    def test_pending_image_can_be_deleted_while_its_batch_uploads(self):
+        self.use_local_media()
+        book = Book.objects.create(title="Removed", author="Author")
+        buffer = BytesIO()
+        Image.new('RGB', (60, 40), 'green').save(buffer, 'JPEG')
+        image = enqueue_book_image(book, SimpleUploadedFile("cover.jpg", buffer.getvalue()))
+        deleted = []
+
+        def delete_from_another_connection():
+            try:
+                with connection.cursor() as cursor:
+                    # Fails instead of waiting if the worker still held the job row.
+                    cursor.execute("SET lock_timeout = '2s'")
+                deleted.append(BookImage.objects.filter(pk=image.pk).delete()[0])
+            finally:
+                connection.close()
+
+        def upload_while_deleting(items):
+            thread = threading.Thread(target=delete_from_another_connection)
+            thread.start()
+            thread.join()
+            return upload_files(items)
+
+        with mock.patch('Server.images.upload_files', upload_while_deleting):
+            self.assertEqual(process_image_batch(), [])
+        self.assertEqual(deleted, [2])
+        self.assertFalse(ImageJob.objects.exists())
+        self.assertFalse(StoredImage.objects.exists())
+
+
+class BookImageEncodingTests(LocalMediaMixin, TestCase):
+    def setUp(self):
+        self.storage = self.use_local_media()
+        self.book = Book.objects.create(title="Cover", author="Author")
+
+    def upload(self, mode='RGB', size=(400, 300), fmt='JPEG', name="My Cover.jpg", color='red'):
+        buffer = BytesIO()
+        Image.new(mode, size, color).save(buffer, fmt)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def stored_image(self, url):
+        return Image.open(self.storage.open(url.split(settings.MEDIA_URL, 1)[1]))
+
+    def test_encodes_full_and_small_webp_in_memory(self):
+        image = BookImage(book=self.book)
+        image.save(image_file=self.upload())
+        self.assertRegex(image.image_url, r'books/my_cover_[0-9a-f-]+\.webp$')
+        with self.stored_image(image.image_url) as full, self.stored_image(image.image_small) as small:
+            self.assertEqual((full.format, full.size), ('WEBP', (400, 300)))
+            self.assertEqual((small.format, small.size), ('WEBP', (20, 15)))
+
+    def test_inlines_the_small_variant_as_placeholder(self):
+        image = BookImage(book=self.book)
+        image.save(image_file=self.upload())
+        prefix, encoded = image.placeholder.split(',', 1)
+        self.assertEqual(prefix, 'data:image/webp;base64')
+        with self.storage.open(image.image_small.split(settings.MEDIA_URL, 1)[1]) as small:
+            self.assertEqual(base64.b64decode(encoded), small.read())
+        self.assertLess(len(image.placeholder), 1000)
+        self.assertEqual(BookImageSerializer(image).data['placeholder'], image.placeholder)
+
+    def test_responsive_widths_and_metadata(self):
+        image = BookImage(book=self.book)
+        image.save(image_file=self.upload(size=(1000, 1500), fmt='PNG', color=(200, 30, 40)))
+        self.assertEqual((image.width, image.height, image.dominant_color), (1000, 1500, '#c81e28'))
+        self.assertEqual([(variant['width'], variant['height']) for variant in image.variants], [(160, 240), (320, 480), (640, 960)])
+        for variant in image.variants:
+            with self.stored_image(variant['url']) as stored:
+                self.assertEqual(stored.size, (variant['width'], variant['height']))
+
+        srcset = BookImageSerializer(image).data['srcset']
+        self.assertEqual([entry['width'] for entry in srcset], [160, 320, 640, 1000])
+        self.assertEqual(srcset[-1]['url'], image.image_url)
+
+    def test_keeps_transparency(self):
+        image = BookImage(book=self.book)
+        image.save(image_file=self.upload(mode='RGBA', fmt='PNG', name="cover.png", color=(255, 0, 0, 128)))
+        with self.stored_image(image.image_url) as full:
+            self.assertEqual(full.mode, 'RGBA')
+
+
+class ImageJobTests(LocalMediaMixin, TestCase):
+    def setUp(self):
+        self.storage = self.use_local_media('Common.testing.FlakyStorage')
+        self.staff = CustomUser.objects.create_user(email="staff@example.com", password="pass", first_name="Staff", is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def upload(self, name="cover.jpg"):
+        buffer = BytesIO()
+        Image.new('RGB', (120, 80), 'blue').save(buffer, 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def test_create_returns_pending_placeholders_then_worker_processes(self):
+        response = self.client.post(reverse('create-book'), {
+            'title': "Queued", 'author': "Author", 'categories': [], 'images': [self.upload(), self.upload("back.jpg")],
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([(image['status'], image['image_url']) for image in response.data['images']], [('pending', None)] * 2)
+        self.assertEqual(os.listdir(self.media_root), [])
+
+        call_command('process_images', '--once', stdout=StringIO())
+        book = Book.objects.get(title="Queued")
+        self.assertEqual({image.status for image in book.images.all()}, {BookImage.READY})
+        self.assertTrue(all(self.storage.exists(image.image_small.split(settings.MEDIA_URL, 1)[1]) for image in book.images.all()))
+        self.assertFalse(ImageJob.objects.exists())
+
+    def test_update_queues_new_images(self):
+        book = Book.objects.create(title="Existing", author="Author")
+        response = self.client.put(reverse('update-book', args=[book.id]), {
+            'title': "Existing", 'author': "Author", 'images': [self.upload()],
+        }, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['book']['images'][0]['status'], 'pending')
+        self.assertEqual(ImageJob.objects.filter(image__book=book).count(), 1)
+
+    def test_failed_jobs_are_retried_then_marked_failed(self):
+        book = Book.objects.create(title="Broken", author="Author")
+        self.client.put(reverse('update-book', args=[book.id]), {
+            'title': "Broken", 'author': "Author", 'images': [SimpleUploadedFile("bad.jpg", b"not an image")],
+        }, format='multipart')
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            [image] = process_image_batch()
+            self.assertEqual(image.job.attempts, attempt)
+            self.assertEqual(process_image_batch(), [])  # backing off
+            ImageJob.objects.update(run_after=timezone.now())
+        self.assertEqual(BookImage.objects.get(book=book).status, BookImage.FAILED)
+        self.assertIn("UnidentifiedImageError", ImageJob.objects.get().last_error)
+        self.assertEqual(process_image_batch(), [])
+
+    def test_upload_failures_are_reported_per_image(self):
+        book = Book.objects.create(title="Mixed", author="Author")
+        self.client.put(reverse('update-book', args=[book.id]), {
+            'title': "Mixed", 'author': "Author", 'images': [self.upload("good.jpg"), self.upload("flaky.jpg"), self.upload("fine.jpg")],
+        }, format='multipart')
+
+        images = process_image_batch()
+        self.assertEqual([image.status for image in images], [BookImage.READY, BookImage.PENDING, BookImage.READY])
+        self.assertIsNone(images[1].image_url)
+        self.assertIn("Uploading small failed: OSError: connection reset", images[1].job.last_error)
+
+    def test_identical_upload_reuses_stored_variants(self):
+        first = Book.objects.create(title="First", author="Author")
+        self.client.put(reverse('update-book', args=[first.id]), {
+            'title': "First", 'author': "Author", 'images': [self.upload()],
+        }, format='multipart')
+        [original] = process_image_batch()
+        uploaded = self.media_files()
+
+        second = Book.objects.create(title="Second", author="Author")
+        with mock.patch('Server.models.encode_responsive_webp') as encode:
+            response = self.client.put(reverse('update-book', args=[second.id]), {
+                'title': "Second", 'author': "Author", 'images': [self.upload("same.jpg")],
+            }, format='multipart')
+        encode.assert_not_called()
+        [image] = response.data['book']['images']
+        self.assertEqual((image['status'], image['image_url'], image['srcset']), ('ready', original.image_url, BookImageSerializer(original).data['srcset']))
+        self.assertFalse(ImageJob.objects.exists())
+        self.assertEqual(self.media_files(), uploaded)
+        self.assertEqual(StoredImage.objects.get().ref_count, 2)
+
+    def test_deleting_images_releases_their_reference(self):
+        books = [Book.objects.create(title=title, author="Author") for title in ("Kept", "Deleted")]
+        for book in books:
+            BookImage(book=book).save(image_file=self.upload())
+        stored = StoredImage.objects.get()
+        self.assertEqual(BookImage.objects.filter(stored=stored).count(), 2)
+
+        books[1].delete()
+        stored.refresh_from_db()
+        self.assertEqual((stored.ref_count, stored.released_at), (1, None))
+        books[0].images.get().delete()
+        stored.refresh_from_db()
+        self.assertEqual(stored.ref_count, 0)
+        self.assertEqual(list(StoredImage.objects.unreferenced(timezone.now() + timedelta(seconds=1))), [stored])
+        self.assertFalse(StoredImage.objects.unreferenced(stored.released_at).exists())
+
+    def test_claimed_jobs_are_leased_until_the_worker_finishes(self):
+        enqueue_book_image(Book.objects.create(title="Leased", author="Author"), self.upload())
+        [job] = claim_jobs(10)
+        self.assertEqual(process_image_batch(), [])  # another worker holds the lease
+
+        ImageJob.objects.update(run_after=timezone.now())
+        [image] = process_image_batch()
+        self.assertEqual(image.status, BookImage.READY)
+
+    @override_settings(MAX_IMAGE_UPLOAD_SIZE=256)
+    def test_oversized_upload_is_rejected_before_changes(self):
+        book = Book.objects.create(title="Limited", author="Author")
+        response = self.client.put(reverse('update-book', args=[book.id]), {
+            'title': "Renamed", 'author': "Author", 'images': [self.upload()],
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("larger than", response.data['detail'])
+        book.refresh_from_db()
+        self.assertEqual(book.title, "Limited")
+        self.assertFalse(BookImage.objects.exists())
+
+    @override_settings(MAX_IMAGE_PIXELS=5000)
+    def test_pixel_count_is_bounded_before_decode(self):
+        response = self.client.post(reverse('create-book'), {
+            'title': "Huge", 'author': "Author", 'categories': [], 'images': [self.upload()],
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("120x80", response.data['images'][0])
+        self.assertFalse(Book.objects.filter(title="Huge").exists())
+
+        # A job queued under a higher limit is refused by the worker before Pillow decodes it.
+        with override_settings(MAX_IMAGE_PIXELS=10000):
+            enqueue_book_image(Book.objects.create(title="Queued", author="Author"), self.upload())
+        with mock.patch('PIL.ImageFile.ImageFile.load') as load:
+            [image] = process_image_batch()
+        load.assert_not_called()
+        self.assertIn("UploadRejected", image.job.last_error)
+
+    @override_settings(MAX_IMAGE_UPLOAD_SIZE=100 * 1024)
+    def test_spooling_stops_reading_once_over_the_limit(self):
+        upload = self.upload()
+        read = []
+
+        def chunks():
+            for index in range(10):
+                read.append(index)
+                yield b'x' * 64 * 1024
+
+        with mock.patch.object(upload, 'chunks', chunks), self.assertRaises(UploadRejected):
+            spool_upload(upload)
+        self.assertEqual(len(read), 2)
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import BookmarkViewSet, BookRatingViewSet, CategoryViewSet, ReviewViewSet, BookListView, BookInfoView, BookDetailView, HoldBookView, BookReservationView, CancelReservationView, BookRentalActivateView, RemoveHoldView, ReturnBookView, BookCreateView, DeleteBookView, BookCategoryUpdateView, BookUpdateView, ToggleArchiveView, ArchivedBookListView, ResetAllBooksView
+from .views import BookmarkViewSet, BookRatingViewSet, CategoryViewSet, ReviewViewSet, BookListView, BookSearchView, BookInfoView, BookCacheStatsView, BookAvailabilityStreamView, BookDetailView, BookRentalHistoryView, HoldBookView, BookReservationView, CancelReservationView, BookRentalActivateView, RemoveHoldView, ReturnBookView, BookCreateView, DeleteBookView, BookCategoryUpdateView, BookUpdateView, ToggleArchiveView, ArchivedBookListView, ResetAllBooksView
 
 router = DefaultRouter()
 router.register(r'categories', CategoryViewSet, basename='category')
@@ -10,8 +10,12 @@ router.register(r'reviews', ReviewViewSet, basename='review')
 urlpatterns = [
     path('', include(router.urls)),
     path('books/', BookListView.as_view(), name='book-list'),
+    path('books/search/', BookSearchView.as_view(), name='book-search'),
+    path('books/cache-stats/', BookCacheStatsView.as_view(), name='book-cache-stats'),
+    path('books/availability/stream/', BookAvailabilityStreamView.as_view(), name='book-availability-stream'),
     path('books/<int:id>/', BookInfoView.as_view(), name='book-detail'),
     path('books/<int:id>/full/', BookDetailView.as_view(), name='book-full-detail'),
+    path('books/<int:id>/rentals/', BookRentalHistoryView.as_view(), name='book-rental-history'),
     path('books/<int:book_id>/hold/', HoldBookView.as_view(), name='hold-book'),
     path('books/<int:book_id>/reserve/', BookReservationView.as_view(), name='book-reservation'),
     path('books/<int:book_id>/cancel-reservation/', CancelReservationView.as_view(), name='cancel_reservation'),
@@ -3,18 +3,50 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
-from .models import Bookmark, Category, Book, BookRating, BookHold, BookRental, BookImage, Review
+from .models import Bookmark, Category, Book, BookRating, BookImage, Review
 from Accounts.models import CustomUser
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.exceptions import ValidationError, NotFound
-from django.utils import timezone
-from .serializers import CategorySerializer, BookSerializer, BookDetailSerializer, BookRatingSerializer, ReviewSerializer
+from django.conf import settings
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
+from django.db.models import Count
+from .serializers import CategorySerializer, BookSerializer, BookCatalogSerializer, BookDetailSerializer, BookRatingSerializer, RentalHistorySerializer, ReviewSerializer, BookAvailabilitySerializer, RentalDeltaSerializer, HoldDeltaSerializer
+from Accounts.profiles import load_user_profile
 from Accounts.serializers import UserInfoSerializer
+from .availability import reset_all_books
+from .reservations import ReservationError, activate_rental, cancel_reservation, place_hold, remove_hold, reserve_book, return_book
+from .cache import book_payload_cache
+from .events import availability_events
+from Common.uploads import UploadRejected, check_image_upload
+from .images import enqueue_book_image
+from .pagination import BookCursorPagination, BookSearchPagination, CategoryCursorPagination, RentalHistoryPagination, ReviewCursorPagination
 
 class IsStaffPermission(permissions.BasePermission):
     def has_permission(self, request, view):
         return request.user.is_authenticated and request.user.is_staff
 
+class MutationResponseMixin:
+    """
+    Reservation and hold endpoints answer with the book and the full user profile by default.
+    With `?response=delta` they return only the book's availability and the records that changed.
+    """
+
+    def mutation_response(self, detail, book, user, changes, **extra):
+        if self.request.query_params.get('response') == 'delta':
+            data = {"detail": detail, "book": BookAvailabilitySerializer(book).data, **changes}
+        else:
+            data = {"detail": detail, "book": BookSerializer(book).data, "user": UserInfoSerializer(load_user_profile(user)).data, **extra}
+        return Response(data, status=status.HTTP_200_OK)
+
+
+def membership_delta(membership):
+    if not membership:
+        return None
+    return {"monthly_books": membership.monthly_books}
+
+
 class BookmarkViewSet(viewsets.ModelViewSet):
     serializer_class = BookSerializer
     permission_classes = [IsAuthenticated]
@@ -112,9 +144,10 @@ class BookRatingViewSet(ModelViewSet):
 
 
 class CategoryViewSet(viewsets.ModelViewSet):
-    queryset = Category.objects.all()
+    queryset = Category.objects.annotate(book_count=Count('books'))
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticated, IsStaffPermission]
+    pagination_class = CategoryCursorPagination
 
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
@@ -157,15 +190,20 @@ class CategoryViewSet(viewsets.ModelViewSet):
         if not isinstance(order_data, list) or not all(isinstance(id, int) for id in order_data):
             return Response({"error": "Invalid order data format."}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            for sort_order, category_id in enumerate(order_data, start=1):
-                category = Category.objects.get(id=category_id)
-                category.sort_order = sort_order
-                category.save()
-        except Category.DoesNotExist:
+        categories = {category.id: category for category in self.get_queryset()}
+        if not set(order_data) <= categories.keys():
             return Response({"error": "One or more category IDs are invalid."}, status=status.HTTP_400_BAD_REQUEST)
 
-        ordered_categories = Category.objects.all().order_by('sort_order')
+        reordered = {}
+        for sort_order, category_id in enumerate(order_data, start=1):
+            category = categories[category_id]
+            category.sort_order = sort_order
+            reordered[category_id] = category
+
+        with transaction.atomic():
+            Category.objects.bulk_update(reordered.values(), ['sort_order'])
+
+        ordered_categories = sorted(categories.values(), key=lambda category: (category.sort_order, category.id))
         serializer = self.get_serializer(ordered_categories, many=True)
         return Response({
             "message": "Categories reordered successfully.",
@@ -176,6 +214,7 @@ class CategoryViewSet(viewsets.ModelViewSet):
 class ReviewViewSet(viewsets.ModelViewSet):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
+    pagination_class = ReviewCursorPagination
 
     def get_permissions(self):
         if self.action == 'list':
@@ -207,17 +246,35 @@ class BookCategoryUpdateView(generics.UpdateAPIView):
 
 
 class BookListView(generics.ListAPIView):
-    serializer_class = BookSerializer
+    serializer_class = BookCatalogSerializer
     permission_classes = []
+    pagination_class = BookCursorPagination
 
     def get_queryset(self):
-        queryset = Book.objects.filter(archived=False)
+        queryset = Book.objects.filter(archived=False).with_catalog_data()
         category_id = self.request.query_params.get('category_id', None)
         if category_id:
             queryset = queryset.filter(categories__id=category_id)
         return queryset
 
 
+class BookSearchView(generics.ListAPIView):
+    serializer_class = BookCatalogSerializer
+    permission_classes = []
+    pagination_class = BookSearchPagination
+
+    def get_queryset(self):
+        query = self.request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({"detail": "A search query is required."})
+
+        queryset = Book.objects.filter(archived=False)
+        category_id = self.request.query_params.get('category_id', None)
+        if category_id:
+            queryset = queryset.filter(categories__id=category_id)
+        return queryset.search(query).with_catalog_data()
+
+
 class BookDetailView(generics.RetrieveAPIView):
     queryset = Book.objects.all()
     serializer_class = BookDetailSerializer
@@ -225,14 +282,68 @@ class BookDetailView(generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated, IsStaffPermission]
 
 
+class BookRentalHistoryView(generics.ListAPIView):
+    serializer_class = RentalHistorySerializer
+    pagination_class = RentalHistoryPagination
+    permission_classes = [IsAuthenticated, IsStaffPermission]
+
+    def get_queryset(self):
+        book = generics.get_object_or_404(Book, id=self.kwargs['id'])
+        return book.rentals.select_related('user__image')
+
+
 class BookInfoView(generics.RetrieveAPIView):
+    """Serves the serialized book from book_payload_cache; X-Cache tells whether this response was a hit."""
     queryset = Book.objects.filter(archived=False)
     serializer_class = BookSerializer
     lookup_field = 'id'
     permission_classes = []
 
+    def retrieve(self, request, *args, **kwargs):
+        payload, hit = book_payload_cache.get(kwargs['id'], lambda: dict(self.get_serializer(self.get_object()).data))
+        return Response(payload, headers={'X-Cache': 'HIT' if hit else 'MISS'})
 
-class HoldBookView(generics.GenericAPIView):
+
+class BookCacheStatsView(APIView):
+    permission_classes = [IsAuthenticated, IsStaffPermission]
+
+    def get(self, request):
+        stats = book_payload_cache.stats()
+        lookups = stats['hits'] + stats['waits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['waits']) / lookups if lookups else None
+        return Response(stats)
+
+
+class BookAvailabilityStreamView(View):
+    """
+    Server-sent events for `?ids=1,2,3`: each book's inventory, available,
+    on_hold and archived now, then again whenever one of them changes. A plain
+    async Django view rather than DRF, so under ASGI an open stream costs a
+    coroutine instead of a worker thread.
+    """
+
+    async def get(self, request):
+        try:
+            book_ids = {int(value) for value in request.GET.get('ids', '').split(',') if value.strip()}
+        except ValueError:
+            return JsonResponse({"error": "ids must be comma-separated book ids"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not book_ids:
+            return JsonResponse({"error": "No book IDs provided"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(book_ids) > settings.AVAILABILITY_STREAM_MAX_BOOKS:
+            return JsonResponse(
+                {"error": f"At most {settings.AVAILABILITY_STREAM_MAX_BOOKS} books can be watched per stream"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        response = StreamingHttpResponse(availability_events(book_ids), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stops nginx-style proxies from buffering the stream.
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class HoldBookView(MutationResponseMixin, generics.GenericAPIView):
     permission_classes = [IsAuthenticated, IsStaffPermission]
 
     def post(self, request, *args, **kwargs):
@@ -245,33 +356,21 @@ class HoldBookView(generics.GenericAPIView):
         except Book.DoesNotExist:
             return Response({"error": "Book not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        if book.available <= 0:
-            return Response({"error": f"No available copies for {book.title}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            hold = place_hold(book, request.user)
+        except ReservationError as e:
+            return Response({"error": str(e)}, status=e.status)
 
-        active_holds = book.holds.filter(hold_date__isnull=False)
-        if active_holds.exists():
-            return Response({"error": f"Book '{book.title}' is already on hold"}, status=status.HTTP_400_BAD_REQUEST)
+        book.refresh_from_db()
 
-        BookHold.objects.create(
-            book=book,
-            user=request.user,
-            hold_date=timezone.now()
+        return self.mutation_response(
+            f"Book '{book.title}' has been placed on hold by {request.user.email}.",
+            book, request.user,
+            {"hold": HoldDeltaSerializer(hold).data},
         )
 
-        book.available -= 1
-        book.save()
-
-        book_data = BookSerializer(book).data
-        user_data = UserInfoSerializer(request.user).data
-
-        return Response({
-            "detail": f"Book '{book.title}' has been placed on hold by {request.user.email}.",
-            "book": book_data,
-            "user": user_data
-        }, status=status.HTTP_200_OK)
-
 
-class RemoveHoldView(generics.GenericAPIView):
+class RemoveHoldView(MutationResponseMixin, generics.GenericAPIView):
     permission_classes = [IsAuthenticated, IsStaffPermission]
 
     def post(self, request, *args, **kwargs):
@@ -284,26 +383,21 @@ class RemoveHoldView(generics.GenericAPIView):
         except Book.DoesNotExist:
             return Response({"error": "Book not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        hold = book.holds.filter(hold_date__isnull=False).first()
-
-        if not hold:
-            return Response({"error": f"No active hold found for {book.title}"}, status=status.HTTP_400_BAD_REQUEST)
-
-        hold.delete()
-
-        book.save()
+        try:
+            hold_id = remove_hold(book)
+        except ReservationError as e:
+            return Response({"error": str(e)}, status=e.status)
 
-        book_data = BookSerializer(book).data
-        user_data = UserInfoSerializer(request.user).data
+        book.refresh_from_db()
 
-        return Response({
-            "detail": f"Hold on book '{book.title}' removed successfully.",
-            "book": book_data,
-            "user": user_data
-        }, status=status.HTTP_200_OK)
+        return self.mutation_response(
+            f"Hold on book '{book.title}' removed successfully.",
+            book, request.user,
+            {"hold": {"id": hold_id, "removed": True}},
+        )
 
 
-class BookReservationView(generics.GenericAPIView):
+class BookReservationView(MutationResponseMixin, generics.GenericAPIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, *args, **kwargs):
@@ -316,43 +410,21 @@ class BookReservationView(generics.GenericAPIView):
         except Book.DoesNotExist:
             return Response({"error": "Book not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        if book.available <= 0:
-            return Response({"error": f"No available copies for {book.title}"}, status=status.HTTP_400_BAD_REQUEST)
-
-        active_membership = request.user.memberships.filter(active=True).first()
-        if not active_membership:
-            return Response({"error": "User does not have an active membership"}, status=status.HTTP_403_FORBIDDEN)
-
-        if active_membership.monthly_books >= 4:
-            return Response({"error": "You have reached your limit of 4 books for this month"}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            reservation, active_membership = reserve_book(book, request.user)
+        except ReservationError as e:
+            return Response({"error": str(e)}, status=e.status)
 
-        active_rentals = BookRental.objects.filter(user=request.user, return_date__isnull=True)
-        if active_rentals.exists():
-            return Response({"error": "You already have an active rental"}, status=status.HTTP_403_FORBIDDEN)
+        book.refresh_from_db()
 
-        reservation = BookRental.objects.create(
-            book=book,
-            user=request.user,
-            rental_date=timezone.now(),
-            due_date=timezone.now() + timezone.timedelta(days=7),
-            reserved=True
+        return self.mutation_response(
+            f"Book '{book.title}' rented successfully.",
+            book, request.user,
+            {"rental": RentalDeltaSerializer(reservation).data, "membership": membership_delta(active_membership)},
         )
 
-        book.save()
-        active_membership.monthly_books += 1
-        active_membership.save()
-
-        book_data = BookSerializer(book).data
-        user_data = UserInfoSerializer(request.user).data
-
-        return Response({
-            "detail": f"Book '{book.title}' rented successfully.",
-            "book": book_data,
-            "user": user_data
-        }, status=status.HTTP_200_OK)
-
 
-class CancelReservationView(APIView):
+class CancelReservationView(MutationResponseMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, book_id):
@@ -361,38 +433,22 @@ class CancelReservationView(APIView):
         except Book.DoesNotExist:
             return Response({"error": "Book not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        reservation = BookRental.objects.filter(
-            book=book,
-            user=request.user,
-            reserved=True,
-            is_active=False
-        ).first()
-
-        if not reservation:
-            return Response({"error": "No matching reservation found for this book."}, status=status.HTTP_404_NOT_FOUND)
-
-        active_membership = request.user.memberships.filter(active=True).first()
-        if active_membership:
-            active_membership.monthly_books -= 1
-            active_membership.save()
-
-        reservation.reserved = False
-        reservation.delete()
-
-        book.save()
+        try:
+            reservation_id, active_membership = cancel_reservation(book, request.user)
+        except ReservationError as e:
+            return Response({"error": str(e)}, status=e.status)
 
-        book_data = BookSerializer(book).data
-        user_data = UserInfoSerializer(request.user).data
+        book.refresh_from_db()
 
-        return Response({
-            "detail": f"Reservation for '{book.title}' has been canceled successfully.",
-            "book": book_data,
-            "user": user_data,
-            "monthly_books": active_membership.monthly_books
-        }, status=status.HTTP_200_OK)
+        return self.mutation_response(
+            f"Reservation for '{book.title}' has been canceled successfully.",
+            book, request.user,
+            {"rental": {"id": reservation_id, "removed": True}, "membership": membership_delta(active_membership)},
+            monthly_books=active_membership.monthly_books if active_membership else None,
+        )
 
 
-class BookRentalActivateView(generics.GenericAPIView):
+class BookRentalActivateView(MutationResponseMixin, generics.GenericAPIView):
     permission_classes = [IsAuthenticated, IsStaffPermission]
 
     def post(self, request, *args, **kwargs):
@@ -407,22 +463,15 @@ class BookRentalActivateView(generics.GenericAPIView):
             return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
 
         try:
-            rental = BookRental.objects.get(user=user, reserved=True)
-        except BookRental.DoesNotExist:
-            return Response({"error": "No reserved rental found for this user or already activated."}, status=status.HTTP_404_NOT_FOUND)
-
-        rental.reserved = False
-        rental.is_active = True
-        rental.save()
-
-        book_data = BookSerializer(rental.book).data
-        user_data = UserInfoSerializer(user).data
-
-        return Response({
-            "detail": f"Book '{rental.book.title}' rental activated successfully.",
-            "book": book_data,
-            "user": user_data
-        }, status=status.HTTP_200_OK)
+            rental = activate_rental(user)
+        except ReservationError as e:
+            return Response({"error": str(e)}, status=e.status)
+
+        return self.mutation_response(
+            f"Book '{rental.book.title}' rental activated successfully.",
+            rental.book, user,
+            {"rental": RentalDeltaSerializer(rental).data},
+        )
 
 
 class ReturnBookView(generics.GenericAPIView):
@@ -445,21 +494,12 @@ class ReturnBookView(generics.GenericAPIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        rental = BookRental.objects.filter(user=user, return_date__isnull=True).first()
-
-        if not rental:
-            return Response(
-                {"detail": "No active rental found for this user"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        rental.return_date = timezone.now()
-        rental.reserved = False
-        rental.is_active = False
-        rental.save()
+        try:
+            rental = return_book(user)
+        except ReservationError as e:
+            return Response({"detail": str(e)}, status=e.status)
 
         book = rental.book
-        book.save()
 
         return Response(
             {"detail": f"Book '{book.title}' returned successfully."},
@@ -474,16 +514,19 @@ class BookCreateView(generics.CreateAPIView):
 
     def perform_create(self, serializer):
         images_files = self.request.FILES.getlist('images')
+        try:
+            for image_file in images_files:
+                check_image_upload(image_file)
+        except UploadRejected as e:
+            raise ValidationError({"images": [str(e)]})
 
         try:
             book = serializer.save()
         except ValidationError as e:
             raise ValidationError({"detail": "A book with this title already exists."})
 
-        if images_files:
-            for image_file in images_files:
-                image_instance = BookImage(book=book)
-                image_instance.save(image_file=image_file)
+        for image_file in images_files:
+            enqueue_book_image(book, image_file)
 
         return Response({
             'message': 'Book created successfully',
@@ -520,6 +563,13 @@ class BookUpdateView(generics.UpdateAPIView):
         if not author:
             return Response({"detail": "Author cannot be empty."}, status=status.HTTP_400_BAD_REQUEST)
 
+        images_to_add = request.FILES.getlist('images')
+        try:
+            for image_file in images_to_add:
+                check_image_upload(image_file)
+        except UploadRejected as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         book.title = title
         book.author = author
         book.description = data.get('description', book.description)
@@ -565,10 +615,8 @@ class BookUpdateView(generics.UpdateAPIView):
 
         book.save()
 
-        images_to_add = request.FILES.getlist('images')
         for image_file in images_to_add:
-            image_instance = BookImage(book=book)
-            image_instance.save(image_file=image_file)
+            enqueue_book_image(book, image_file)
 
         images_to_remove = data.get('images_to_remove', [])
 
@@ -615,23 +663,18 @@ class ToggleArchiveView(APIView):
 
 
 class ArchivedBookListView(generics.ListAPIView):
-    serializer_class = BookSerializer
+    serializer_class = BookCatalogSerializer
     permission_classes = [IsAuthenticated, IsStaffPermission]
+    pagination_class = BookCursorPagination
 
     def get_queryset(self):
-        return Book.objects.filter(archived=True)
+        return Book.objects.filter(archived=True).with_catalog_data()
 
 
 class ResetAllBooksView(APIView):
     permission_classes = [IsAuthenticated, IsStaffPermission]
 
     def post(self, request, *args, **kwargs):
-        BookRental.objects.update(is_active=False, reserved=False)
-        
-        Book.objects.update(archived=False)
-        
-        for book in Book.objects.all():
-            book.update_available()
-            book.save()
+        reset_all_books()
 
         return Response({"detail": "All books and rentals have been reset successfully."}, status=status.HTTP_200_OK)